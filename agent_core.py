@@ -1,9 +1,208 @@
 import os
-import json
-import requests
-from typing import Optional
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Optional, Dict, List, Any, Tuple
 from openai import OpenAI
 
+import airtable_client
+import filter_ast
+import prompt_encoding
+import prompts
+import record_store
+import stats_context
+from airtable_client import AirtableAPIError
+from record_store import RecordStore, date_value, date_from_value
+from table_snapshot import projection
+
+
+# Tiempo máximo (segundos) para traer cada tabla antes de seguir sin ella
+TABLE_TIMEOUT = float(os.getenv("AGENT_TABLE_TIMEOUT", "20"))
+
+# Máximo de registros por tabla que se traen de Airtable cuando no hay copia local
+MAX_RECORDS = int(os.getenv("AGENT_MAX_RECORDS", "5000"))
+
+SUMMARY_HEADER = "=== {table}: RESUMEN CALCULADO POR EL SERVIDOR (usa estas cifras, no las recalcules) ==="
+SAMPLE_HEADER = (
+    "=== {table}: MUESTRA PARCIAL ({count} registros más recientes de Airtable; hay más). "
+    "Las cifras no son totales: dilo en la respuesta ==="
+)
+
+# Hilos para consultar las tablas en paralelo (compartidos por todas las peticiones)
+_prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="agent-prefetch")
+
+
+def _fetch_start(fecha_desde: Any, fecha_hasta: Any) -> Any:
+    """
+    Límite inferior de la consulta a Airtable: con desde y hasta se adelanta
+    una duración del periodo para tener también el periodo anterior
+    (stats_context.previous_rows).
+    """
+    after, before = date_value(fecha_desde), date_value(fecha_hasta)
+    if not after < before:
+        return fecha_desde
+    return date_from_value(after - (before - after)).strftime("%Y-%m-%d")
+
+
+def _period_params(table_name: str, fecha_desde: Any = None, fecha_hasta: Any = None) -> Dict[str, Any]:
+    """
+    Parámetros para traer de Airtable solo el periodo (filterByFormula sobre la
+    fecha de la tabla) con los campos que usa el agente, los más recientes primero.
+    """
+    filters = {}
+    if fecha_desde is not None:
+        filters["fecha_desde"] = _fetch_start(fecha_desde, fecha_hasta)
+    if fecha_hasta is not None:
+        filters["fecha_hasta"] = fecha_hasta
+    
+    # Solo los campos que usa el agente (sin adjuntos ni lookups)
+    params: Dict[str, Any] = {
+        "fields[]": projection(table_name),
+        "sort[0][field]": filter_ast.date_field(table_name),
+        "sort[0][direction]": "desc",
+    }
+    formula = filter_ast.compile_filters(filters, table_name).formula()
+    if formula:
+        params["filterByFormula"] = formula
+    return params
+
+
+def _fetch_table(
+    base_id: str,
+    api_key: str,
+    table_name: str,
+    max_records: int,
+    timeout: float,
+    fecha_desde: Any = None,
+    fecha_hasta: Any = None
+) -> List[Dict[str, Any]]:
+    """
+    Trae los registros del periodo de una tabla (forma de la API) siguiendo la
+    paginación, hasta max_records + 1 (uno de más para saber si se cortó).
+    Lanza excepción si falla o si las páginas no terminan antes del timeout.
+    """
+    deadline = time.monotonic() + timeout
+    records: List[Dict[str, Any]] = []
+    try:
+        for page in airtable_client.iter_record_pages(
+            base_id, api_key, table_name, _period_params(table_name, fecha_desde, fecha_hasta),
+            max_records=max_records + 1, timeout=timeout
+        ):
+            records.extend(page)
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"sin respuesta en {timeout:g}s")
+    except AirtableAPIError as e:
+        raise RuntimeError(f"Error {e.status_code}: {e.message}")
+    return records
+
+
+def _fetch_tables(
+    base_id: str,
+    api_key: str,
+    table_names: List[str],
+    max_records: int,
+    timeout: float = None,
+    fecha_desde: Any = None,
+    fecha_hasta: Any = None
+) -> Tuple[Dict[str, List[Dict[str, Any]]], Dict[str, str]]:
+    """
+    Consulta varias tablas a la vez, cada una con su timeout.
+    
+    Las latencias no se suman: el tiempo total es el de la tabla más lenta.
+    Una tabla que falla o no responde a tiempo queda vacía y su error se
+    devuelve aparte, sin afectar a las demás.
+    
+    Returns:
+        Tupla (registros por tabla, errores por tabla)
+    """
+    timeout = timeout or TABLE_TIMEOUT
+    futures = {
+        table_name: _prefetch_executor.submit(
+            _fetch_table, base_id, api_key, table_name, max_records, timeout, fecha_desde, fecha_hasta
+        )
+        for table_name in table_names
+    }
+    
+    # Todas arrancaron a la vez: el plazo de cada una cuenta desde aquí
+    deadline = time.monotonic() + timeout
+    tables = {}
+    errors = {}
+    for table_name, future in futures.items():
+        try:
+            tables[table_name] = future.result(timeout=max(0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            future.cancel()
+            tables[table_name] = []
+            errors[table_name] = f"sin respuesta en {timeout:g}s"
+        except Exception as e:
+            tables[table_name] = []
+            errors[table_name] = str(e)
+    
+    return tables, errors
+
+
+def _load_stores(
+    base_id: str,
+    api_key: str,
+    table_names: List[str],
+    max_records: int,
+    fecha_desde: Any = None,
+    fecha_hasta: Any = None
+) -> Tuple[Dict[str, Optional[RecordStore]], Dict[str, str], Dict[str, str], Dict[str, bool]]:
+    """
+    Almacén columnar de cada tabla: el de la copia local si está lista (todos
+    los registros, sin consultar Airtable) y, para las demás, uno armado con
+    los registros del periodo traídos de Airtable (todas las páginas, hasta
+    max_records; si hay más la tabla queda marcada como cortada).
+    
+    Returns:
+        Tupla (almacén por tabla o None si falló, errores por tabla, origen por
+        tabla, si los registros de Airtable se cortaron en max_records)
+    """
+    stores: Dict[str, Optional[RecordStore]] = {name: record_store.get_store(name) for name in table_names}
+    sources = {name: "mirror" for name, store in stores.items() if store is not None}
+    truncated = {name: False for name in table_names}
+    missing = [name for name, store in stores.items() if store is None]
+    errors: Dict[str, str] = {}
+    if missing:
+        tables, errors = _fetch_tables(base_id, api_key, missing, max_records, None, fecha_desde, fecha_hasta)
+        for table_name, records in tables.items():
+            if table_name not in errors:
+                stores[table_name] = RecordStore(table_name, records[:max_records])
+                sources[table_name] = "airtable"
+                truncated[table_name] = len(records) > max_records
+    return stores, errors, sources, truncated
+
+
+def _table_section(
+    table_name: str,
+    store: Optional[RecordStore],
+    error: Optional[str],
+    fecha_desde: Any = None,
+    fecha_hasta: Any = None,
+    source: str = "mirror",
+    truncated: bool = False
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Resúmenes de una tabla para el prompt (stats_context) con su encabezado,
+    o una nota si no se pudo consultar. Si los registros de Airtable se
+    cortaron, el encabezado los presenta como muestra parcial y no como totales.
+    
+    Returns:
+        Tupla (texto, metadatos: tokens y registros del periodo)
+    """
+    header = SUMMARY_HEADER.format(table=table_name.upper())
+    if error or store is None:
+        text = f"{header}\n(Tabla no disponible en este momento: {error}. Responde con la otra tabla e indícalo.)"
+        return text, {"tokens": prompt_encoding.count_tokens(text), "rows_in_period": 0, "rows_total": 0, "truncated": False}
+    
+    if truncated:
+        header = SAMPLE_HEADER.format(table=table_name.upper(), count=store.size)
+    text, metadata = stats_context.build_context(
+        store, fecha_desde, fecha_hasta, whole_table=source == "mirror", truncated=truncated
+    )
+    text = f"{header}\n{text}"
+    return text, dict(metadata, tokens=prompt_encoding.count_tokens(text))
+
 
 def run_agent(question: str, extra: Optional[dict] = None):
     """
@@ -11,7 +210,7 @@ def run_agent(question: str, extra: Optional[dict] = None):
     
     Args:
         question: Pregunta del usuario
-        extra: Datos adicionales opcionales (max_records, etc.)
+        extra: Datos adicionales opcionales (max_records sin copia local, fecha_desde, fecha_hasta)
     
     Returns:
         dict con 'success', 'response', 'error'
@@ -31,89 +230,34 @@ def run_agent(question: str, extra: Optional[dict] = None):
         return {"success": False, "error": "OPENAI_API_KEY no definida"}
     
     # Parámetros
-    max_records = (extra or {}).get("max_records", 100)
+    max_records = (extra or {}).get("max_records", MAX_RECORDS)
+    fecha_desde = (extra or {}).get("fecha_desde")
+    fecha_hasta = (extra or {}).get("fecha_hasta")
     
-    # Función auxiliar para consultar Airtable
-    def consultar_tabla(table_name, max_records):
-        url = f"https://api.airtable.com/v0/{base_id}/{table_name}"
-        params = {"maxRecords": max_records}
-        headers = {"Authorization": f"Bearer {api_key}"}
-        
-        response = requests.get(url, params=params, headers=headers)
-        
-        if response.status_code != 200:
-            return None, f"Error {response.status_code}: {response.text}"
-        
-        return response.json().get("records", []), None
-    
-    # Consultar Certificados
-    certificados_records, error = consultar_tabla("Certificados", max_records)
-    if error:
-        return {"success": False, "error": f"Certificados: {error}"}
-    
-    certificados = []
-    for record in certificados_records:
-        fields = record.get("fields", {})
-        certificados.append({
-            "tabla": "Certificados",
-            "pre_consecutivo": fields.get("pre_consecutivo", "N/A"),
-            "fechadevolucion": fields.get("fechadevolucion", "N/A"),
-            "nombrecoordinador": fields.get("nombrecoordinador", "N/A"),
-            "rigidos": fields.get("rigidos", 0),
-            "flexibles": fields.get("flexibles", 0),
-            "metalicos": fields.get("metalicos", 0),
-            "embalaje": fields.get("embalaje", 0),
-            "total": fields.get("total", 0),
-            "municipiogenerador": fields.get("municipiogenerador", "N/A"),
-            "municipiodevolucion": fields.get("municipiodevolucion", "N/A"),
-            "observaciones": fields.get("observaciones", "")
-        })
-    
-    # Consultar Kardex
-    kardex_records, error = consultar_tabla("Kardex", max_records)
-    if error:
-        return {"success": False, "error": f"Kardex: {error}"}
-    
-    kardex = []
-    for record in kardex_records:
-        fields = record.get("fields", {})
-        kardex.append({
-            "tabla": "Kardex",
-            "idkardex": fields.get("idkardex", "N/A"),
-            "fechakardex": fields.get("fechakardex", "N/A"),
-            "TipoMovimiento": fields.get("TipoMovimiento", "N/A"),
-            "coordinador": fields.get("Name (from Coordinador)", "N/A"),
-            "MunicipioOrigen": fields.get("MunicipioOrigen", "N/A"),
-            "Reciclaje": fields.get("Reciclaje", 0),
-            "Incineración": fields.get("Incineración", 0),
-            "PlasticoContaminado": fields.get("PlasticoContaminado", 0),
-            "Flexibles": fields.get("Flexibles", 0),
-            "Lonas": fields.get("Lonas", 0),
-            "Carton": fields.get("Carton", 0),
-            "Metal": fields.get("Metal", 0),
-            "Total": fields.get("Total", 0),
-            "CentrodeAcopio": fields.get("NombreCentrodeAcopio", "N/A"),
-            "gestor": fields.get("nombregestor", "N/A"),
-            "Observaciones": fields.get("Observaciones", "")
-        })
-    
-    # Leer system prompt
-    try:
-        with open('agent/system_prompt.txt', 'r', encoding='utf-8') as f:
-            system_prompt = f.read()
-    except FileNotFoundError:
+    # Copia local si está lista; si no, el periodo de ambas tablas en paralelo (si una falla se sigue con la otra)
+    stores, errors, sources, truncated = _load_stores(
+        base_id, api_key, ["Certificados", "Kardex"], max_records, fecha_desde, fecha_hasta
+    )
+    if len(errors) == len(stores):
+        return {"success": False, "error": "; ".join(f"{name}: {error}" for name, error in errors.items())}
+    
+    # System prompt (cargado al arrancar, prompts.BUSINESS_CONTEXT)
+    if not prompts.BUSINESS_CONTEXT:
         return {"success": False, "error": "agent/system_prompt.txt no encontrado"}
     
-    # Construir prompt
-    prompt = system_prompt + "\n\n"
-    prompt += f"El Director de Campolimpio pregunta: {question}\n\n"
-    prompt += "Tienes acceso a datos de AMBAS tablas:\n\n"
-    prompt += "=== TABLA CERTIFICADOS (últimos 100 registros) ===\n"
-    prompt += json.dumps(certificados, indent=2, ensure_ascii=False)
-    prompt += "\n\n=== TABLA KARDEX (últimos 100 registros) ===\n"
-    prompt += json.dumps(kardex, indent=2, ensure_ascii=False)
-    prompt += "\n\nPor favor, responde la pregunta del Director con análisis detallado basado en los datos proporcionados."
-    prompt += "\nIDENTIFICA AUTOMÁTICAMENTE qué tabla(s) necesitas usar según la pregunta."
+    # Construir prompt: prefijo fijo, resúmenes y al final la pregunta
+    certificados_text, certificados_context = _table_section(
+        "Certificados", stores["Certificados"], errors.get("Certificados"), fecha_desde, fecha_hasta,
+        sources.get("Certificados", "airtable"), truncated["Certificados"]
+    )
+    kardex_text, kardex_context = _table_section(
+        "Kardex", stores["Kardex"], errors.get("Kardex"), fecha_desde, fecha_hasta,
+        sources.get("Kardex", "airtable"), truncated["Kardex"]
+    )
+    data = certificados_text + "\n\n" + kardex_text
+    prompt = prompts.legacy_prompt(data, question)
+    
+    prompt_tokens = prompt_encoding.count_tokens(prompt)
     
     # Llamar a OpenAI
     try:
@@ -122,13 +266,23 @@ def run_agent(question: str, extra: Optional[dict] = None):
             model="gpt-5.1",
             input=prompt
         )
+        usage = prompts.record_usage(response)
         
         return {
             "success": True,
             "response": response.output_text,
             "metadata": {
-                "certificados_count": len(certificados),
-                "kardex_count": len(kardex)
+                "certificados_count": certificados_context["rows_in_period"],
+                "kardex_count": kardex_context["rows_in_period"],
+                "table_errors": errors,
+                "table_sources": sources,
+                "table_truncated": truncated,
+                "prompt_tokens": {
+                    "Certificados": certificados_context,
+                    "Kardex": kardex_context,
+                    "total": prompt_tokens
+                },
+                "usage": usage
             }
         }
     except Exception as e:
@@ -1,162 +1,114 @@
 import os
 import json
-import requests
-from typing import Optional, Tuple
-from openai import OpenAI
+import asyncio
+from typing import Optional, Tuple, List, Dict, Any, AsyncIterator
+from openai import OpenAI, AsyncOpenAI
 
+import prompts
+import response_cache
+import table_snapshot
+from airtable_client import AirtableAPIError
 from conversation_state import ConversationState, ConversationStatus
 
 
-def run_agent_with_context(
-    question: str,
-    state: ConversationState,
-    extra: Optional[dict] = None
-) -> Tuple[str, ConversationState]:
-    """
-    Ejecuta el agente con contexto de conversación.
-    
-    Args:
-        question: Pregunta del usuario
-        state: Estado actual de la conversación
-        extra: Datos adicionales opcionales (max_records, etc.)
-    
-    Returns:
-        Tupla (mensaje_para_usuario, state_actualizado)
-    """
-    # Configuración
-    api_key = os.getenv("AIRTABLE_API_KEY")
-    base_id = os.getenv("AIRTABLE_BASE_ID")
-    openai_key = os.getenv("OPENAI_API_KEY")
-    
-    if not api_key:
-        return "Error: Configuración de Airtable no disponible", state
-    
-    if not base_id:
-        return "Error: Base de datos no configurada", state
-    
-    if not openai_key:
-        return "Error: OpenAI no configurado", state
-    
-    # Parámetros
-    max_records = (extra or {}).get("max_records", 100)
-    
-    # Función auxiliar para consultar Airtable
-    def consultar_tabla(table_name, max_records):
-        url = f"https://api.airtable.com/v0/{base_id}/{table_name}"
-        params = {"maxRecords": max_records}
-        headers = {"Authorization": f"Bearer {api_key}"}
-        
-        response = requests.get(url, params=params, headers=headers)
-        
-        if response.status_code != 200:
-            return None, f"Error {response.status_code}: {response.text}"
-        
-        return response.json().get("records", []), None
-    
-    # Consultar Certificados
-    certificados_records, error = consultar_tabla("Certificados", max_records)
-    if error:
-        return f"Error consultando Certificados: {error}", state
-    
-    certificados = []
-    for record in certificados_records:
-        fields = record.get("fields", {})
-        certificados.append({
-            "tabla": "Certificados",
-            "pre_consecutivo": fields.get("pre_consecutivo", "N/A"),
-            "fechadevolucion": fields.get("fechadevolucion", "N/A"),
-            "nombrecoordinador": fields.get("nombrecoordinador", "N/A"),
-            "rigidos": fields.get("rigidos", 0),
-            "flexibles": fields.get("flexibles", 0),
-            "metalicos": fields.get("metalicos", 0),
-            "embalaje": fields.get("embalaje", 0),
-            "total": fields.get("total", 0),
-            "municipiogenerador": fields.get("municipiogenerador", "N/A"),
-            "municipiodevolucion": fields.get("municipiodevolucion", "N/A"),
-            "observaciones": fields.get("observaciones", "")
-        })
-    
-    # Consultar Kardex
-    kardex_records, error = consultar_tabla("Kardex", max_records)
-    if error:
-        return f"Error consultando Kardex: {error}", state
-    
-    kardex = []
-    for record in kardex_records:
-        fields = record.get("fields", {})
-        kardex.append({
-            "tabla": "Kardex",
-            "idkardex": fields.get("idkardex", "N/A"),
-            "fechakardex": fields.get("fechakardex", "N/A"),
-            "TipoMovimiento": fields.get("TipoMovimiento", "N/A"),
-            "coordinador": fields.get("Name (from Coordinador)", "N/A"),
-            "MunicipioOrigen": fields.get("MunicipioOrigen", "N/A"),
-            "Reciclaje": fields.get("Reciclaje", 0),
-            "Incineración": fields.get("Incineración", 0),
-            "PlasticoContaminado": fields.get("PlasticoContaminado", 0),
-            "Flexibles": fields.get("Flexibles", 0),
-            "Lonas": fields.get("Lonas", 0),
-            "Carton": fields.get("Carton", 0),
-            "Metal": fields.get("Metal", 0),
-            "Total": fields.get("Total", 0),
-            "CentrodeAcopio": fields.get("NombreCentrodeAcopio", "N/A"),
-            "gestor": fields.get("nombregestor", "N/A"),
-            "Observaciones": fields.get("Observaciones", "")
-        })
-    
-    # System message: instrucciones del asistente constructor de consultas
-    system_instructions = """Eres un asistente inteligente que ayuda a formular consultas a la base de datos de Campolimpio.
+# Modelo del agente conversacional (también forma parte de la clave de response_cache)
+AGENT_MODEL = "gpt-5.1"
+
+# Tablas cuyo conteo se incluye en el prompt
+AGENT_TABLES = ["Certificados", "Kardex"]
+
+# Cliente asíncrono de OpenAI compartido por el endpoint /ask (se crea al primer uso)
+_async_openai_client: Optional[AsyncOpenAI] = None
+
 
-TU TRABAJO NO ES SOLO RESPONDER, SINO:
+def get_async_openai_client() -> AsyncOpenAI:
+    """Devuelve el cliente AsyncOpenAI compartido del proceso"""
+    global _async_openai_client
+    if _async_openai_client is None:
+        _async_openai_client = AsyncOpenAI()
+    return _async_openai_client
 
-1. Interpretar lo que el usuario quiere consultar
-2. Detectar si la petición es ambigua, incompleta o imposible con los datos disponibles
-3. Construir y actualizar una consulta normalizada en el state_json
-4. Indicar el estado correcto: building, awaiting_clarification, ready_to_execute, executed o cancelled
 
-COMPORTAMIENTO EN CADA TURNO:
+async def close_async_openai_client():
+    """Cierra el cliente AsyncOpenAI compartido (al apagar el servidor)"""
+    global _async_openai_client
+    if _async_openai_client is not None:
+        await _async_openai_client.close()
+        _async_openai_client = None
 
-- Si la petición es AMBIGUA o FALTA INFORMACIÓN:
-  * Pregunta al usuario qué necesitas (periodo, coordinador, municipio, tipo de material, etc.)
-  * Actualiza state_json marcando qué falta (issues con tipo missing_filter)
-  * Marca status como awaiting_clarification
-  
-- Si el usuario pide algo IMPOSIBLE (campos inexistentes, cálculos no disponibles):
-  * Explica el problema de forma amable
-  * Propón alternativas basadas en los datos reales
-  * Marca un issue con tipo invalid_field o impossible_request
-  
-- Si la consulta está COMPLETA Y VÁLIDA:
-  * Marca status como ready_to_execute
-  * Asegúrate de que query.table, query.type y query.filters estén correctamente definidos
-  
-- Si el usuario CORRIGE algo:
-  * Ajusta el state_json en consecuencia
-  * Explica brevemente el cambio
 
-REGLAS CRÍTICAS:
+def _check_config() -> Optional[str]:
+    """Verifica las variables de entorno necesarias. Devuelve mensaje de error o None"""
+    if not os.getenv("AIRTABLE_API_KEY"):
+        return "Error: Configuración de Airtable no disponible"
+    
+    if not os.getenv("AIRTABLE_BASE_ID"):
+        return "Error: Base de datos no configurada"
+    
+    if not os.getenv("OPENAI_API_KEY"):
+        return "Error: OpenAI no configurado"
+    
+    return None
 
-✓ NUNCA inventes nombres de tablas o campos - usa SOLO los que existen en los datos
-✓ Usa ÚNICAMENTE estas tablas: "Certificados" (recolección) y "Kardex" (movimientos/disposición)
-✓ Mantén mensajes CORTOS y CLAROS, orientados a avanzar en la construcción de la consulta
-✓ Actualiza SIEMPRE el state_json de manera consistente en cada turno
 
-CAMPOS VÁLIDOS:
+def _table_error(table_name: str, error: Exception) -> str:
+    """Mensaje de error al consultar una tabla (mismo formato de siempre)"""
+    if isinstance(error, AirtableAPIError):
+        return f"Error consultando {table_name}: Error {error.status_code}: {error.message}"
+    return f"Error consultando {table_name}: {str(error)}"
 
-Tabla Certificados: pre_consecutivo, fechadevolucion, nombrecoordinador, rigidos, flexibles, metalicos, embalaje, total, municipiogenerador, municipiodevolucion, observaciones
 
-Tabla Kardex: idkardex, fechakardex, TipoMovimiento, coordinador, MunicipioOrigen, Reciclaje, Incineración, PlasticoContaminado, Flexibles, Lonas, Carton, Metal, Total, CentrodeAcopio, gestor, Observaciones"""
+def _load_counts(max_records: int) -> Tuple[Optional[Dict[str, str]], Optional[str]]:
+    """
+    Cuenta los registros de Certificados y Kardex para el prompt.
+    
+    Usa las instantáneas en caché de table_snapshot: en la mayoría de los
+    turnos no se llama a Airtable.
+    
+    Returns:
+        Tupla (conteo por tabla como texto, "más de N" si pasa de max_records; error)
+    """
+    counts = {}
+    for table_name in AGENT_TABLES:
+        try:
+            counts[table_name] = table_snapshot.get_snapshot(table_name, max_records).count_label()
+        except Exception as e:
+            return None, _table_error(table_name, e)
+    
+    return counts, None
 
-    # Leer contexto de negocio adicional si existe
-    business_context = ""
-    try:
-        with open('agent/system_prompt.txt', 'r', encoding='utf-8') as f:
-            business_context = f.read()
-    except FileNotFoundError:
-        pass  # Opcional, continuar sin contexto adicional
+
+async def _load_counts_async(max_records: int) -> Tuple[Optional[Dict[str, str]], Optional[str]]:
+    """Versión asíncrona de _load_counts: consulta ambas tablas a la vez si no están en caché"""
+    snapshots = await asyncio.gather(
+        *(table_snapshot.aget_snapshot(table_name, max_records) for table_name in AGENT_TABLES),
+        return_exceptions=True
+    )
     
-    # Construir mensaje del usuario con contexto completo
-    user_message = ""
+    counts = {}
+    for table_name, snapshot in zip(AGENT_TABLES, snapshots):
+        if isinstance(snapshot, Exception):
+            return None, _table_error(table_name, snapshot)
+        counts[table_name] = snapshot.count_label()
+    
+    return counts, None
+
+
+def _build_agent_input(
+    question: str,
+    state: ConversationState,
+    certificados_count: Any,
+    kardex_count: Any
+) -> List[Dict[str, str]]:
+    """
+    Construye los mensajes que se envían a OpenAI: el system message es el
+    prefijo fijo (prompts.AGENT_SYSTEM_PROMPT) y el user message lleva solo
+    lo que cambia en cada turno, de lo más estable a lo más volátil.
+    """
+    # Datos disponibles (cambian solo cuando se sincronizan las tablas)
+    user_message = "=== DATOS DISPONIBLES ===\n"
+    user_message += f"Tabla Certificados: {certificados_count} registros\n"
+    user_message += f"Tabla Kardex: {kardex_count} registros\n\n"
     
     # Añadir contexto de conversación si existe
     if state.history:
@@ -176,212 +128,359 @@ Tabla Kardex: idkardex, fechakardex, TipoMovimiento, coordinador, MunicipioOrige
     user_message += "\n\n"
     
     # Pregunta actual del usuario
-    user_message += f"=== NUEVA PREGUNTA DEL USUARIO ===\n{question}\n\n"
-    
-    # Datos disponibles
-    user_message += "=== DATOS DISPONIBLES ===\n"
-    user_message += f"Tabla Certificados: {len(certificados)} registros\n"
-    user_message += f"Tabla Kardex: {len(kardex)} registros\n\n"
-    
-    # Contexto de negocio adicional
-    if business_context:
-        user_message += "=== CONTEXTO DE NEGOCIO ===\n"
-        user_message += business_context + "\n\n"
-    
-    user_message += """
-INSTRUCCIONES DE RESPUESTA:
-Responde ÚNICAMENTE con el mensaje que quieres enviar al usuario.
-- Tu respuesta debe ser clara, concisa y natural
-- NO incluyas etiquetas como "MENSAJE:" o "STATE_JSON:"
-- NO incluyas JSON, bloques de código ni información técnica
-- Solo el texto conversacional para el usuario
+    user_message += f"=== NUEVA PREGUNTA DEL USUARIO ===\n{question}\n"
+    return prompts.agent_messages(user_message)
+
 
-El sistema se encargará automáticamente de actualizar el state_json.
-"""
+def _apply_agent_response(state: ConversationState, respuesta_completa: str) -> str:
+    """
+    Limpia la respuesta de OpenAI, la agrega al historial y actualiza
+    state.query / state.execution según lo que dice el agente.
     
-    # Llamar a OpenAI con system message y user message
-    try:
-        client = OpenAI()
-        response = client.responses.create(
-            model="gpt-5.1",
-            input=[
-                {"role": "system", "content": system_instructions},
-                {"role": "user", "content": user_message}
-            ]
-        )
-        
-        respuesta_completa = response.output_text
-        
-        # Extraer solo el mensaje para el usuario (limpiar cualquier formato residual)
-        mensaje_para_usuario = respuesta_completa.strip()
-        
-        # Limpiar posibles etiquetas de formato si las hay
-        if "MENSAJE:" in mensaje_para_usuario:
-            # Extraer solo la parte después de MENSAJE:
-            partes = mensaje_para_usuario.split("MENSAJE:", 1)
-            if len(partes) > 1:
-                mensaje_para_usuario = partes[1].strip()
-                # Eliminar STATE_JSON: y todo lo que sigue
-                if "STATE_JSON:" in mensaje_para_usuario:
-                    mensaje_para_usuario = mensaje_para_usuario.split("STATE_JSON:")[0].strip()
-        
-        # Actualizar estado de conversación con el mensaje limpio
-        state.add_message("agent", mensaje_para_usuario)
-        
-        # TODO: Aquí debería parsearse STATE_JSON de la respuesta de OpenAI
-        # para actualizar state.query dinámicamente.
+    Returns:
+        Mensaje limpio para el usuario
+    """
+    # Extraer solo el mensaje para el usuario (limpiar cualquier formato residual)
+    mensaje_para_usuario = respuesta_completa.strip()
+    
+    # Limpiar posibles etiquetas de formato si las hay
+    if "MENSAJE:" in mensaje_para_usuario:
+        # Extraer solo la parte después de MENSAJE:
+        partes = mensaje_para_usuario.split("MENSAJE:", 1)
+        if len(partes) > 1:
+            mensaje_para_usuario = partes[1].strip()
+            # Eliminar STATE_JSON: y todo lo que sigue
+            if "STATE_JSON:" in mensaje_para_usuario:
+                mensaje_para_usuario = mensaje_para_usuario.split("STATE_JSON:")[0].strip()
+    
+    # Actualizar estado de conversación con el mensaje limpio
+    state.add_message("agent", mensaje_para_usuario)
+    
+    # TODO: Aquí debería parsearse STATE_JSON de la respuesta de OpenAI
+    # para actualizar state.query dinámicamente.
+    
+    # WORKAROUND temporal: Intentar extraer información del mensaje
+    # para actualizar state.query basándose en palabras clave
+    msg_lower = mensaje_para_usuario.lower()
+    
+    # Detectar tabla mencionada
+    if not state.query.get("table"):
+        if "certificados" in msg_lower or "recolección" in msg_lower:
+            state.query["table"] = "Certificados"
+        elif "kardex" in msg_lower or "movimientos" in msg_lower:
+            state.query["table"] = "Kardex"
+    
+    # Detectar si el agente dice que va a ejecutar la consulta
+    # Debe ser una frase muy específica que indique ejecución inminente
+    execution_keywords = [
+        "voy a armar la consulta",
+        "voy a ejecutar la consulta",
+        "procedo con la consulta",
+        "ejecuto la consulta ahora",
+        "armando la consulta",
+        "consultando airtable",
+        "consulta marcada como lista",
+        "marcada como lista para ejecutar",
+        "dejo la consulta lista",
+        "voy a dejar la consulta lista",
+        "consulta lista para ejecución",
+        "listo para ejecutar"
+    ]
+    
+    # Verificar que el agente realmente esté ejecutando, no solo preguntando
+    is_asking_questions = any(phrase in msg_lower for phrase in [
+        "necesito que", 
+        "por favor indícame",
+        "¿qué", "¿cuál", "¿para qué",
+        "falta", "necesito saber",
+        "elige", "quieres que"
+    ])
+    
+    # Detectar si el USUARIO está rechazando o diciendo NO
+    user_is_rejecting = False
+    if len(state.history) > 0:
+        last_user_msg = None
+        for msg in reversed(state.history):
+            if msg['role'] == 'user':
+                last_user_msg = msg['content'].lower().strip()
+                break
         
-        # WORKAROUND temporal: Intentar extraer información del mensaje
-        # para actualizar state.query basándose en palabras clave
-        msg_lower = mensaje_para_usuario.lower()
+        if last_user_msg:
+            rejection_phrases = [
+                last_user_msg == "no",
+                last_user_msg.startswith("no "),
+                "no quiero" in last_user_msg,
+                "cancela" in last_user_msg,
+                "no me" in last_user_msg
+            ]
+            user_is_rejecting = any(rejection_phrases)
+    
+    # Detectar cuando muestra resumen de consulta SIN preguntar más
+    shows_query_summary = (
+        "- tabla:" in msg_lower and 
+        ("- filtros:" in msg_lower or "- período:" in msg_lower)
+    )
+    
+    should_mark_ready = (
+        (any(keyword in msg_lower for keyword in execution_keywords) 
+         and not is_asking_questions
+         and not user_is_rejecting) or
+        (shows_query_summary 
+         and not is_asking_questions
+         and not user_is_rejecting)
+    )
+    
+    if should_mark_ready:
+        # El agente indica que está ejecutando
+        # Extraer filtros básicos de la conversación
         
-        # Detectar tabla mencionada
-        if not state.query.get("table"):
-            if "certificados" in msg_lower or "recolección" in msg_lower:
-                state.query["table"] = "Certificados"
-            elif "kardex" in msg_lower or "movimientos" in msg_lower:
-                state.query["table"] = "Kardex"
+        # Buscar coordinador en el historial
+        for msg in reversed(state.history):
+            if msg['role'] == 'user':
+                user_msg_lower = msg['content'].lower()
+                # Buscar nombres de coordinador mencionados
+                if 'andrea' in user_msg_lower and not state.query["filters"].get("coordinador"):
+                    state.query["filters"]["coordinador"] = "Andrea Villarraga"
+                elif 'andrés' in user_msg_lower or 'andres' in user_msg_lower:
+                    if not state.query["filters"].get("coordinador"):
+                        state.query["filters"]["coordinador"] = "Andrés Felipe Ramirez"
         
-        # Detectar si el agente dice que va a ejecutar la consulta
-        # Debe ser una frase muy específica que indique ejecución inminente
-        execution_keywords = [
-            "voy a armar la consulta",
-            "voy a ejecutar la consulta",
-            "procedo con la consulta",
-            "ejecuto la consulta ahora",
-            "armando la consulta",
-            "consultando airtable",
-            "consulta marcada como lista",
-            "marcada como lista para ejecutar",
-            "dejo la consulta lista",
-            "voy a dejar la consulta lista",
-            "consulta lista para ejecución",
-            "listo para ejecutar"
-        ]
+        # Extraer fechas del mensaje del agente
+        import re
+        from datetime import datetime, timedelta
         
-        # Verificar que el agente realmente esté ejecutando, no solo preguntando
-        is_asking_questions = any(phrase in msg_lower for phrase in [
-            "necesito que", 
-            "por favor indícame",
-            "¿qué", "¿cuál", "¿para qué",
-            "falta", "necesito saber",
-            "elige", "quieres que"
-        ])
+        # Intentar encontrar fechas en formato YYYY-MM-DD
+        date_pattern = r'(\d{4})-(\d{2})-(\d{2})'
+        dates_found = re.findall(date_pattern, mensaje_para_usuario)
         
-        # Detectar si el USUARIO está rechazando o diciendo NO
-        user_is_rejecting = False
-        if len(state.history) > 0:
-            last_user_msg = None
-            for msg in reversed(state.history):
-                if msg['role'] == 'user':
-                    last_user_msg = msg['content'].lower().strip()
-                    break
+        if len(dates_found) >= 2:
+            # Si encontramos 2 fechas, asumimos desde-hasta
+            state.query["filters"]["fecha_desde"] = f"{dates_found[0][0]}-{dates_found[0][1]}-{dates_found[0][2]}"
+            state.query["filters"]["fecha_hasta"] = f"{dates_found[1][0]}-{dates_found[1][1]}-{dates_found[1][2]}"
+        elif len(dates_found) == 1:
+            # Una sola fecha, usar como fecha_desde
+            state.query["filters"]["fecha_desde"] = f"{dates_found[0][0]}-{dates_found[0][1]}-{dates_found[0][2]}"
+        elif "mes pasado" in msg_lower or "último mes" in msg_lower:
+            # Calcular mes pasado
+            today = datetime.now()
+            first_day_current = today.replace(day=1)
+            last_day_prev = first_day_current - timedelta(days=1)
+            first_day_prev = last_day_prev.replace(day=1)
             
-            if last_user_msg:
-                rejection_phrases = [
-                    last_user_msg == "no",
-                    last_user_msg.startswith("no "),
-                    "no quiero" in last_user_msg,
-                    "cancela" in last_user_msg,
-                    "no me" in last_user_msg
-                ]
-                user_is_rejecting = any(rejection_phrases)
+            state.query["filters"]["fecha_desde"] = first_day_prev.strftime("%Y-%m-%d")
+            state.query["filters"]["fecha_hasta"] = last_day_prev.strftime("%Y-%m-%d")
+        elif "este mes" in msg_lower or "mes actual" in msg_lower:
+            # Calcular este mes
+            today = datetime.now()
+            first_day = today.replace(day=1)
+            state.query["filters"]["fecha_desde"] = first_day.strftime("%Y-%m-%d")
+            state.query["filters"]["fecha_hasta"] = today.strftime("%Y-%m-%d")
         
-        # Detectar cuando muestra resumen de consulta SIN preguntar más
-        shows_query_summary = (
-            "- tabla:" in msg_lower and 
-            ("- filtros:" in msg_lower or "- período:" in msg_lower)
-        )
+        # Detectar si es un consolidado/ranking (válido sin filtros específicos)
+        is_aggregate_query = any(phrase in msg_lower for phrase in [
+            "consolidado", "ranking", "resumen", "totales", 
+            "por coordinador", "agrupado", "todo colombia"
+        ])
         
-        should_mark_ready = (
-            (any(keyword in msg_lower for keyword in execution_keywords) 
-             and not is_asking_questions
-             and not user_is_rejecting) or
-            (shows_query_summary 
-             and not is_asking_questions
-             and not user_is_rejecting)
+        # NO marcar como ready si no hay filtros suficientes
+        # EXCEPTO si es un query agregado (consolidado/ranking)
+        has_meaningful_filters = (
+            state.query["filters"].get("coordinador") or
+            state.query["filters"].get("fecha_desde") or
+            state.query["filters"].get("municipio") or
+            is_aggregate_query
         )
         
-        if should_mark_ready:
-            # El agente indica que está ejecutando
-            # Extraer filtros básicos de la conversación
-            
-            # Buscar coordinador en el historial
-            for msg in reversed(state.history):
-                if msg['role'] == 'user':
-                    user_msg_lower = msg['content'].lower()
-                    # Buscar nombres de coordinador mencionados
-                    if 'andrea' in user_msg_lower and not state.query["filters"].get("coordinador"):
-                        state.query["filters"]["coordinador"] = "Andrea Villarraga"
-                    elif 'andrés' in user_msg_lower or 'andres' in user_msg_lower:
-                        if not state.query["filters"].get("coordinador"):
-                            state.query["filters"]["coordinador"] = "Andrés Felipe Ramirez"
-            
-            # Extraer fechas del mensaje del agente
-            import re
-            from datetime import datetime, timedelta
-            
-            # Intentar encontrar fechas en formato YYYY-MM-DD
-            date_pattern = r'(\d{4})-(\d{2})-(\d{2})'
-            dates_found = re.findall(date_pattern, mensaje_para_usuario)
-            
-            if len(dates_found) >= 2:
-                # Si encontramos 2 fechas, asumimos desde-hasta
-                state.query["filters"]["fecha_desde"] = f"{dates_found[0][0]}-{dates_found[0][1]}-{dates_found[0][2]}"
-                state.query["filters"]["fecha_hasta"] = f"{dates_found[1][0]}-{dates_found[1][1]}-{dates_found[1][2]}"
-            elif len(dates_found) == 1:
-                # Una sola fecha, usar como fecha_desde
-                state.query["filters"]["fecha_desde"] = f"{dates_found[0][0]}-{dates_found[0][1]}-{dates_found[0][2]}"
-            elif "mes pasado" in msg_lower or "último mes" in msg_lower:
-                # Calcular mes pasado
-                today = datetime.now()
-                first_day_current = today.replace(day=1)
-                last_day_prev = first_day_current - timedelta(days=1)
-                first_day_prev = last_day_prev.replace(day=1)
-                
-                state.query["filters"]["fecha_desde"] = first_day_prev.strftime("%Y-%m-%d")
-                state.query["filters"]["fecha_hasta"] = last_day_prev.strftime("%Y-%m-%d")
-            elif "este mes" in msg_lower or "mes actual" in msg_lower:
-                # Calcular este mes
-                today = datetime.now()
-                first_day = today.replace(day=1)
-                state.query["filters"]["fecha_desde"] = first_day.strftime("%Y-%m-%d")
-                state.query["filters"]["fecha_hasta"] = today.strftime("%Y-%m-%d")
-            
-            # Detectar si es un consolidado/ranking (válido sin filtros específicos)
-            is_aggregate_query = any(phrase in msg_lower for phrase in [
-                "consolidado", "ranking", "resumen", "totales", 
-                "por coordinador", "agrupado", "todo colombia"
-            ])
-            
-            # NO marcar como ready si no hay filtros suficientes
-            # EXCEPTO si es un query agregado (consolidado/ranking)
-            has_meaningful_filters = (
-                state.query["filters"].get("coordinador") or
-                state.query["filters"].get("fecha_desde") or
-                state.query["filters"].get("municipio") or
-                is_aggregate_query
-            )
-            
-            # Si tenemos tabla Y filtros significativos, marcar como ready
-            if state.query.get("table") and has_meaningful_filters:
-                state.execution["ready"] = True
-                state.update_status(ConversationStatus.READY_TO_EXECUTE)
-        
-        # Alternativa: Si la query ya tiene tabla y filtros, marcar como ready
-        elif (state.query.get("table") and 
-              (state.query.get("filters") or state.query.get("validated"))):
+        # Si tenemos tabla Y filtros significativos, marcar como ready
+        if state.query.get("table") and has_meaningful_filters:
             state.execution["ready"] = True
             state.update_status(ConversationStatus.READY_TO_EXECUTE)
+    
+    # Alternativa: Si la query ya tiene tabla y filtros, marcar como ready
+    elif (state.query.get("table") and 
+          (state.query.get("filters") or state.query.get("validated"))):
+        state.execution["ready"] = True
+        state.update_status(ConversationStatus.READY_TO_EXECUTE)
+    
+    return mensaje_para_usuario
+
+
+def run_agent_with_context(
+    question: str,
+    state: ConversationState,
+    extra: Optional[dict] = None
+) -> Tuple[str, ConversationState]:
+    """
+    Ejecuta el agente con contexto de conversación.
+    
+    Args:
+        question: Pregunta del usuario
+        state: Estado actual de la conversación
+        extra: Datos adicionales opcionales (max_records, no_cache, etc.)
+    
+    Returns:
+        Tupla (mensaje_para_usuario, state_actualizado)
+    """
+    # Configuración
+    config_error = _check_config()
+    if config_error:
+        return config_error, state
+    
+    # Parámetros
+    max_records = (extra or {}).get("max_records", 100)
+    
+    # Mismo turno ya respondido (misma pregunta, estado y datos): sin llamar a OpenAI
+    cache_key, cached_response = response_cache.lookup(question, state, AGENT_MODEL, extra)
+    if cached_response is not None:
+        return _apply_agent_response(state, cached_response), state
+    
+    counts, error = _load_counts(max_records)
+    if error:
+        return error, state
+    
+    agent_input = _build_agent_input(question, state, counts["Certificados"], counts["Kardex"])
+    
+    # Llamar a OpenAI con system message y user message
+    try:
+        client = OpenAI()
+        response = client.responses.create(
+            model=AGENT_MODEL,
+            input=agent_input
+        )
         
+        prompts.record_usage(response)
+        response_cache.put(cache_key, response.output_text)
+        mensaje_para_usuario = _apply_agent_response(state, response.output_text)
         return mensaje_para_usuario, state
+    
+    except Exception as e:
+        error_msg = f"Error al consultar OpenAI: {str(e)}"
+        state.mark_executed(error=error_msg)
+        return error_msg, state
+
+
+async def _prepare_turn_async(
+    question: str,
+    state: ConversationState,
+    extra: Optional[dict]
+) -> Tuple[Optional[str], Optional[str], Optional[List[Dict[str, str]]]]:
+    """
+    Pasos previos a OpenAI de las versiones asíncronas.
+    
+    Returns:
+        Tupla (mensaje inmediato, clave de response_cache, entrada para OpenAI).
+        Si hay mensaje inmediato (error de configuración o de las tablas, o
+        respuesta ya aplicada desde la caché) no hay que llamar a OpenAI.
+    """
+    config_error = _check_config()
+    if config_error:
+        return config_error, None, None
+    
+    max_records = (extra or {}).get("max_records", 100)
+    
+    cache_key, cached_response = await asyncio.to_thread(response_cache.lookup, question, state, AGENT_MODEL, extra)
+    if cached_response is not None:
+        return _apply_agent_response(state, cached_response), cache_key, None
+    
+    counts, error = await _load_counts_async(max_records)
+    if error:
+        return error, cache_key, None
+    
+    return None, cache_key, _build_agent_input(question, state, counts["Certificados"], counts["Kardex"])
+
+
+async def run_agent_with_context_async(
+    question: str,
+    state: ConversationState,
+    extra: Optional[dict] = None
+) -> Tuple[str, ConversationState]:
+    """
+    Versión asíncrona de run_agent_with_context para el endpoint /ask.
+    
+    Usa el cliente asíncrono de Airtable y AsyncOpenAI, así que mientras
+    espera la red el event loop puede atender otras conversaciones.
+    Misma lógica de prompt y de actualización de estado que la versión síncrona.
+    """
+    mensaje, cache_key, agent_input = await _prepare_turn_async(question, state, extra)
+    if mensaje is not None:
+        return mensaje, state
+    
+    try:
+        client = get_async_openai_client()
+        response = await client.responses.create(
+            model=AGENT_MODEL,
+            input=agent_input
+        )
         
+        prompts.record_usage(response)
+        await asyncio.to_thread(response_cache.put, cache_key, response.output_text)
+        mensaje_para_usuario = _apply_agent_response(state, response.output_text)
+        return mensaje_para_usuario, state
+    
     except Exception as e:
         error_msg = f"Error al consultar OpenAI: {str(e)}"
         state.mark_executed(error=error_msg)
         return error_msg, state
 
 
+async def stream_agent_with_context(
+    question: str,
+    state: ConversationState,
+    extra: Optional[dict] = None
+) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Versión en streaming de run_agent_with_context_async para /ask/stream.
+    
+    Pide la respuesta a OpenAI con stream=True y entrega el texto a medida
+    que llega, sin esperar la respuesta completa. El estado se actualiza
+    igual que en la versión sin streaming, una vez terminada la respuesta.
+    
+    Yields:
+        ("delta", texto parcial) mientras llega la respuesta y al final
+        ("message", mensaje_para_usuario): el mensaje limpio que devolvería
+        run_agent_with_context_async (o el error). Una respuesta de la caché
+        o un error previo a OpenAI llegan como un solo delta.
+    """
+    mensaje, cache_key, agent_input = await _prepare_turn_async(question, state, extra)
+    if mensaje is not None:
+        yield "delta", mensaje
+        yield "message", mensaje
+        return
+    
+    try:
+        client = get_async_openai_client()
+        stream = await client.responses.create(
+            model=AGENT_MODEL,
+            input=agent_input,
+            stream=True
+        )
+        
+        parts = []
+        completed = None
+        async for event in stream:
+            if event.type == "response.output_text.delta":
+                parts.append(event.delta)
+                yield "delta", event.delta
+            elif event.type == "response.completed":
+                completed = event.response
+            elif event.type in ("response.failed", "error"):
+                raise RuntimeError(getattr(event, "message", None) or event.type)
+        
+        respuesta_completa = "".join(parts)
+        if completed is not None:
+            prompts.record_usage(completed)
+            respuesta_completa = completed.output_text or respuesta_completa
+    
+    except Exception as e:
+        error_msg = f"Error al consultar OpenAI: {str(e)}"
+        state.mark_executed(error=error_msg)
+        yield "message", error_msg
+        return
+    
+    await asyncio.to_thread(response_cache.put, cache_key, respuesta_completa)
+    yield "message", _apply_agent_response(state, respuesta_completa)
+
+
 # Mantener la función original para retrocompatibilidad
 def run_agent(question: str, extra: Optional[dict] = None):
     """
@@ -0,0 +1,208 @@
+"""
+Motor de agregación para los consolidados de Certificados y Kardex.
+
+El prompt pide al modelo totales por coordinador, material y municipio a
+partir de cientos de registros en JSON, y el modelo es lento y poco fiable
+sumando. Aquí los totales se calculan en el servidor de forma determinista
+y al modelo se le entregan las tablas ya consolidadas.
+
+Los registros se pasan a columnas una sola vez (`Columns`): cada material
+queda en un `array('d')` y cada dimensión como códigos enteros de grupo, así
+que cada agregación es un recorrido por columna sin volver a leer los
+diccionarios de Airtable.
+
+Si numpy está instalado (es opcional), las sumas por grupo son vectoriales
+(`numpy.bincount` sobre los mismos arreglos, sin copiarlos); si no, se
+recorre cada columna en Python con el mismo resultado.
+
+Ejemplo:
+    >>> columns = Columns("Certificados", records)
+    >>> aggregate(columns, "coordinador")
+    [{'coordinador': 'Ana Gómez', 'registros': 12, 'rigidos': 340.0, ...}, ...]
+"""
+from array import array
+from typing import Dict, List, Any, Optional
+
+from airtable_values import field_text, parse_date, to_number
+
+try:
+    import numpy
+except ImportError:  # Opcional: sin numpy las sumas por grupo se hacen en Python
+    numpy = None
+
+
+# Columnas numéricas (materiales en kg) por tabla, con los nombres de Airtable
+MEASURES: Dict[str, List[str]] = {
+    "Certificados": ["rigidos", "flexibles", "metalicos", "embalaje", "total"],
+    "Kardex": ["Reciclaje", "Incineración", "PlasticoContaminado", "Flexibles", "Lonas", "Carton", "Metal", "Total"],
+}
+
+# Dimensiones de agrupación -> campo de Airtable
+DIMENSIONS: Dict[str, Dict[str, str]] = {
+    "Certificados": {
+        "coordinador": "nombrecoordinador",
+        "municipio": "municipiogenerador",
+        "municipio_devolucion": "municipiodevolucion",
+        "mes": "fechadevolucion",
+    },
+    "Kardex": {
+        "coordinador": "Name (from Coordinador)",
+        "municipio": "MunicipioOrigen",
+        "mes": "fechakardex",
+        "gestor": "nombregestor",
+        "centro_acopio": "NombreCentrodeAcopio",
+        "tipo_movimiento": "TipoMovimiento",
+    },
+}
+
+# Agrupaciones que se envían al agente en el consolidado
+DEFAULT_GROUPS: Dict[str, List[str]] = {
+    "Certificados": ["coordinador", "municipio", "mes"],
+    "Kardex": ["coordinador", "gestor", "mes"],
+}
+
+EMPTY_GROUP = "(sin dato)"
+
+
+def _group_label(dimension: str, value: Any) -> str:
+    if dimension == "mes":
+        moment = parse_date(value)
+        return moment.strftime("%Y-%m") if moment else EMPTY_GROUP
+    return field_text(value) or EMPTY_GROUP
+
+
+class Columns:
+    """
+    Registros de una tabla en formato columnar.
+    
+    Las columnas de grupo se codifican la primera vez que se agrupa por
+    ellas y quedan guardadas para las siguientes agregaciones.
+    """
+    
+    def __init__(self, table_name: str, records: List[Dict[str, Any]]):
+        if table_name not in MEASURES:
+            raise ValueError(f"Tabla sin agregaciones definidas: {table_name}")
+        self.table_name = table_name
+        self.size = len(records)
+        self._fields = [record.get("fields", {}) for record in records]
+        self.measures = {
+            measure: array("d", (to_number(fields.get(measure)) for fields in self._fields))
+            for measure in MEASURES[table_name]
+        }
+        self._groups: Dict[str, tuple] = {}
+    
+    def group_codes(self, dimension: str):
+        """Devuelve (códigos por fila, etiquetas por código) para una dimensión"""
+        if dimension not in self._groups:
+            field = DIMENSIONS[self.table_name].get(dimension)
+            if field is None:
+                raise ValueError(f"No se puede agrupar {self.table_name} por '{dimension}'")
+            
+            labels: List[str] = []
+            index: Dict[str, int] = {}
+            codes = array("l")
+            for fields in self._fields:
+                label = _group_label(dimension, fields.get(field))
+                code = index.get(label)
+                if code is None:
+                    code = index[label] = len(labels)
+                    labels.append(label)
+                codes.append(code)
+            self._groups[dimension] = (codes, labels)
+        return self._groups[dimension]
+
+
+def _sum_by_group(codes: array, values: array, groups: int) -> array:
+    """Suma de `values` por código de grupo (un valor por grupo, en orden de código)"""
+    if numpy is not None and len(codes):
+        sums = numpy.bincount(
+            numpy.frombuffer(codes, dtype=numpy.dtype(f"i{codes.itemsize}")),
+            weights=numpy.frombuffer(values, dtype=numpy.float64),
+            minlength=groups
+        )
+        return array("d", sums.tobytes())
+    
+    sums = array("d", bytes(8 * groups))
+    for code, value in zip(codes, values):
+        sums[code] += value
+    return sums
+
+
+def totals(columns: Columns) -> Dict[str, Any]:
+    """Total general de cada material"""
+    result: Dict[str, Any] = {"registros": columns.size}
+    for measure, values in columns.measures.items():
+        result[measure] = round(sum(values), 2)
+    return result
+
+
+def aggregate(columns: Columns, group_by: str, measures: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Suma los materiales por grupo.
+    
+    Args:
+        columns: Registros en columnas (Columns)
+        group_by: "coordinador", "municipio", "mes", "gestor", ...
+        measures: Materiales a sumar (default: todos los de la tabla)
+    
+    Returns:
+        Una fila por grupo con el número de registros y la suma de cada
+        material. Ordenadas por mes si group_by es "mes"; si no, por total
+        de mayor a menor.
+    """
+    codes, labels = columns.group_codes(group_by)
+    measures = measures or MEASURES[columns.table_name]
+    
+    counts = _sum_by_group(codes, array("d", [1.0]) * columns.size, len(labels))
+    sums = {measure: _sum_by_group(codes, columns.measures[measure], len(labels)) for measure in measures}
+    
+    rows = []
+    for code, label in enumerate(labels):
+        row: Dict[str, Any] = {group_by: label, "registros": int(counts[code])}
+        for measure in measures:
+            row[measure] = round(sums[measure][code], 2)
+        rows.append(row)
+    
+    if group_by == "mes":
+        rows.sort(key=lambda row: row["mes"])
+    else:
+        rows.sort(key=lambda row: row.get(measures[-1], 0), reverse=True)
+    return rows
+
+
+def _format_number(value: Any) -> str:
+    if isinstance(value, float):
+        return f"{value:.2f}".rstrip("0").rstrip(".")
+    return str(value)
+
+
+def format_table(rows: List[Dict[str, Any]], max_rows: Optional[int] = None) -> str:
+    """Tabla de texto (columnas separadas por |) para incluir en el prompt"""
+    if not rows:
+        return "(sin datos)"
+    columns = list(rows[0].keys())
+    lines = [" | ".join(columns)]
+    shown = rows[:max_rows] if max_rows else rows
+    for row in shown:
+        lines.append(" | ".join(_format_number(row.get(column, "")) for column in columns))
+    if len(shown) < len(rows):
+        lines.append(f"... y {len(rows) - len(shown)} grupos más")
+    return "\n".join(lines)
+
+
+def consolidated_report(
+    table_name: str,
+    records: List[Dict[str, Any]],
+    group_bys: Optional[List[str]] = None,
+    max_rows: int = 20
+) -> str:
+    """
+    Bloque de texto con el total general y las tablas agrupadas de una tabla,
+    listo para enviar al modelo en lugar de los registros.
+    """
+    columns = Columns(table_name, records)
+    sections = [f"Total general ({table_name}):", format_table([totals(columns)])]
+    for group_by in group_bys or DEFAULT_GROUPS[table_name]:
+        sections.append(f"\nPor {group_by.replace('_', ' ')}:")
+        sections.append(format_table(aggregate(columns, group_by), max_rows))
+    return "\n".join(sections)
@@ -0,0 +1,336 @@
+"""
+Cliente HTTP compartido para todas las llamadas a la API de Airtable.
+
+Mantiene una única `requests.Session` por proceso con un pool de conexiones
+keep-alive, de modo que las consultas sucesivas (queries.py, agent_core y
+agent_with_context) reutilizan la conexión TLS en lugar de abrir una nueva
+en cada llamada.
+
+Para el endpoint /ask existe además un cliente asíncrono (`httpx.AsyncClient`)
+con el mismo tamaño de pool y timeouts: `aget` y `aiter_record_pages`.
+
+Todas las llamadas pasan por el limitador de rate_limit.py (5 req/s por base)
+y reintentan automáticamente las respuestas 429.
+
+Configuración (variables de entorno opcionales):
+    AIRTABLE_POOL_SIZE        Conexiones máximas en el pool (default: 10)
+    AIRTABLE_CONNECT_TIMEOUT  Timeout de conexión en segundos (default: 5)
+    AIRTABLE_READ_TIMEOUT     Timeout de lectura en segundos (default: 30)
+"""
+import os
+import threading
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Dict, List, Any, Optional, Iterator, AsyncIterator, Tuple, Union
+
+import rate_limit
+
+
+AIRTABLE_API_URL = "https://api.airtable.com/v0"
+
+# Airtable devuelve como máximo 100 registros por página
+AIRTABLE_PAGE_SIZE = 100
+
+POOL_SIZE = int(os.getenv("AIRTABLE_POOL_SIZE", "10"))
+CONNECT_TIMEOUT = float(os.getenv("AIRTABLE_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("AIRTABLE_READ_TIMEOUT", "30"))
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+class AirtableAPIError(Exception):
+    """Error devuelto por la API de Airtable (respuesta con código distinto de 200)"""
+    
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"Airtable API error {status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+
+
+def get_session() -> requests.Session:
+    """
+    Devuelve la sesión HTTP compartida del proceso (la crea la primera vez).
+    
+    La sesión monta un HTTPAdapter con un pool de POOL_SIZE conexiones
+    para https://, así que es segura para usarse desde varios hilos.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def close_session():
+    """Cierra la sesión compartida (por ejemplo al apagar el servidor)"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Devuelve el cliente HTTP asíncrono compartido del proceso (lo crea la primera vez).
+    
+    Debe usarse desde el event loop del servidor; las corrutinas que lo
+    comparten reutilizan las conexiones keep-alive del pool.
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=POOL_SIZE,
+                max_keepalive_connections=POOL_SIZE
+            ),
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+        )
+    return _async_client
+
+
+async def aclose_async_client():
+    """Cierra el cliente asíncrono compartido (al apagar el servidor)"""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def default_timeout() -> Tuple[float, float]:
+    """Timeout (conexión, lectura) usado cuando el llamador no indica uno"""
+    return (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+
+def table_url(base_id: str, table_name: str) -> str:
+    """URL REST de una tabla de Airtable"""
+    return f"{AIRTABLE_API_URL}/{base_id}/{table_name}"
+
+
+def auth_headers(api_key: str) -> Dict[str, str]:
+    """Headers de autenticación para la API de Airtable"""
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+
+def get(
+    base_id: str,
+    api_key: str,
+    table_name: str,
+    params: Optional[Dict[str, Any]] = None,
+    timeout: Optional[Union[float, Tuple[float, float]]] = None
+) -> requests.Response:
+    """
+    Hace un GET a una tabla de Airtable usando el pool de conexiones compartido.
+    
+    Espera turno en el limitador de la base y, si Airtable responde 429,
+    reintenta con backoff hasta rate_limit.MAX_RETRIES veces.
+    
+    Devuelve la respuesta sin procesar; el manejo del código de estado queda
+    a cargo del llamador.
+    """
+    limiter = rate_limit.get_limiter(base_id)
+    attempt = 0
+    while True:
+        limiter.acquire()
+        response = get_session().get(
+            table_url(base_id, table_name),
+            params=params,
+            headers=auth_headers(api_key),
+            timeout=timeout or default_timeout()
+        )
+        if response.status_code != 429 or attempt >= rate_limit.MAX_RETRIES:
+            return response
+        
+        # El siguiente acquire() espera el backoff (y frena al resto de llamadas a la base)
+        limiter.throttle(rate_limit.backoff_delay(attempt, response.headers.get("Retry-After")))
+        attempt += 1
+
+
+async def aget(
+    base_id: str,
+    api_key: str,
+    table_name: str,
+    params: Optional[Dict[str, Any]] = None
+) -> httpx.Response:
+    """
+    Versión asíncrona de get(): no bloquea el event loop mientras espera a Airtable
+    (ni mientras espera turno en el limitador).
+    
+    Devuelve la respuesta sin procesar (httpx.Response expone status_code,
+    text y json() igual que requests).
+    """
+    limiter = rate_limit.get_limiter(base_id)
+    attempt = 0
+    while True:
+        await limiter.acquire_async()
+        response = await get_async_client().get(
+            table_url(base_id, table_name),
+            params=params,
+            headers=auth_headers(api_key)
+        )
+        if response.status_code != 429 or attempt >= rate_limit.MAX_RETRIES:
+            return response
+        
+        limiter.throttle(rate_limit.backoff_delay(attempt, response.headers.get("Retry-After")))
+        attempt += 1
+
+
+def _page_params(params: Optional[Dict[str, Any]], max_records: Optional[int]) -> Dict[str, Any]:
+    """Parámetros de la primera página (pageSize / maxRecords)"""
+    page_params = dict(params or {})
+    page_params["pageSize"] = AIRTABLE_PAGE_SIZE
+    if max_records:
+        page_params["maxRecords"] = max_records
+        page_params["pageSize"] = min(AIRTABLE_PAGE_SIZE, max_records)
+    return page_params
+
+
+def _raise_for_status(response: Union[requests.Response, httpx.Response]):
+    """Lanza AirtableAPIError si la respuesta no es 200"""
+    if response.status_code != 200:
+        error_message = response.text
+        try:
+            error_message = response.json().get("error", {}).get("message", error_message)
+        except Exception:
+            pass
+        raise AirtableAPIError(response.status_code, error_message)
+
+
+def fetch_page(
+    base_id: str,
+    api_key: str,
+    table_name: str,
+    params: Optional[Dict[str, Any]] = None,
+    offset: Optional[str] = None,
+    timeout: Optional[Union[float, Tuple[float, float]]] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Pide una sola página de una tabla.
+    
+    Returns:
+        Tupla (registros, offset de la página siguiente o None si es la última)
+    
+    Raises:
+        AirtableAPIError: Si Airtable responde con un código distinto de 200
+    """
+    page_params = dict(params or {})
+    if offset:
+        page_params["offset"] = offset
+    
+    response = get(base_id, api_key, table_name, page_params, timeout)
+    _raise_for_status(response)
+    
+    data = response.json()
+    # Airtable incluye `offset` solo cuando quedan más páginas
+    return data.get("records", []), data.get("offset")
+
+
+def iter_record_pages(
+    base_id: str,
+    api_key: str,
+    table_name: str,
+    params: Optional[Dict[str, Any]] = None,
+    max_records: Optional[int] = None,
+    timeout: Optional[Union[float, Tuple[float, float]]] = None
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Recorre una tabla de Airtable página por página siguiendo el cursor `offset`.
+    
+    Cada iteración hace una sola llamada a la API y entrega la lista de registros
+    de esa página, de modo que el llamador puede detenerse en cualquier momento
+    (las páginas siguientes no se piden) o ir acumulando resultados sin tener
+    toda la tabla en memoria.
+    
+    Args:
+        base_id: ID de la base de Airtable
+        api_key: API key de Airtable
+        table_name: Nombre de la tabla ("Certificados", "Kardex", ...)
+        params: Parámetros adicionales (filterByFormula, fields[], sort[...], ...)
+        max_records: Límite total de registros (None = toda la tabla)
+        timeout: Timeout para cada página (default: default_timeout())
+    
+    Yields:
+        Lista de registros de cada página (máximo AIRTABLE_PAGE_SIZE)
+    
+    Raises:
+        AirtableAPIError: Si Airtable responde con un código distinto de 200
+        requests.exceptions.RequestException: Errores de red / timeout
+    
+    Ejemplo:
+        >>> total = 0
+        >>> for page in iter_record_pages(base_id, api_key, "Certificados"):
+        ...     total += sum(r["fields"].get("total", 0) for r in page)
+    """
+    page_params = _page_params(params, max_records)
+    
+    offset = None
+    while True:
+        records, offset = fetch_page(base_id, api_key, table_name, page_params, offset, timeout)
+        if records:
+            yield records
+        
+        if not offset:
+            break
+
+
+def iter_records(
+    base_id: str,
+    api_key: str,
+    table_name: str,
+    params: Optional[Dict[str, Any]] = None,
+    max_records: Optional[int] = None,
+    timeout: Optional[Union[float, Tuple[float, float]]] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Igual que iter_record_pages pero entrega los registros uno a uno.
+    
+    Útil para agregar resultados de forma incremental (sumas, conteos)
+    sin construir la lista completa.
+    """
+    for page in iter_record_pages(base_id, api_key, table_name, params, max_records, timeout):
+        yield from page
+
+
+async def aiter_record_pages(
+    base_id: str,
+    api_key: str,
+    table_name: str,
+    params: Optional[Dict[str, Any]] = None,
+    max_records: Optional[int] = None
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Versión asíncrona de iter_record_pages (generador asíncrono).
+    
+    Ejemplo:
+        >>> async for page in aiter_record_pages(base_id, api_key, "Kardex"):
+        ...     procesar(page)
+    """
+    page_params = _page_params(params, max_records)
+    
+    offset = None
+    while True:
+        if offset:
+            page_params["offset"] = offset
+        
+        response = await aget(base_id, api_key, table_name, page_params)
+        _raise_for_status(response)
+        
+        data = response.json()
+        records = data.get("records", [])
+        if records:
+            yield records
+        
+        offset = data.get("offset")
+        if not offset:
+            break
@@ -0,0 +1,55 @@
+"""
+Conversión de valores de campos de Airtable, compartida por el motor de
+consultas local, las agregaciones y los consolidados de la copia local.
+
+No depende de otros módulos del proyecto, así que table_mirror puede usarlo
+sin ciclos de importación.
+"""
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+
+def field_text(value: Any) -> str:
+    """Valor de un campo como lo compara Airtable en una fórmula con '='"""
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return ", ".join(field_text(item) for item in value)
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def parse_date(value: Any) -> Optional[datetime]:
+    """
+    Convierte una fecha de Airtable ('2024-01-15' o '2024-01-15T10:30:00.000Z')
+    a datetime UTC sin zona. Devuelve None si está vacía o no es válida.
+    """
+    if isinstance(value, list):
+        value = value[0] if value else None
+    text = field_text(value).strip()
+    if not text:
+        return None
+    try:
+        moment = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def to_number(value: Any) -> float:
+    """Valor numérico de un campo (lookups: primer valor; vacío o texto: 0)"""
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace(",", "."))
+    except (TypeError, ValueError):
+        return 0.0
@@ -9,6 +9,7 @@ O simplemente ejecutar el servidor - se creará automáticamente si no existe.
 """
 
 import json
+import asyncio
 from datetime import datetime
 from typing import Optional
 from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
@@ -241,6 +242,20 @@ def list_user_conversations(user_id: str, limit: int = 10):
         db.close()
 
 
+# Versiones asíncronas para el endpoint /ask.
+# SQLite es local y las operaciones son cortas, así que se ejecutan en el
+# pool de hilos por defecto para no bloquear el event loop de uvicorn.
+
+async def aget_or_create_conversation(user_id: str, conversation_id: str = None) -> ConversationState:
+    """Versión asíncrona de get_or_create_conversation"""
+    return await asyncio.to_thread(get_or_create_conversation, user_id, conversation_id)
+
+
+async def aupdate_conversation(state: ConversationState) -> Conversation:
+    """Versión asíncrona de update_conversation"""
+    return await asyncio.to_thread(update_conversation, state)
+
+
 # Inicializar la base de datos al importar el módulo
 try:
     init_db()
@@ -55,7 +55,8 @@ class ConversationState:
             "filters": {},  # fecha_desde, fecha_hasta, coordinador, municipio, etc.
             "fields": [],  # campos a retornar
             "sort": [],  # ordenamiento
-            "limit": 100,
+            "limit": None,  # None = todos los registros que cumplan los filtros
+            "group_by": None,  # totales por coordinador, mes, etc. en lugar de registros
             "validated": False
         }
         
@@ -120,8 +121,8 @@ class ConversationState:
         self.query["sort"] = sort
         self._update_timestamp()
     
-    def set_limit(self, limit: int):
-        """Establece el límite de registros"""
+    def set_limit(self, limit: Optional[int]):
+        """Establece el límite de registros (None = sin límite)"""
         self.query["limit"] = limit
         self._update_timestamp()
     
@@ -197,7 +198,8 @@ class ConversationState:
             "filters": {},
             "fields": [],
             "sort": [],
-            "limit": 100,
+            "limit": None,  # None = todos los registros que cumplan los filtros
+            "group_by": None,  # totales por coordinador, mes, etc. en lugar de registros
             "validated": False
         }
         
@@ -0,0 +1,361 @@
+"""
+Árbol de filtros compartido por la consulta remota (fórmula de Airtable) y la
+local (predicados sobre la copia local).
+
+Los filtros de state.query se compilan una sola vez en un árbol de nodos:
+
+    Equals      {campo}='valor'
+    In          OR({campo}='a', {campo}='b', ...)
+    NumberRange {campo}>=min, {campo}<=max          (límites incluidos)
+    DateRange   IS_AFTER({campo}, 'desde'), IS_BEFORE({campo}, 'hasta')  (estrictos)
+    And / Or    AND(...) / OR(...)
+
+y cada nodo sabe convertirse en fórmula (`formula`), en predicado de Python
+sobre `fields` (`predicate`) y en texto para el usuario (`describe`). Así la
+fórmula enviada a Airtable, el motor local y el mensaje de resultado salen
+del mismo árbol y no pueden divergir.
+
+Correspondencia con los filtros de state.query:
+
+    fecha_desde            DateRange(<fecha de la tabla>, after=v)
+    fecha_hasta            DateRange(<fecha de la tabla>, before=v)
+    coordinador            Equals(nombrecoordinador, v)
+    municipio              Or(Equals(municipiogenerador, v), Equals(municipiodevolucion, v))
+    municipio_generador    Equals(municipiogenerador, v)
+    municipio_devolucion   Equals(municipiodevolucion, v)
+    <campo>_min / _max     NumberRange(<campo>, min, max)   p. ej. total_min: 100
+    otro                   Equals(otro, v)
+
+La fecha de la tabla sale de DATE_FIELDS (fechadevolucion en Certificados,
+fechakardex en Kardex); la misma correspondencia usan record_store y rollups,
+así que la fórmula y los predicados locales filtran por el mismo campo.
+
+Si el valor es una lista se usa In en lugar de Equals (p. ej.
+"coordinador": ["Ana", "Juan"]). Los valores de texto se escapan (comillas y
+barras invertidas) antes de ir a la fórmula.
+
+Como en Airtable, '=' compara texto (campos vacíos valen '' y los lookups se
+unen con ", "), las fechas vacías o no válidas no cumplen IS_AFTER /
+IS_BEFORE y los campos numéricos vacíos cuentan como 0.
+
+Ejemplo:
+    >>> tree = compile_filters({"coordinador": "Ana", "fecha_desde": "2024-01-01"}, "Certificados")
+    >>> tree.formula()
+    "AND({nombrecoordinador}='Ana', IS_AFTER({fechadevolucion}, '2024-01-01'))"
+    >>> tree.describe()
+    'coordinador Ana, desde 2024-01-01'
+"""
+import json
+from functools import lru_cache
+from typing import Dict, List, Any, Optional, Callable, Tuple
+
+from airtable_values import field_text, parse_date, to_number
+
+
+Predicate = Callable[[Dict[str, Any]], bool]
+
+# Campo de fecha principal de cada tabla (filtros fecha_desde / fecha_hasta)
+DATE_FIELDS: Dict[str, str] = {
+    "Certificados": "fechadevolucion",
+    "Kardex": "fechakardex",
+}
+
+# Campo de fecha de las tablas que no están en DATE_FIELDS
+DATE_FILTER_FIELD = "fechadevolucion"
+
+# Filtros con nombre propio: clave -> (campos comparados con OR, descripción)
+NAMED_FILTERS: Dict[str, Tuple[List[str], str]] = {
+    "coordinador": (["nombrecoordinador"], "coordinador"),
+    "municipio": (["municipiogenerador", "municipiodevolucion"], "municipio"),
+    "municipio_generador": (["municipiogenerador"], "municipio generador"),
+    "municipio_devolucion": (["municipiodevolucion"], "municipio de devolución"),
+}
+
+# Árboles compilados que se conservan (consultas distintas)
+COMPILE_CACHE_SIZE = 512
+
+
+def quote(value: Any) -> str:
+    """Literal de texto para una fórmula de Airtable, con comillas y barras escapadas"""
+    text = field_text(value)
+    return "'" + text.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def field_ref(field: str) -> str:
+    return "{" + field + "}"
+
+
+def _number_literal(value: float) -> str:
+    return field_text(float(value))
+
+
+class Node:
+    """Nodo del árbol de filtros"""
+    
+    # Descripción para el usuario fijada al compilar (si no, se usa la genérica)
+    description: Optional[str] = None
+    
+    def formula(self) -> str:
+        raise NotImplementedError
+    
+    def _build_predicate(self) -> Predicate:
+        raise NotImplementedError
+    
+    def _default_description(self) -> str:
+        raise NotImplementedError
+    
+    def predicate(self) -> Predicate:
+        """Predicado sobre `fields` de un registro (se construye una vez por nodo)"""
+        if getattr(self, "_predicate", None) is None:
+            self._predicate = self._build_predicate()
+        return self._predicate
+    
+    def describe(self) -> str:
+        return self.description if self.description is not None else self._default_description()
+
+
+class Equals(Node):
+    def __init__(self, field: str, value: Any):
+        self.field = field
+        self.value = value
+        self.text = field_text(value)
+    
+    def formula(self) -> str:
+        return f"{field_ref(self.field)}={quote(self.value)}"
+    
+    def _build_predicate(self) -> Predicate:
+        field, expected = self.field, self.text
+        return lambda fields: field_text(fields.get(field)) == expected
+    
+    def _default_description(self) -> str:
+        return f"{self.field} = {self.text}"
+
+
+class In(Node):
+    def __init__(self, field: str, values: List[Any]):
+        self.field = field
+        self.values = list(values)
+        self.texts = [field_text(value) for value in self.values]
+    
+    def formula(self) -> str:
+        if not self.values:
+            return "FALSE()"
+        if len(self.values) == 1:
+            return Equals(self.field, self.values[0]).formula()
+        return "OR(" + ", ".join(Equals(self.field, value).formula() for value in self.values) + ")"
+    
+    def _build_predicate(self) -> Predicate:
+        field, expected = self.field, set(self.texts)
+        return lambda fields: field_text(fields.get(field)) in expected
+    
+    def _default_description(self) -> str:
+        return f"{self.field} en {' o '.join(self.texts)}"
+
+
+class NumberRange(Node):
+    """Rango numérico con límites incluidos (None = abierto)"""
+    
+    def __init__(self, field: str, low: Any = None, high: Any = None):
+        self.field = field
+        self.low = None if low is None else to_number(low)
+        self.high = None if high is None else to_number(high)
+    
+    def formula(self) -> str:
+        parts = []
+        if self.low is not None:
+            parts.append(f"{field_ref(self.field)}>={_number_literal(self.low)}")
+        if self.high is not None:
+            parts.append(f"{field_ref(self.field)}<={_number_literal(self.high)}")
+        if not parts:
+            return ""
+        return parts[0] if len(parts) == 1 else f"AND({', '.join(parts)})"
+    
+    def _build_predicate(self) -> Predicate:
+        field, low, high = self.field, self.low, self.high
+        
+        def predicate(fields):
+            value = to_number(fields.get(field))
+            return (low is None or value >= low) and (high is None or value <= high)
+        return predicate
+    
+    def _default_description(self) -> str:
+        parts = []
+        if self.low is not None:
+            parts.append(f"mínimo {_number_literal(self.low)}")
+        if self.high is not None:
+            parts.append(f"máximo {_number_literal(self.high)}")
+        return f"{self.field} {' y '.join(parts)}"
+
+
+class DateRange(Node):
+    """
+    Rango de fechas con límites estrictos, como IS_AFTER / IS_BEFORE
+    (None = abierto). Un límite que no es una fecha válida no deja pasar
+    ningún registro.
+    """
+    
+    def __init__(self, field: str, after: Any = None, before: Any = None):
+        self.field = field
+        self.after_text = None if after is None else field_text(after)
+        self.before_text = None if before is None else field_text(before)
+        self.after = None if after is None else parse_date(after)
+        self.before = None if before is None else parse_date(before)
+        self.valid = (after is None or self.after is not None) and (before is None or self.before is not None)
+    
+    def formula(self) -> str:
+        if not self.valid:
+            return "FALSE()"
+        parts = []
+        if self.after_text is not None:
+            parts.append(f"IS_AFTER({field_ref(self.field)}, {quote(self.after_text)})")
+        if self.before_text is not None:
+            parts.append(f"IS_BEFORE({field_ref(self.field)}, {quote(self.before_text)})")
+        if not parts:
+            return ""
+        return parts[0] if len(parts) == 1 else f"AND({', '.join(parts)})"
+    
+    def _build_predicate(self) -> Predicate:
+        field, after, before = self.field, self.after, self.before
+        if not self.valid:
+            return lambda fields: False
+        
+        def predicate(fields):
+            moment = parse_date(fields.get(field))
+            return (
+                moment is not None
+                and (after is None or moment > after)
+                and (before is None or moment < before)
+            )
+        return predicate
+    
+    def _default_description(self) -> str:
+        parts = []
+        if self.after_text is not None:
+            parts.append(f"desde {self.after_text}")
+        if self.before_text is not None:
+            parts.append(f"hasta {self.before_text}")
+        return " ".join(parts)
+
+
+class And(Node):
+    def __init__(self, children: List[Node]):
+        self.children = list(children)
+    
+    def formula(self) -> str:
+        parts = [formula for formula in (child.formula() for child in self.children) if formula]
+        if not parts:
+            return ""
+        return parts[0] if len(parts) == 1 else f"AND({', '.join(parts)})"
+    
+    def _build_predicate(self) -> Predicate:
+        predicates = [child.predicate() for child in self.children]
+        if not predicates:
+            return lambda fields: True
+        if len(predicates) == 1:
+            return predicates[0]
+        return lambda fields: all(predicate(fields) for predicate in predicates)
+    
+    def _default_description(self) -> str:
+        return ", ".join(description for description in (child.describe() for child in self.children) if description)
+
+
+class Or(Node):
+    def __init__(self, children: List[Node]):
+        self.children = list(children)
+    
+    def formula(self) -> str:
+        parts = [child.formula() for child in self.children]
+        if not parts:
+            return "FALSE()"
+        return parts[0] if len(parts) == 1 else f"OR({', '.join(parts)})"
+    
+    def _build_predicate(self) -> Predicate:
+        predicates = [child.predicate() for child in self.children]
+        if len(predicates) == 1:
+            return predicates[0]
+        return lambda fields: any(predicate(fields) for predicate in predicates)
+    
+    def _default_description(self) -> str:
+        return " o ".join(child.describe() for child in self.children)
+
+
+def _match(field: str, value: Any) -> Node:
+    return In(field, value) if isinstance(value, list) else Equals(field, value)
+
+
+def _value_text(value: Any) -> str:
+    return " o ".join(field_text(item) for item in value) if isinstance(value, list) else field_text(value)
+
+
+def _range_field(key: str) -> Optional[str]:
+    """Campo de un filtro <campo>_min / <campo>_max (None si la clave no es de rango)"""
+    for suffix in ("_min", "_max"):
+        if key.endswith(suffix) and len(key) > len(suffix):
+            return key[:-len(suffix)]
+    return None
+
+
+def date_field(table_name: Optional[str]) -> str:
+    """Campo de fecha que filtran fecha_desde / fecha_hasta en una tabla"""
+    return DATE_FIELDS.get(table_name, DATE_FILTER_FIELD)
+
+
+def build_tree(filters: Dict[str, Any], table_name: Optional[str] = None) -> And:
+    """
+    Arma el árbol de un diccionario de filtros de state.query (sin caché).
+    
+    Las condiciones se combinan con AND en el orden de las claves; las de
+    fecha usan el campo de fecha de `table_name` (date_field).
+    """
+    dates = date_field(table_name)
+    children: List[Node] = []
+    ranges: Dict[str, NumberRange] = {}
+    
+    for key, value in (filters or {}).items():
+        if key == "fecha_desde":
+            # Un límite vacío no es una fecha válida (no se toma como rango abierto)
+            node = DateRange(dates, after="" if value is None else value)
+            node.description = f"desde {field_text(value)}"
+        elif key == "fecha_hasta":
+            node = DateRange(dates, before="" if value is None else value)
+            node.description = f"hasta {field_text(value)}"
+        elif key in NAMED_FILTERS:
+            fields, label = NAMED_FILTERS[key]
+            matches = [_match(field, value) for field in fields]
+            node = matches[0] if len(matches) == 1 else Or(matches)
+            node.description = f"{label} {_value_text(value)}"
+        elif _range_field(key):
+            field = _range_field(key)
+            node = ranges.get(field)
+            if node is None:
+                node = ranges[field] = NumberRange(field)
+                children.append(node)
+            if key.endswith("_min"):
+                node.low = to_number(value)
+            else:
+                node.high = to_number(value)
+            continue
+        else:
+            node = _match(key, value)
+        children.append(node)
+    
+    return And(children)
+
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def _compile_cached(canonical: str, table_name: Optional[str]) -> And:
+    return build_tree(json.loads(canonical), table_name)
+
+
+def canonical_filters(filters: Dict[str, Any]) -> str:
+    """Forma serializada de los filtros que sirve de clave de la caché de árboles"""
+    return json.dumps(filters or {}, ensure_ascii=False, default=str)
+
+
+def compile_filters(filters: Dict[str, Any], table_name: Optional[str] = None) -> And:
+    """
+    Árbol compilado de los filtros de una tabla, memorizado por consulta.
+    
+    El árbol devuelto se comparte entre llamadas: no se debe modificar.
+    """
+    return _compile_cached(canonical_filters(filters), table_name)
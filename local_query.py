@@ -0,0 +1,115 @@
+"""
+Motor de consultas local: ejecuta los filtros de state.query sobre la copia
+local de Airtable (table_mirror.py) sin llamar a la API.
+
+Los filtros se compilan con filter_ast, el mismo árbol del que sale la
+fórmula que arma queries._build_query_params, así que los predicados locales
+tienen la misma semántica que Airtable (ver filter_ast para la
+correspondencia de cada filtro):
+
+    fecha_desde / fecha_hasta   estrictamente después / antes (IS_AFTER / IS_BEFORE)
+                                sobre la fecha de la tabla (filter_ast.DATE_FIELDS)
+    coordinador, municipio...   '=' de texto: vacío vale '' y los lookups se unen con ", "
+
+Las fechas vacías o no válidas no cumplen IS_AFTER / IS_BEFORE.
+
+Los registros resultantes tienen la forma de la API ({"id", "createdTime",
+"fields"}), así que format_records_for_display funciona igual con ellos.
+"""
+from typing import Dict, List, Any, Optional, Iterable
+
+import filter_ast
+import table_mirror
+from airtable_values import field_text
+from filter_ast import Predicate
+
+
+def compile_filters(filters: Dict[str, Any], table_name: Optional[str] = None) -> Predicate:
+    """
+    Compila el diccionario de filtros en un solo predicado sobre `fields`
+    (todas las condiciones con AND, como la fórmula). El árbol sale de
+    filter_ast, el mismo que genera la fórmula de Airtable para `table_name`.
+    """
+    return filter_ast.compile_filters(filters, table_name).predicate()
+
+
+def _sort_key(value: Any):
+    """Clave de orden: vacíos primero, luego números y luego texto (sin mayúsculas)"""
+    if value is None or value == "" or value == []:
+        return (0, 0, "")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (1, value, "")
+    return (2, 0, field_text(value).casefold())
+
+
+def _apply_sort(records: List[Dict[str, Any]], sort_config: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+    # Orden estable: se aplica del último criterio al primero
+    for sort_item in reversed(sort_config or []):
+        field = sort_item.get("field", "")
+        records.sort(
+            key=lambda record: _sort_key(record.get("fields", {}).get(field)),
+            reverse=sort_item.get("direction", "asc") == "desc"
+        )
+    return records
+
+
+def _project(record: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    """Deja solo los campos pedidos (fields[]), como hace Airtable"""
+    return {
+        "id": record["id"],
+        "createdTime": record.get("createdTime"),
+        "fields": {name: value for name, value in record.get("fields", {}).items() if name in fields}
+    }
+
+
+def run_query(
+    records: Iterable[Dict[str, Any]],
+    filters: Dict[str, Any],
+    fields: Optional[List[str]] = None,
+    sort_config: Optional[List[Dict[str, str]]] = None,
+    limit: Optional[int] = None,
+    table_name: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Ejecuta una consulta sobre registros con forma de la API de Airtable.
+    
+    Args:
+        records: Registros a filtrar (por ejemplo iter_mirror_records)
+        filters: Filtros de state.query
+        fields: Campos a devolver (vacío = todos)
+        sort_config: Ordenamiento [{"field", "direction"}]
+        limit: Máximo de registros (None = todos)
+        table_name: Tabla de los registros (define el campo de fecha de los filtros)
+    
+    Returns:
+        Lista de registros que cumplen los filtros
+    """
+    predicate = compile_filters(filters, table_name)
+    
+    if sort_config:
+        matched = _apply_sort([r for r in records if predicate(r.get("fields", {}))], sort_config)
+        if limit:
+            matched = matched[:limit]
+    else:
+        # Sin orden se puede cortar apenas se llega al límite
+        matched = []
+        for record in records:
+            if predicate(record.get("fields", {})):
+                matched.append(record)
+                if limit and len(matched) >= limit:
+                    break
+    
+    if fields:
+        matched = [_project(record, fields) for record in matched]
+    return matched
+
+
+def query_mirror(
+    table_name: str,
+    filters: Dict[str, Any],
+    fields: Optional[List[str]] = None,
+    sort_config: Optional[List[Dict[str, str]]] = None,
+    limit: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """Ejecuta la consulta sobre la copia local de `table_name`"""
+    return run_query(table_mirror.iter_mirror_records(table_name), filters, fields, sort_config, limit, table_name)
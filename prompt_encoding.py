@@ -0,0 +1,199 @@
+"""
+Codificación compacta de registros para el prompt, con presupuesto de tokens.
+
+run_agent enviaba las filas con `json.dumps(..., indent=2)`: cada fila repite
+todos los nombres de campo, la indentación y los valores por defecto ("N/A",
+0), y eso es la mayor parte de los tokens de entrada. Aquí las filas se
+escriben como una tabla:
+
+    tabla: Certificados (celdas vacías = sin dato o 0)
+    pre_consecutivo|fechadevolucion|nombrecoordinador|total
+    30962|2024-01-15|Andrés Felipe Ramirez|85.25
+    13184|2024-01-20||400
+
+- Los nombres de columna van una sola vez, en la cabecera.
+- Los valores por defecto de cada campo ("N/A", 0, "") quedan vacíos, y las
+  columnas vacías en todas las filas no se incluyen.
+- Las columnas con el mismo valor en todas las filas pasan a la primera línea.
+
+Si la tabla no cabe en el presupuesto (`budget`, en tokens), se quitan filas
+de forma determinista: "sample" (default) toma filas espaciadas de manera
+uniforme sobre todo el rango y "truncate" conserva las primeras. Una nota al
+final dice cuántas filas se muestran.
+
+Los tokens se cuentan con tiktoken si está instalado; si no, se estiman
+(CHARS_PER_TOKEN caracteres por token).
+
+Configuración (variables de entorno opcionales):
+    PROMPT_TABLE_TOKENS     Presupuesto de tokens por tabla (default: 6000)
+    PROMPT_TABLE_STRATEGY   "sample" o "truncate" (default: sample)
+"""
+import os
+import math
+from typing import Dict, List, Any, Optional, Tuple
+
+from airtable_values import field_text
+
+
+DEFAULT_BUDGET = int(os.getenv("PROMPT_TABLE_TOKENS", "6000"))
+DEFAULT_STRATEGY = os.getenv("PROMPT_TABLE_STRATEGY", "sample")
+
+STRATEGIES = ("sample", "truncate")
+
+# Estimación cuando no está tiktoken (texto en español con números)
+CHARS_PER_TOKEN = 4
+
+# Codificación de tiktoken de los modelos de OpenAI actuales
+TIKTOKEN_ENCODING = "o200k_base"
+
+SEPARATOR = "|"
+EMPTY_LEGEND = "(celdas vacías = sin dato o 0)"
+
+_encoding = None
+
+
+def _tiktoken_encoding():
+    """Codificación de tiktoken, o False si no está instalado (se intenta una vez)"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+        except Exception:
+            _encoding = False
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Tokens de un texto (exactos con tiktoken, estimados sin él)"""
+    encoding = _tiktoken_encoding()
+    if encoding:
+        return len(encoding.encode(text))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def cell(value: Any) -> str:
+    """Texto de una celda: números sin ceros de sobra, listas unidas y sin separadores ni saltos"""
+    if isinstance(value, float):
+        text = f"{value:.2f}".rstrip("0").rstrip(".")
+    else:
+        text = field_text(value)
+    return text.replace("\n", " ").replace(SEPARATOR, "/")
+
+
+class EncodedTable:
+    """Resultado de encode_table: texto y cuánto se incluyó"""
+    
+    def __init__(self, text: str, tokens: int, rows_total: int, rows_included: int, strategy: Optional[str]):
+        self.text = text
+        self.tokens = tokens
+        self.rows_total = rows_total
+        self.rows_included = rows_included
+        self.strategy = strategy  # None si cupo todo
+    
+    def metadata(self) -> Dict[str, Any]:
+        return {
+            "tokens": self.tokens,
+            "rows_total": self.rows_total,
+            "rows_included": self.rows_included,
+            "strategy": self.strategy,
+        }
+
+
+def _is_default(value: Any, default: Any) -> bool:
+    return value is None or value == "" or value == [] or (default is not None and value == default)
+
+
+def _layout(
+    rows: List[Dict[str, Any]],
+    defaults: Dict[str, Any]
+) -> Tuple[List[str], List[str], List[str]]:
+    """Columnas variables, línea de constantes y línea de cada fila"""
+    columns: List[str] = []
+    for row in rows:
+        columns.extend(column for column in row if column not in columns)
+    
+    cells = {
+        column: ["" if _is_default(row.get(column), defaults.get(column)) else cell(row.get(column)) for row in rows]
+        for column in columns
+    }
+    constant = {
+        column for column, values in cells.items()
+        if len(rows) > 1 and values[0] and len(set(values)) == 1
+    }
+    constants = [f"{column}: {cells[column][0]}" for column in columns if column in constant]
+    variable = [column for column in columns if any(cells[column]) and column not in constant]
+    lines = [SEPARATOR.join(cells[column][index] for column in variable) for index in range(len(rows))]
+    return variable, constants, lines
+
+
+def _sample_positions(total: int, count: int) -> List[int]:
+    """`count` posiciones espaciadas de manera uniforme en range(total), empezando por la primera"""
+    return [index * total // count for index in range(count)]
+
+
+def encode_table(
+    rows: List[Dict[str, Any]],
+    defaults: Optional[Dict[str, Any]] = None,
+    budget: Optional[int] = None,
+    strategy: Optional[str] = None
+) -> EncodedTable:
+    """
+    Codifica filas (diccionarios planos, p. ej. reshape_records) como tabla compacta.
+    
+    Args:
+        rows: Filas a codificar
+        defaults: Valor por defecto de cada columna (se deja la celda vacía)
+        budget: Máximo de tokens (default: PROMPT_TABLE_TOKENS)
+        strategy: "sample" o "truncate" (default: PROMPT_TABLE_STRATEGY)
+    
+    Returns:
+        EncodedTable con el texto, los tokens usados y las filas incluidas
+    """
+    budget = DEFAULT_BUDGET if budget is None else budget
+    strategy = strategy or DEFAULT_STRATEGY
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Estrategia no soportada: {strategy}")
+    if not rows:
+        return EncodedTable("(sin registros)", count_tokens("(sin registros)"), 0, 0, None)
+    
+    columns, constants, lines = _layout(rows, defaults or {})
+    head = "\n".join([", ".join(constants + [EMPTY_LEGEND]), SEPARATOR.join(columns)])
+    
+    text = head + "\n" + "\n".join(lines)
+    tokens = count_tokens(text)
+    if tokens <= budget:
+        return EncodedTable(text, tokens, len(rows), len(rows), None)
+    
+    # No cabe: se eligen filas con el costo de cada línea (más la nota del final)
+    note = f"(se muestran {{}} de {len(rows)} registros: {'muestra uniforme' if strategy == 'sample' else 'los primeros'})"
+    available = budget - count_tokens(head) - count_tokens(note.format(len(rows)))
+    costs = [count_tokens(line) + 1 for line in lines]
+    
+    if strategy == "truncate":
+        chosen: List[int] = []
+        used = 0
+        for index, cost in enumerate(costs):
+            if used + cost > available:
+                break
+            chosen.append(index)
+            used += cost
+    else:
+        # La mayor muestra uniforme que cabe (búsqueda binaria sobre el tamaño)
+        low, high = 0, len(rows)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if sum(costs[index] for index in _sample_positions(len(rows), middle)) <= available:
+                low = middle
+            else:
+                high = middle - 1
+        chosen = _sample_positions(len(rows), low)
+    
+    # Contar por líneas puede diferir un poco del texto completo: se ajusta al final
+    while True:
+        text = "\n".join([head] + [lines[index] for index in chosen] + [note.format(len(chosen))])
+        tokens = count_tokens(text)
+        if tokens <= budget or not chosen:
+            break
+        chosen = chosen[:-1] if strategy == "truncate" else _sample_positions(len(rows), len(chosen) - 1)
+    return EncodedTable(text, tokens, len(rows), len(chosen), strategy)
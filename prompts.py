@@ -0,0 +1,166 @@
+"""
+Prompts de los agentes armados con segmentos fijos que se cargan una sola vez.
+
+OpenAI reutiliza el prefijo de la entrada que se repite entre peticiones
+(caché de prefijo, desde ~1024 tokens): esos tokens se cobran con descuento
+y se procesan más rápido. Solo funciona si el comienzo de la entrada es
+idéntico byte a byte, así que los segmentos fijos van primero y los datos de
+cada turno (historial, state JSON, resúmenes, pregunta) van al final:
+
+    agent_with_context   system: SYSTEM_INSTRUCTIONS + BUSINESS_CONTEXT + RESPONSE_INSTRUCTIONS
+                         user:   conteos, historial, state JSON y pregunta
+    agent_core (legacy)  BUSINESS_CONTEXT + LEGACY_INSTRUCTIONS, luego los resúmenes y la pregunta
+
+Los segmentos se leen al importar el módulo (al arrancar el servidor), no en
+cada petición; para tomar cambios de agent/system_prompt.txt hay que reiniciar.
+
+`record_usage` toma de `response.usage` los tokens de entrada y los servidos
+desde la caché de prefijo (`input_tokens_details.cached_tokens`) y los
+acumula; `get_metrics` los expone en /metrics.
+"""
+import os
+import threading
+from typing import Dict, List, Any
+
+import prompt_encoding
+
+
+BUSINESS_CONTEXT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent", "system_prompt.txt")
+
+
+# System message: instrucciones del asistente constructor de consultas
+SYSTEM_INSTRUCTIONS = """Eres un asistente inteligente que ayuda a formular consultas a la base de datos de Campolimpio.
+
+TU TRABAJO NO ES SOLO RESPONDER, SINO:
+
+1. Interpretar lo que el usuario quiere consultar
+2. Detectar si la petición es ambigua, incompleta o imposible con los datos disponibles
+3. Construir y actualizar una consulta normalizada en el state_json
+4. Indicar el estado correcto: building, awaiting_clarification, ready_to_execute, executed o cancelled
+
+COMPORTAMIENTO EN CADA TURNO:
+
+- Si la petición es AMBIGUA o FALTA INFORMACIÓN:
+  * Pregunta al usuario qué necesitas (periodo, coordinador, municipio, tipo de material, etc.)
+  * Actualiza state_json marcando qué falta (issues con tipo missing_filter)
+  * Marca status como awaiting_clarification
+  
+- Si el usuario pide algo IMPOSIBLE (campos inexistentes, cálculos no disponibles):
+  * Explica el problema de forma amable
+  * Propón alternativas basadas en los datos reales
+  * Marca un issue con tipo invalid_field o impossible_request
+  
+- Si la consulta está COMPLETA Y VÁLIDA:
+  * Marca status como ready_to_execute
+  * Asegúrate de que query.table, query.type y query.filters estén correctamente definidos
+  
+- Si el usuario CORRIGE algo:
+  * Ajusta el state_json en consecuencia
+  * Explica brevemente el cambio
+
+REGLAS CRÍTICAS:
+
+✓ NUNCA inventes nombres de tablas o campos - usa SOLO los que existen en los datos
+✓ Usa ÚNICAMENTE estas tablas: "Certificados" (recolección) y "Kardex" (movimientos/disposición)
+✓ Mantén mensajes CORTOS y CLAROS, orientados a avanzar en la construcción de la consulta
+✓ Actualiza SIEMPRE el state_json de manera consistente en cada turno
+
+CAMPOS VÁLIDOS:
+
+Tabla Certificados: pre_consecutivo, fechadevolucion, nombrecoordinador, rigidos, flexibles, metalicos, embalaje, total, municipiogenerador, municipiodevolucion, observaciones
+
+Tabla Kardex: idkardex, fechakardex, TipoMovimiento, coordinador, MunicipioOrigen, Reciclaje, Incineración, PlasticoContaminado, Flexibles, Lonas, Carton, Metal, Total, CentrodeAcopio, gestor, Observaciones"""
+
+
+# Formato de la respuesta del asistente constructor de consultas
+RESPONSE_INSTRUCTIONS = """INSTRUCCIONES DE RESPUESTA:
+Responde ÚNICAMENTE con el mensaje que quieres enviar al usuario.
+- Tu respuesta debe ser clara, concisa y natural
+- NO incluyas etiquetas como "MENSAJE:" o "STATE_JSON:"
+- NO incluyas JSON, bloques de código ni información técnica
+- Solo el texto conversacional para el usuario
+
+El sistema se encargará automáticamente de actualizar el state_json."""
+
+# Instrucciones del agente legacy (van antes de los datos para no romper el prefijo)
+LEGACY_INSTRUCTIONS = """Responde la pregunta del Director con análisis detallado basado en los datos proporcionados.
+IDENTIFICA AUTOMÁTICAMENTE qué tabla(s) necesitas usar según la pregunta.
+
+Tienes acceso a datos de AMBAS tablas:"""
+
+
+def _read_segment(path: str) -> str:
+    """Lee un segmento de prompt; vacío si el archivo no existe"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return ""
+
+
+# Se lee una sola vez al importar: evita abrir el archivo en cada turno
+# (y bloquear el event loop del servidor). Reiniciar para tomar cambios.
+BUSINESS_CONTEXT = _read_segment(BUSINESS_CONTEXT_PATH)
+
+
+def _join(*segments: str) -> str:
+    return "\n\n".join(segment.strip() for segment in segments if segment)
+
+
+# Prefijos completos, armados una vez: idénticos en todas las peticiones
+AGENT_SYSTEM_PROMPT = _join(
+    SYSTEM_INSTRUCTIONS,
+    f"=== CONTEXTO DE NEGOCIO ===\n{BUSINESS_CONTEXT}" if BUSINESS_CONTEXT else "",
+    RESPONSE_INSTRUCTIONS,
+)
+LEGACY_PREFIX = _join(BUSINESS_CONTEXT, LEGACY_INSTRUCTIONS)
+
+_usage_lock = threading.Lock()
+_usage = {"responses": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0}
+
+
+def agent_messages(turn: str) -> List[Dict[str, str]]:
+    """Mensajes (system fijo + user con los datos del turno) para agent_with_context"""
+    return [
+        {"role": "system", "content": AGENT_SYSTEM_PROMPT},
+        {"role": "user", "content": turn}
+    ]
+
+
+def legacy_prompt(data: str, question: str) -> str:
+    """Entrada del agente legacy: prefijo fijo, luego los datos y al final la pregunta"""
+    return f"{LEGACY_PREFIX}\n\n{data}\n\nEl Director de Campolimpio pregunta: {question}"
+
+
+def usage_tokens(response: Any) -> Dict[str, int]:
+    """Tokens de entrada, de entrada servidos desde la caché y de salida de una respuesta"""
+    usage = getattr(response, "usage", None)
+    details = getattr(usage, "input_tokens_details", None)
+    return {
+        "input_tokens": getattr(usage, "input_tokens", None) or 0,
+        "cached_tokens": getattr(details, "cached_tokens", None) or 0,
+        "output_tokens": getattr(usage, "output_tokens", None) or 0,
+    }
+
+
+def record_usage(response: Any) -> Dict[str, int]:
+    """Acumula el uso de tokens de una respuesta de OpenAI y lo devuelve"""
+    tokens = usage_tokens(response)
+    with _usage_lock:
+        _usage["responses"] += 1
+        for key, value in tokens.items():
+            _usage[key] += value
+    return tokens
+
+
+def get_metrics() -> Dict[str, Any]:
+    """Tokens acumulados y fracción de los de entrada que vinieron de la caché de prefijo"""
+    with _usage_lock:
+        return {
+            **_usage,
+            "cached_ratio": round(_usage["cached_tokens"] / _usage["input_tokens"], 3) if _usage["input_tokens"] else 0.0,
+            "prefix_tokens": {
+                "agent": prompt_encoding.count_tokens(AGENT_SYSTEM_PROMPT),
+                "legacy": prompt_encoding.count_tokens(LEGACY_PREFIX)
+            },
+        }
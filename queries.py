@@ -2,9 +2,18 @@
 Módulo para ejecutar consultas a Airtable basadas en el estado de conversación.
 """
 import os
+import httpx
 import requests
+import asyncio
 from typing import Dict, List, Any, Tuple, Optional
+import query_cache
+import filter_ast
+import local_query
+import record_format
+import record_store
+import table_mirror
 from conversation_state import ConversationState
+from airtable_client import AirtableAPIError, iter_record_pages, iter_records, aiter_record_pages
 
 
 def execute_query_from_state(state: ConversationState) -> Tuple[str, Optional[List[Dict[str, Any]]], Optional[str]]:
@@ -40,6 +49,145 @@ def execute_query_from_state(state: ConversationState) -> Tuple[str, Optional[Li
         - Los filtros en state.query.filters deben estar normalizados 
           (fechas en formato ISO, nombres exactos, etc.)
     """
+    config_error = _check_query_config(state)
+    if config_error:
+        return config_error
+    
+    api_key = os.getenv("AIRTABLE_API_KEY")
+    base_id = os.getenv("AIRTABLE_BASE_ID")
+    
+    # Extraer información de la query
+    table_name = state.query["table"]
+    filters = state.query.get("filters", {})
+    fields = state.query.get("fields", [])
+    sort_config = state.query.get("sort", [])
+    limit = state.query.get("limit")  # None = todas las páginas
+    
+    # Consulta repetida: responder desde la caché sin llamar a Airtable
+    cache_key = query_cache.make_key(state.query)
+    cached = query_cache.get(cache_key, table_name)
+    if cached:
+        summary, records = cached
+        return (summary, records, None)
+    
+    try:
+        params = _build_query_params(filters, fields, sort_config, table_name)
+        
+        # Ejecutar la consulta siguiendo la paginación de Airtable
+        # (cada página trae como máximo 100 registros)
+        records = []
+        for page in iter_record_pages(base_id, api_key, table_name, params, max_records=limit):
+            records.extend(page)
+        
+        # Devolver resultados
+        summary = _build_result_summary(table_name, filters, records)
+        query_cache.put(cache_key, table_name, summary, records)
+        return (summary, records, None)
+        
+    except Exception as e:
+        return _query_error_result(e)
+
+
+async def execute_query_from_state_async(state: ConversationState) -> Tuple[str, Optional[List[Dict[str, Any]]], Optional[str]]:
+    """
+    Versión asíncrona de execute_query_from_state para el endpoint /ask.
+    
+    Misma construcción de filtros, mensajes y manejo de errores, pero las
+    páginas se piden con el cliente asíncrono compartido de airtable_client,
+    así que no bloquea el event loop del servidor.
+    """
+    config_error = _check_query_config(state)
+    if config_error:
+        return config_error
+    
+    api_key = os.getenv("AIRTABLE_API_KEY")
+    base_id = os.getenv("AIRTABLE_BASE_ID")
+    
+    table_name = state.query["table"]
+    filters = state.query.get("filters", {})
+    fields = state.query.get("fields", [])
+    sort_config = state.query.get("sort", [])
+    limit = state.query.get("limit")  # None = todas las páginas
+    
+    # La caché consulta el estado de la copia local (SQLite): fuera del event loop
+    cache_key = query_cache.make_key(state.query)
+    cached = await asyncio.to_thread(query_cache.get, cache_key, table_name)
+    if cached:
+        summary, records = cached
+        return (summary, records, None)
+    
+    try:
+        params = _build_query_params(filters, fields, sort_config, table_name)
+        
+        records = []
+        async for page in aiter_record_pages(base_id, api_key, table_name, params, max_records=limit):
+            records.extend(page)
+        
+        summary = _build_result_summary(table_name, filters, records)
+        await asyncio.to_thread(query_cache.put, cache_key, table_name, summary, records)
+        return (summary, records, None)
+        
+    except Exception as e:
+        return _query_error_result(e)
+
+
+def execute_query_from_mirror(state: ConversationState) -> Tuple[str, Optional[List[Dict[str, Any]]], Optional[str]]:
+    """
+    Ejecuta la consulta de state.query sobre la copia local (table_mirror),
+    sin llamar a Airtable.
+    
+    Los filtros se evalúan sobre las columnas de record_store (o con
+    local_query si usan un campo que no está en columnas), con la misma
+    semántica que la fórmula enviada a Airtable, así que devuelve los mismos
+    registros que execute_query_from_state (y el mismo formato de resultado).
+    
+    Returns:
+        Misma tupla (result_summary, records, error) que execute_query_from_state
+    """
+    table_name = state.query.get("table")
+    if not table_name:
+        return (
+            "No se puede ejecutar la consulta porque no se ha especificado la tabla.",
+            None,
+            "table no definida en state.query"
+        )
+    
+    if not table_mirror.is_configured() or not table_mirror.get_sync_info(table_name)["ready"]:
+        return (
+            "Lo siento, los datos locales todavía no están disponibles. Intenta de nuevo en unos minutos.",
+            None,
+            f"La copia local de {table_name} no está lista"
+        )
+    
+    filters = state.query.get("filters", {})
+    fields = state.query.get("fields", [])
+    sort_config = state.query.get("sort", [])
+    limit = state.query.get("limit")
+    try:
+        store = record_store.get_store(table_name) if table_name in record_store.DATE_FIELDS else None
+        rows = store.filter(filters) if store else None
+        
+        if rows is None:
+            # Filtro sobre un campo que no está en columnas: se evalúan los registros completos
+            records = local_query.query_mirror(table_name, filters, fields, sort_config, limit)
+        else:
+            if limit and not sort_config:
+                rows = rows[:limit]
+            matched = table_mirror.get_mirror_records(table_name, [store.ids[row] for row in rows])
+            records = local_query.run_query(matched, {}, fields, sort_config, limit)
+        return (_build_result_summary(table_name, filters, records), records, None)
+    
+    except Exception as e:
+        return _query_error_result(e)
+
+
+def _check_query_config(state: ConversationState) -> Optional[Tuple[str, None, str]]:
+    """
+    Verifica la configuración de Airtable y que state.query tenga tabla.
+    
+    Returns:
+        Tupla de error (result_summary, None, error) o None si todo está bien
+    """
     # Validar configuración
     api_key = os.getenv("AIRTABLE_API_KEY")
     base_id = os.getenv("AIRTABLE_BASE_ID")
@@ -67,172 +215,123 @@ def execute_query_from_state(state: ConversationState) -> Tuple[str, Optional[Li
             "table no definida en state.query"
         )
     
-    filters = state.query.get("filters", {})
-    fields = state.query.get("fields", [])
-    sort_config = state.query.get("sort", [])
-    limit = state.query.get("limit", 100)
+    return None
+
+
+def _build_query_params(
+    filters: Dict[str, Any],
+    fields: List[str],
+    sort_config: List[Dict[str, str]],
+    table_name: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Traduce filtros, campos y ordenamiento de state.query a parámetros de la API de Airtable.
     
-    try:
-        # Construir URL
-        url = f"https://api.airtable.com/v0/{base_id}/{table_name}"
-        
-        # Construir headers
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        # Construir parámetros
-        params = {
-            "maxRecords": limit
-        }
-        
-        # Agregar filtros como fórmula de Airtable
-        if filters:
-            formula_parts = []
-            for key, value in filters.items():
-                # Construir condiciones según el tipo de filtro
-                if key == "fecha_desde":
-                    formula_parts.append(f"IS_AFTER({{fechadevolucion}}, '{value}')")
-                elif key == "fecha_hasta":
-                    formula_parts.append(f"IS_BEFORE({{fechadevolucion}}, '{value}')")
-                elif key == "coordinador":
-                    formula_parts.append(f"{{nombrecoordinador}}='{value}'")
-                elif key == "municipio":
-                    # Puede ser municipio generador o de devolución
-                    formula_parts.append(
-                        f"OR({{municipiogenerador}}='{value}', {{municipiodevolucion}}='{value}')"
-                    )
-                elif key == "municipio_generador":
-                    formula_parts.append(f"{{municipiogenerador}}='{value}'")
-                elif key == "municipio_devolucion":
-                    formula_parts.append(f"{{municipiodevolucion}}='{value}'")
-                else:
-                    # Filtro genérico: buscar campo con el nombre del key
-                    formula_parts.append(f"{{{key}}}='{value}'")
-            
-            # Combinar todas las partes con AND
-            if formula_parts:
-                if len(formula_parts) == 1:
-                    params["filterByFormula"] = formula_parts[0]
-                else:
-                    params["filterByFormula"] = f"AND({', '.join(formula_parts)})"
-        
-        # Agregar campos específicos si están definidos
-        if fields:
-            # Airtable acepta fields[] como parámetro repetido
-            for field in fields:
-                params.setdefault("fields[]", []).append(field)
-        
-        # Agregar ordenamiento si está definido
-        if sort_config:
-            # Airtable acepta sort[0][field], sort[0][direction], etc.
-            for i, sort_item in enumerate(sort_config):
-                params[f"sort[{i}][field]"] = sort_item.get("field", "")
-                params[f"sort[{i}][direction]"] = sort_item.get("direction", "asc")
-        
-        # Ejecutar la consulta
-        response = requests.get(url, params=params, headers=headers, timeout=30)
-        
-        # Verificar respuesta
-        if response.status_code != 200:
-            error_detail = response.text
-            try:
-                error_json = response.json()
-                error_message = error_json.get("error", {}).get("message", error_detail)
-            except:
-                error_message = error_detail
-            
-            return (
-                f"Lo siento, hubo un problema al consultar la base de datos (código {response.status_code}). Por favor, intenta de nuevo más tarde.",
-                None,
-                f"Airtable API error {response.status_code}: {error_message}"
-            )
-        
-        # Procesar resultados
-        data = response.json()
-        records = data.get("records", [])
+    Las fechas se filtran por el campo de fecha de `table_name` (filter_ast.DATE_FIELDS).
+    """
+    # Construir parámetros
+    params = {}
+    
+    # Agregar filtros como fórmula de Airtable (valores escapados)
+    formula = filter_ast.compile_filters(filters, table_name).formula()
+    if formula:
+        params["filterByFormula"] = formula
+    
+    # Agregar campos específicos si están definidos
+    if fields:
+        # Airtable acepta fields[] como parámetro repetido
+        for field in fields:
+            params.setdefault("fields[]", []).append(field)
+    
+    # Agregar ordenamiento si está definido
+    if sort_config:
+        # Airtable acepta sort[0][field], sort[0][direction], etc.
+        for i, sort_item in enumerate(sort_config):
+            params[f"sort[{i}][field]"] = sort_item.get("field", "")
+            params[f"sort[{i}][direction]"] = sort_item.get("direction", "asc")
+    
+    return params
+
+
+def _build_result_summary(
+    table_name: str,
+    filters: Dict[str, Any],
+    records: List[Dict[str, Any]]
+) -> str:
+    """
+    Construye el mensaje para el usuario a partir de los registros obtenidos.
+    """
+    # Construir resumen para el usuario
+    if not records:
+        # Construir descripción de los filtros aplicados
+        filter_description = _build_filter_description(filters)
+        result_summary = f"No se encontraron registros en {table_name}"
+        if filter_description:
+            result_summary += f" con los filtros: {filter_description}"
+        result_summary += "."
+    else:
+        count = len(records)
+        filter_description = _build_filter_description(filters)
         
-        # Construir resumen para el usuario
-        if not records:
-            # Construir descripción de los filtros aplicados
-            filter_description = _build_filter_description(filters)
-            result_summary = f"No se encontraron registros en {table_name}"
-            if filter_description:
-                result_summary += f" con los filtros: {filter_description}"
-            result_summary += "."
+        # Personalizar mensaje según la tabla
+        if table_name == "Certificados":
+            result_summary = f"Encontré {count} certificado{'s' if count != 1 else ''} de recolección"
+        elif table_name == "Kardex":
+            result_summary = f"Encontré {count} registro{'s' if count != 1 else ''} de movimientos"
         else:
-            count = len(records)
-            filter_description = _build_filter_description(filters)
-            
-            # Personalizar mensaje según la tabla
-            if table_name == "Certificados":
-                result_summary = f"Encontré {count} certificado{'s' if count != 1 else ''} de recolección"
-            elif table_name == "Kardex":
-                result_summary = f"Encontré {count} registro{'s' if count != 1 else ''} de movimientos"
-            else:
-                result_summary = f"Encontré {count} registro{'s' if count != 1 else ''} en {table_name}"
-            
-            if filter_description:
-                result_summary += f" que cumple{'n' if count != 1 else ''} con: {filter_description}"
-            
-            result_summary += "."
+            result_summary = f"Encontré {count} registro{'s' if count != 1 else ''} en {table_name}"
         
-        # Devolver resultados
-        return (result_summary, records, None)
+        if filter_description:
+            result_summary += f" que cumple{'n' if count != 1 else ''} con: {filter_description}"
         
-    except requests.exceptions.Timeout:
+        result_summary += "."
+    
+    return result_summary
+
+
+def _query_error_result(e: Exception) -> Tuple[str, None, str]:
+    """
+    Convierte una excepción de la consulta (síncrona o asíncrona) en la tupla
+    (result_summary amigable, None, error técnico).
+    """
+    if isinstance(e, AirtableAPIError):
+        return (
+            f"Lo siento, hubo un problema al consultar la base de datos (código {e.status_code}). Por favor, intenta de nuevo más tarde.",
+            None,
+            str(e)
+        )
+    if isinstance(e, (requests.exceptions.Timeout, httpx.TimeoutException)):
         return (
             "Lo siento, la consulta está tardando demasiado. Por favor, intenta de nuevo o usa filtros más específicos.",
             None,
             "Timeout al consultar Airtable"
         )
-    except requests.exceptions.ConnectionError:
+    if isinstance(e, (requests.exceptions.ConnectionError, httpx.TransportError)):
         return (
             "Lo siento, no puedo conectarme a la base de datos en este momento. Por favor, verifica tu conexión a internet e intenta de nuevo.",
             None,
             "ConnectionError al consultar Airtable"
         )
-    except Exception as e:
-        return (
-            "Lo siento, ocurrió un error inesperado al ejecutar la consulta. Por favor, intenta de nuevo.",
-            None,
-            f"Error inesperado: {type(e).__name__}: {str(e)}"
-        )
+    return (
+        "Lo siento, ocurrió un error inesperado al ejecutar la consulta. Por favor, intenta de nuevo.",
+        None,
+        f"Error inesperado: {type(e).__name__}: {str(e)}"
+    )
 
 
 def _build_filter_description(filters: Dict[str, Any]) -> str:
     """
     Construye una descripción legible de los filtros aplicados.
     
+    Sale del mismo árbol (filter_ast) que la fórmula enviada a Airtable.
+    
     Args:
         filters: Diccionario de filtros aplicados
     
     Returns:
         String con descripción amigable de los filtros
     """
-    if not filters:
-        return ""
-    
-    descriptions = []
-    
-    for key, value in filters.items():
-        if key == "fecha_desde":
-            descriptions.append(f"desde {value}")
-        elif key == "fecha_hasta":
-            descriptions.append(f"hasta {value}")
-        elif key == "coordinador":
-            descriptions.append(f"coordinador {value}")
-        elif key == "municipio":
-            descriptions.append(f"municipio {value}")
-        elif key == "municipio_generador":
-            descriptions.append(f"municipio generador {value}")
-        elif key == "municipio_devolucion":
-            descriptions.append(f"municipio de devolución {value}")
-        else:
-            descriptions.append(f"{key} = {value}")
-    
-    return ", ".join(descriptions)
+    return filter_ast.compile_filters(filters).describe()
 
 
 def format_records_for_display(
@@ -243,6 +342,10 @@ def format_records_for_display(
     """
     Formatea los registros de Airtable en un formato legible para el usuario.
     
+    El texto sale de las plantillas de plantillas/registros (ver
+    record_format.py); para listados grandes o por ventanas usar
+    record_format.iter_formatted, que no arma el texto completo.
+    
     Args:
         records: Lista de registros devueltos por Airtable
         table_name: Nombre de la tabla ("Certificados" o "Kardex")
@@ -251,73 +354,4 @@ def format_records_for_display(
     Returns:
         String formateado con la información de los registros
     """
-    if not records:
-        return "No hay registros para mostrar."
-    
-    if format_type == "json":
-        import json
-        return json.dumps(records, indent=2, ensure_ascii=False)
-    
-    # Formato de resumen o detallado
-    output_lines = []
-    
-    if table_name == "Certificados":
-        for i, record in enumerate(records, 1):
-            fields = record.get("fields", {})
-            if format_type == "summary":
-                output_lines.append(
-                    f"{i}. {fields.get('pre_consecutivo', 'N/A')} - "
-                    f"Coordinador: {fields.get('nombrecoordinador', 'N/A')} - "
-                    f"Total: {fields.get('total', 0)} kg"
-                )
-            else:  # detailed
-                output_lines.append(f"\n=== Certificado #{i} ===")
-                output_lines.append(f"Consecutivo: {fields.get('pre_consecutivo', 'N/A')}")
-                output_lines.append(f"Fecha devolución: {fields.get('fechadevolucion', 'N/A')}")
-                output_lines.append(f"Coordinador: {fields.get('nombrecoordinador', 'N/A')}")
-                output_lines.append(f"Municipio generador: {fields.get('municipiogenerador', 'N/A')}")
-                output_lines.append(f"Municipio devolución: {fields.get('municipiodevolucion', 'N/A')}")
-                output_lines.append(f"Materiales:")
-                output_lines.append(f"  - Rígidos: {fields.get('rigidos', 0)} kg")
-                output_lines.append(f"  - Flexibles: {fields.get('flexibles', 0)} kg")
-                output_lines.append(f"  - Metálicos: {fields.get('metalicos', 0)} kg")
-                output_lines.append(f"  - Embalaje: {fields.get('embalaje', 0)} kg")
-                output_lines.append(f"Total: {fields.get('total', 0)} kg")
-    
-    elif table_name == "Kardex":
-        for i, record in enumerate(records, 1):
-            fields = record.get("fields", {})
-            if format_type == "summary":
-                output_lines.append(
-                    f"{i}. {fields.get('idkardex', 'N/A')} - "
-                    f"{fields.get('TipoMovimiento', 'N/A')} - "
-                    f"Total: {fields.get('Total', 0)} kg"
-                )
-            else:  # detailed
-                output_lines.append(f"\n=== Movimiento #{i} ===")
-                output_lines.append(f"ID Kardex: {fields.get('idkardex', 'N/A')}")
-                output_lines.append(f"Fecha: {fields.get('fechakardex', 'N/A')}")
-                output_lines.append(f"Tipo movimiento: {fields.get('TipoMovimiento', 'N/A')}")
-                output_lines.append(f"Coordinador: {fields.get('Name (from Coordinador)', 'N/A')}")
-                output_lines.append(f"Municipio origen: {fields.get('MunicipioOrigen', 'N/A')}")
-                output_lines.append(f"Centro de acopio: {fields.get('NombreCentrodeAcopio', 'N/A')}")
-                output_lines.append(f"Gestor: {fields.get('nombregestor', 'N/A')}")
-                output_lines.append(f"Disposición:")
-                output_lines.append(f"  - Reciclaje: {fields.get('Reciclaje', 0)} kg")
-                output_lines.append(f"  - Incineración: {fields.get('Incineración', 0)} kg")
-                output_lines.append(f"  - Plástico contaminado: {fields.get('PlasticoContaminado', 0)} kg")
-                output_lines.append(f"Materiales:")
-                output_lines.append(f"  - Flexibles: {fields.get('Flexibles', 0)} kg")
-                output_lines.append(f"  - Lonas: {fields.get('Lonas', 0)} kg")
-                output_lines.append(f"  - Cartón: {fields.get('Carton', 0)} kg")
-                output_lines.append(f"  - Metal: {fields.get('Metal', 0)} kg")
-                output_lines.append(f"Total: {fields.get('Total', 0)} kg")
-    else:
-        # Tabla desconocida - formato genérico
-        for i, record in enumerate(records, 1):
-            fields = record.get("fields", {})
-            output_lines.append(f"\n=== Registro #{i} ===")
-            for key, value in fields.items():
-                output_lines.append(f"{key}: {value}")
-    
-    return "\n".join(output_lines)
+    return record_format.format_records(records, table_name, format_type)
@@ -0,0 +1,158 @@
+"""
+Caché de resultados de execute_query_from_state.
+
+Los directores piden muchas veces el mismo reporte ("consolidado del mes
+pasado"). La caché guarda (result_summary, registros) con una clave que es
+un hash canónico de `state.query`: tabla, filtros ordenados, campos, orden y
+límite. Una consulta repetida no llama a Airtable. Los registros se copian al
+guardar y al devolver, así que el llamador puede modificarlos sin tocar la
+entrada guardada.
+
+Una entrada deja de valer cuando:
+- vence su TTL,
+- sube la versión de datos de la copia local de su tabla (table_mirror:
+  solo cambia cuando una sincronización modifica registros, no en cada
+  sincronización), o
+- se necesita espacio: se descarta la usada hace más tiempo (LRU) hasta
+  quedar por debajo del límite de memoria.
+
+Configuración (variables de entorno opcionales):
+    QUERY_CACHE_TTL         Segundos que vale un resultado (default: 600)
+    QUERY_CACHE_MAX_BYTES   Memoria máxima estimada de la caché (default: 50 MB)
+    QUERY_CACHE_ENABLED     "0" para desactivarla
+"""
+import os
+import copy
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
+
+import table_mirror
+
+
+CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "600"))
+CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "1") != "0"
+
+# Claves de state.query que definen el resultado ("type" y "validated" no lo cambian)
+KEY_FIELDS = ("table", "filters", "fields", "sort", "limit")
+
+
+class _Entry:
+    def __init__(self, summary: str, records: List[Dict[str, Any]], version: Optional[int], size: int):
+        self.summary = summary
+        self.records = records
+        self.version = version
+        self.size = size
+        self.stored_at = time.monotonic()
+
+
+_entries: "OrderedDict[str, _Entry]" = OrderedDict()
+_lock = threading.Lock()
+_total_bytes = 0
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+
+def make_key(query: Dict[str, Any]) -> str:
+    """
+    Hash canónico de una query: el mismo reporte da la misma clave sin
+    importar el orden en que se fueron agregando los filtros o los campos.
+    """
+    canonical = {key: query.get(key) for key in KEY_FIELDS}
+    canonical["filters"] = canonical["filters"] or {}
+    canonical["fields"] = sorted(canonical["fields"] or [])
+    canonical["sort"] = canonical["sort"] or []
+    payload = json.dumps(canonical, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _current_version(table_name: str) -> Optional[int]:
+    """Versión de datos de la copia local de la tabla (None si no hay copia)"""
+    if not table_mirror.is_configured():
+        return None
+    try:
+        return table_mirror.get_sync_info(table_name)["version"]
+    except Exception:
+        return None  # Sin información de la copia: las entradas con versión no valen
+
+
+def _remove(key: str):
+    global _total_bytes
+    entry = _entries.pop(key)
+    _total_bytes -= entry.size
+
+
+def get(key: str, table_name: str) -> Optional[Tuple[str, List[Dict[str, Any]]]]:
+    """
+    Busca un resultado en la caché.
+    
+    Returns:
+        Tupla (result_summary, registros) o None si no está o ya no vale
+    """
+    if not CACHE_ENABLED:
+        return None
+    
+    version = _current_version(table_name)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            _stats["misses"] += 1
+            return None
+        
+        if time.monotonic() - entry.stored_at > CACHE_TTL or entry.version != version:
+            _remove(key)
+            _stats["invalidations"] += 1
+            _stats["misses"] += 1
+            return None
+        
+        _entries.move_to_end(key)
+        _stats["hits"] += 1
+        return entry.summary, copy.deepcopy(entry.records)
+
+
+def put(key: str, table_name: str, summary: str, records: List[Dict[str, Any]]):
+    """Guarda un resultado y descarta los menos usados si se pasa del límite de memoria"""
+    global _total_bytes
+    if not CACHE_ENABLED:
+        return
+    
+    # Tamaño aproximado: lo que ocuparían los registros serializados
+    size = len(json.dumps(records, ensure_ascii=False, default=str)) + len(summary)
+    if size > CACHE_MAX_BYTES:
+        return
+    
+    entry = _Entry(summary, copy.deepcopy(records), _current_version(table_name), size)
+    with _lock:
+        if key in _entries:
+            _remove(key)
+        _entries[key] = entry
+        _total_bytes += size
+        
+        while _total_bytes > CACHE_MAX_BYTES:
+            oldest = next(iter(_entries))
+            _remove(oldest)
+            _stats["evictions"] += 1
+
+
+def clear():
+    """Vacía la caché (no reinicia los contadores)"""
+    global _total_bytes
+    with _lock:
+        _entries.clear()
+        _total_bytes = 0
+
+
+def get_metrics() -> Dict[str, Any]:
+    """Contadores de aciertos / fallos y ocupación de la caché"""
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "hit_rate": round(_stats["hits"] / lookups, 3) if lookups else 0.0,
+            "entries": len(_entries),
+            "bytes": _total_bytes,
+            "max_bytes": CACHE_MAX_BYTES
+        }
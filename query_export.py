@@ -0,0 +1,184 @@
+"""
+Exportación en streaming de los registros de una consulta (CSV o NDJSON).
+
+GET /export/{conversation_id} vuelve a ejecutar el state.query guardado de
+la conversación y envía los registros a medida que llegan las páginas, sin
+armar la respuesta completa en memoria: cada página (100 registros de
+Airtable, o EXPORT_BATCH_SIZE de la copia local) se codifica y se entrega
+como un bloque, así que exportar miles de registros usa memoria constante.
+
+La fuente la elige query_planner: si la copia local está al día se leen
+las posiciones que cumplen los filtros en record_store y los registros se
+cargan por lotes; si no (o si la consulta tiene orden o un filtro fuera de
+las columnas), se siguen las páginas de Airtable.
+
+Formatos:
+    csv      Una columna por campo (los de state.query["fields"] o, si está
+             vacío, los que aparecen en la primera página), más id y
+             createdTime. Los lookups se unen con ", ".
+    ndjson   Un registro de Airtable por línea ({"id", "createdTime", "fields"}).
+
+Ejemplo:
+    >>> pages, error = await aopen_export(state)
+    >>> async for chunk in aencode_pages(pages, "csv", state.query.get("fields")):
+    ...     response.write(chunk)
+"""
+import io
+import os
+import csv
+import json
+import asyncio
+from typing import Dict, List, Any, Optional, Tuple, Iterator, AsyncIterator
+
+import record_store
+import table_mirror
+import query_planner
+from airtable_client import aiter_record_pages
+from airtable_values import field_text
+from conversation_state import ConversationState
+from local_query import run_query
+from queries import _build_query_params, _check_query_config
+
+
+EXPORT_FORMATS: Dict[str, str] = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+# Registros que se cargan de la copia local por bloque
+EXPORT_BATCH_SIZE = 500
+
+# Columnas fijas del CSV (antes de los campos)
+RECORD_COLUMNS = ["id", "createdTime"]
+
+Pages = AsyncIterator[List[Dict[str, Any]]]
+
+
+def export_filename(state: ConversationState, export_format: str) -> str:
+    return f"{state.query.get('table') or 'consulta'}_{state.meta['conversation_id']}.{export_format}"
+
+
+def mirror_pages(state: ConversationState) -> Optional[Iterator[List[Dict[str, Any]]]]:
+    """
+    Páginas de registros desde la copia local, o None si la consulta no se
+    puede resolver con las columnas de record_store (orden, filtros sobre
+    otros campos, tabla sin almacén).
+    """
+    table_name = state.query.get("table")
+    if state.query.get("sort") or table_name not in record_store.DATE_FIELDS:
+        return None
+    store = record_store.get_store(table_name)
+    rows = store.filter(state.query.get("filters", {})) if store else None
+    if rows is None:
+        return None
+    
+    limit = state.query.get("limit")
+    if limit:
+        rows = rows[:limit]
+    ids = [store.ids[row] for row in rows]
+    fields = state.query.get("fields") or None
+    
+    def pages():
+        for start in range(0, len(ids), EXPORT_BATCH_SIZE):
+            batch = table_mirror.get_mirror_records(table_name, ids[start:start + EXPORT_BATCH_SIZE])
+            yield run_query(batch, {}, fields)
+    return pages()
+
+
+async def _aiter_sync_pages(pages: Iterator[List[Dict[str, Any]]]) -> Pages:
+    """Recorre un generador de páginas de SQLite sin bloquear el event loop"""
+    while True:
+        page = await asyncio.to_thread(next, pages, None)
+        if page is None:
+            break
+        yield page
+
+
+async def aopen_export(
+    state: ConversationState,
+    max_staleness: Optional[float] = None
+) -> Tuple[Optional[Pages], Optional[str]]:
+    """
+    Prepara la exportación de state.query antes de empezar a enviar la respuesta.
+    
+    Returns:
+        Tupla (páginas, error): un iterador asíncrono de páginas de registros,
+        o None y un mensaje de error si la consulta no se puede ejecutar
+    """
+    if not state.query.get("table"):
+        return None, "table no definida en state.query"
+    
+    plan = await asyncio.to_thread(query_planner.plan_query, state, max_staleness)
+    if plan["source"] != query_planner.PLAN_REMOTE:
+        pages = await asyncio.to_thread(mirror_pages, state)
+        if pages is not None:
+            return _aiter_sync_pages(pages), None
+    
+    config_error = _check_query_config(state)
+    if config_error:
+        return None, config_error[2]
+    
+    params = _build_query_params(
+        state.query.get("filters", {}),
+        state.query.get("fields", []),
+        state.query.get("sort", []),
+        state.query["table"]
+    )
+    pages = aiter_record_pages(
+        os.getenv("AIRTABLE_BASE_ID"),
+        os.getenv("AIRTABLE_API_KEY"),
+        state.query["table"],
+        params,
+        max_records=state.query.get("limit")
+    )
+    return pages, None
+
+
+def csv_columns(fields: Optional[List[str]], first_page: List[Dict[str, Any]]) -> List[str]:
+    """Columnas del CSV: los campos pedidos o, si no hay, los de la primera página en orden de aparición"""
+    if fields:
+        return RECORD_COLUMNS + list(fields)
+    seen: Dict[str, None] = {}
+    for record in first_page:
+        seen.update((name, None) for name in record.get("fields", {}))
+    return RECORD_COLUMNS + list(seen)
+
+
+def encode_csv(page: List[Dict[str, Any]], columns: List[str], header: bool = False) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(columns)
+    for record in page:
+        fields = record.get("fields", {})
+        row = [record.get("id", ""), record.get("createdTime", "")]
+        row.extend(field_text(fields.get(column)) for column in columns[len(RECORD_COLUMNS):])
+        writer.writerow(row)
+    return buffer.getvalue()
+
+
+def encode_ndjson(page: List[Dict[str, Any]]) -> str:
+    return "".join(
+        json.dumps(
+            {"id": record.get("id"), "createdTime": record.get("createdTime"), "fields": record.get("fields", {})},
+            ensure_ascii=False
+        ) + "\n"
+        for record in page
+    )
+
+
+async def aencode_pages(pages: Pages, export_format: str, fields: Optional[List[str]] = None) -> AsyncIterator[str]:
+    """Un bloque de texto por página, en el formato pedido ("csv" o "ndjson")"""
+    columns = None
+    async for page in pages:
+        if export_format == "ndjson":
+            yield encode_ndjson(page)
+        elif columns is None:
+            columns = csv_columns(fields, page)
+            yield encode_csv(page, columns, header=True)
+        else:
+            yield encode_csv(page, columns)
+    
+    if export_format == "csv" and columns is None:
+        # Sin registros: solo la cabecera
+        yield encode_csv([], csv_columns(fields, []), header=True)
@@ -0,0 +1,279 @@
+"""
+Planificador de consultas: decide de dónde sale cada resultado.
+
+Con la copia local (table_mirror) hay tres formas de responder state.query:
+
+    rollup   Consolidados mensuales (rollups.py): O(grupos). Solo para
+             totales agrupados (state.query["group_by"]) con filtros de
+             igualdad sobre las columnas de los consolidados.
+    local    Recorrido de la copia local (record_store / local_query):
+             milisegundos, cualquier filtro.
+    remote   Consulta paginada a Airtable (execute_query_from_state): la
+             más lenta, pero con los datos al día.
+
+La copia local solo se usa si su última sincronización es más reciente que
+la tolerancia de la petición (`max_staleness`, en segundos); si no, o si no
+está lista, se consulta Airtable. Entre las locales se prefiere el rollup
+cuando puede responder. Si el plan local falla se repite en remoto.
+
+El plan que se ejecutó y su duración quedan en state.execution["plan"]:
+
+    {"source": "local", "reason": "...", "max_staleness": 600,
+     "mirror_age_seconds": 42.1, "elapsed_ms": 3.2}
+
+Con group_by el resultado son filas de totales por grupo (mismo formato que
+aggregations.aggregate) en lugar de registros, y el resumen incluye la tabla.
+
+Configuración (variables de entorno opcionales):
+    QUERY_MAX_STALENESS   Antigüedad máxima aceptada de la copia local en
+                          segundos (default: 600); "0" consulta siempre Airtable
+"""
+import os
+import time
+import asyncio
+from typing import Dict, List, Any, Optional, Tuple
+
+import rollups
+import table_mirror
+import record_store
+from aggregations import Columns, DIMENSIONS, EMPTY_GROUP, aggregate, format_table
+from airtable_values import field_text
+from conversation_state import ConversationState
+from queries import (
+    execute_query_from_state,
+    execute_query_from_state_async,
+    execute_query_from_mirror,
+    _build_filter_description,
+    _query_error_result,
+)
+
+
+DEFAULT_MAX_STALENESS = float(os.getenv("QUERY_MAX_STALENESS", "600"))
+
+PLAN_ROLLUP = "rollup"
+PLAN_LOCAL = "local"
+PLAN_REMOTE = "remote"
+
+# Filtros de state.query que se pueden resolver con los consolidados -> columna
+ROLLUP_FILTERS: Dict[str, Dict[str, str]] = {
+    "Certificados": {
+        "coordinador": "coordinador",
+        "municipio_generador": "municipio",
+    },
+    "Kardex": {
+        "Name (from Coordinador)": "coordinador",
+        "NombreCentrodeAcopio": "centro_acopio",
+        "nombregestor": "gestor",
+        "TipoMovimiento": "tipo_movimiento",
+    },
+}
+
+# Grupos que se muestran en el resumen de una consulta agrupada
+MAX_GROUP_ROWS = 30
+
+QueryResult = Tuple[str, Optional[List[Dict[str, Any]]], Optional[str]]
+
+
+def rollup_where(table_name: str, filters: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    """
+    Condiciones sobre los consolidados equivalentes a los filtros, o None si
+    algún filtro no se puede resolver con ellos (fechas, listas, otros campos).
+    
+    Los rangos de fecha quedan fuera a propósito: sus límites son estrictos
+    por día y no coinciden con meses completos.
+    """
+    columns = ROLLUP_FILTERS.get(table_name, {})
+    where = {}
+    for key, value in (filters or {}).items():
+        if key not in columns or isinstance(value, (list, dict)):
+            return None
+        where[columns[key]] = field_text(value) or EMPTY_GROUP
+    return where
+
+
+def _rollup_answers(table_name: str, query: Dict[str, Any]) -> bool:
+    group_by = query.get("group_by")
+    if not group_by or not rollups.has_rollups(table_name):
+        return False
+    if group_by != "mes" and group_by not in rollups.ROLLUP_DIMENSIONS[table_name]:
+        return False
+    # Los consolidados cubren la tabla completa: con límite u orden no equivalen
+    if query.get("limit") or query.get("sort"):
+        return False
+    return rollup_where(table_name, query.get("filters", {})) is not None
+
+
+def choose_plan(
+    query: Dict[str, Any],
+    mirror_info: Dict[str, Any],
+    max_staleness: float
+) -> Dict[str, Any]:
+    """
+    Elige el plan de una consulta (sin ejecutar nada).
+    
+    Args:
+        query: state.query
+        mirror_info: Estado de la copia local de la tabla (table_mirror.get_sync_info)
+        max_staleness: Antigüedad máxima aceptada de la copia local, en segundos
+    
+    Returns:
+        Diccionario con source ("rollup", "local" o "remote"), reason,
+        max_staleness y mirror_age_seconds
+    """
+    age = mirror_info.get("age_seconds")
+    plan = {"max_staleness": max_staleness, "mirror_age_seconds": None if age is None else round(age, 1)}
+    
+    if max_staleness <= 0:
+        return dict(plan, source=PLAN_REMOTE, reason="la petición pide datos al día")
+    if not mirror_info.get("ready"):
+        return dict(plan, source=PLAN_REMOTE, reason="la copia local no está lista")
+    if age is None or age > max_staleness:
+        return dict(plan, source=PLAN_REMOTE, reason=f"la copia local tiene más de {max_staleness:g} s")
+    
+    if _rollup_answers(query.get("table"), query):
+        return dict(plan, source=PLAN_ROLLUP, reason="totales agrupados disponibles en los consolidados")
+    return dict(plan, source=PLAN_LOCAL, reason="la copia local está al día")
+
+
+def plan_query(state: ConversationState, max_staleness: Optional[float] = None) -> Dict[str, Any]:
+    """Plan para state.query según la frescura actual de la copia local"""
+    if max_staleness is None:
+        max_staleness = DEFAULT_MAX_STALENESS
+    table_name = state.query.get("table")
+    mirror_info = table_mirror.get_sync_info(table_name) if table_name else {"ready": False}
+    return choose_plan(state.query, mirror_info, float(max_staleness))
+
+
+def _check_group_by(state: ConversationState) -> Optional[QueryResult]:
+    group_by = state.query.get("group_by")
+    table_name = state.query.get("table")
+    if group_by and group_by not in DIMENSIONS.get(table_name, {}):
+        return (
+            f"Lo siento, no puedo agrupar {table_name} por '{group_by}'.",
+            None,
+            f"group_by no válido para {table_name}: {group_by}"
+        )
+    return None
+
+
+def _grouped_result(state: ConversationState, rows: List[Dict[str, Any]]) -> QueryResult:
+    """Resultado de una consulta agrupada: resumen con la tabla de totales y las filas"""
+    table_name = state.query["table"]
+    group_by = state.query["group_by"]
+    description = _build_filter_description(state.query.get("filters", {}))
+    
+    header = f"Totales de {table_name} por {group_by.replace('_', ' ')}"
+    if description:
+        header += f" ({description})"
+    if not rows:
+        return (f"No se encontraron registros en {table_name}" +
+                (f" con los filtros: {description}." if description else "."), rows, None)
+    return (f"{header}:\n{format_table(rows, MAX_GROUP_ROWS)}", rows, None)
+
+
+def _run_rollup(state: ConversationState) -> QueryResult:
+    table_name = state.query["table"]
+    try:
+        where = rollup_where(table_name, state.query.get("filters", {}))
+        rows = rollups.summarize(table_name, table_mirror.get_rollups(table_name), state.query["group_by"], where)
+        return _grouped_result(state, rows)
+    except Exception as e:
+        return _query_error_result(e)
+
+
+def _run_local(state: ConversationState) -> QueryResult:
+    if not state.query.get("group_by"):
+        return execute_query_from_mirror(state)
+    
+    table_name = state.query["table"]
+    filters = state.query.get("filters", {})
+    limit = state.query.get("limit")
+    try:
+        store = record_store.get_store(table_name) if table_name in record_store.DATE_FIELDS else None
+        rows = store.filter(filters) if store and not state.query.get("sort") else None
+        if rows is None:
+            summary, records, error = execute_query_from_mirror(state)
+            if error:
+                return (summary, records, error)
+            return _grouped_result(state, aggregate(Columns(table_name, records), state.query["group_by"]))
+        
+        if limit:
+            rows = rows[:limit]
+        return _grouped_result(state, aggregate(store.select(rows), state.query["group_by"]))
+    except Exception as e:
+        return _query_error_result(e)
+
+
+def _group_remote(state: ConversationState, result: QueryResult) -> QueryResult:
+    summary, records, error = result
+    if error or not state.query.get("group_by"):
+        return result
+    return _grouped_result(state, aggregate(Columns(state.query["table"], records), state.query["group_by"]))
+
+
+def _record_plan(state: ConversationState, plan: Dict[str, Any], started: float):
+    plan["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    state.execution["plan"] = plan
+
+
+def execute_planned_query(state: ConversationState, max_staleness: Optional[float] = None) -> QueryResult:
+    """
+    Ejecuta state.query con el plan más barato que cumple la tolerancia.
+    
+    Args:
+        state: ConversationState validado
+        max_staleness: Antigüedad máxima aceptada de la copia local en
+            segundos (default: QUERY_MAX_STALENESS; 0 = siempre Airtable)
+    
+    Returns:
+        Misma tupla (result_summary, records, error) que execute_query_from_state;
+        con group_by, records son las filas de totales por grupo.
+        El plan ejecutado y su duración quedan en state.execution["plan"].
+    """
+    started = time.perf_counter()
+    plan = plan_query(state, max_staleness)
+    
+    result = _check_group_by(state)
+    if result is None:
+        if plan["source"] == PLAN_ROLLUP:
+            result = _run_rollup(state)
+        elif plan["source"] == PLAN_LOCAL:
+            result = _run_local(state)
+        
+        if result is not None and result[2]:
+            plan["fallback"] = f"{plan['source']}: {result[2]}"
+            plan["source"] = PLAN_REMOTE
+            result = None
+        if result is None:
+            result = _group_remote(state, execute_query_from_state(state))
+    
+    _record_plan(state, plan, started)
+    return result
+
+
+async def execute_planned_query_async(state: ConversationState, max_staleness: Optional[float] = None) -> QueryResult:
+    """
+    Versión asíncrona de execute_planned_query para el endpoint /ask.
+    
+    Los planes locales leen SQLite y se ejecutan en un hilo; el remoto usa
+    el cliente asíncrono de Airtable.
+    """
+    started = time.perf_counter()
+    plan = await asyncio.to_thread(plan_query, state, max_staleness)
+    
+    result = _check_group_by(state)
+    if result is None:
+        if plan["source"] == PLAN_ROLLUP:
+            result = await asyncio.to_thread(_run_rollup, state)
+        elif plan["source"] == PLAN_LOCAL:
+            result = await asyncio.to_thread(_run_local, state)
+        
+        if result is not None and result[2]:
+            plan["fallback"] = f"{plan['source']}: {result[2]}"
+            plan["source"] = PLAN_REMOTE
+            result = None
+        if result is None:
+            result = _group_remote(state, await execute_query_from_state_async(state))
+    
+    _record_plan(state, plan, started)
+    return result
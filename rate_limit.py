@@ -0,0 +1,162 @@
+"""
+Limitador de tasa para la API de Airtable.
+
+Airtable permite 5 peticiones por segundo por base. Este módulo mantiene un
+token bucket por BASE ID compartido por todo el proceso (hilos y corrutinas),
+de modo que cuando hay ráfagas (por ejemplo, flujos de TextIt que se abren
+en paralelo) las llamadas esperan su turno en lugar de fallar con 429.
+
+Cuando Airtable responde 429 igualmente, `backoff_delay` calcula la espera
+(respetando `Retry-After` si viene) y `TokenBucket.throttle` la aplica a todo
+el bucket, así que el resto de llamadas a la misma base también se frenan.
+
+Configuración (variables de entorno opcionales):
+    AIRTABLE_RATE_LIMIT    Peticiones por segundo por base (default: 5)
+    AIRTABLE_MAX_RETRIES   Reintentos ante 429 antes de devolver el error (default: 5)
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+from typing import Dict, Any, Optional
+
+
+RATE_LIMIT = float(os.getenv("AIRTABLE_RATE_LIMIT", "5"))
+MAX_RETRIES = int(os.getenv("AIRTABLE_MAX_RETRIES", "5"))
+
+# Backoff exponencial cuando no hay Retry-After: 0.5s, 1s, 2s, ... hasta 30s
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+_limiters: Dict[str, "TokenBucket"] = {}
+_limiters_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Token bucket con reserva de turnos.
+    
+    Cada llamada toma un token; si no hay, el contador queda en negativo y la
+    llamada sabe exactamente cuánto debe esperar. Así las esperas se reparten
+    en orden de llegada sin que nadie tenga que sondear el bucket.
+    """
+    
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        
+        # Métricas
+        self.requests = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.waited_requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.throttled = 0
+    
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def reserve(self) -> float:
+        """Reserva un turno y devuelve los segundos que hay que esperar (0 si hay token)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            self.requests += 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+    
+    def throttle(self, delay: float):
+        """Vacía el bucket para que nadie llame a esta base durante `delay` segundos"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, -delay * self.rate)
+            self.throttled += 1
+    
+    def _start_wait(self):
+        with self._lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+    
+    def _end_wait(self, wait: float):
+        with self._lock:
+            self.waiting -= 1
+            self.waited_requests += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+    
+    def acquire(self):
+        """Espera (bloqueando el hilo) hasta que haya turno"""
+        wait = self.reserve()
+        if wait > 0:
+            self._start_wait()
+            try:
+                time.sleep(wait)
+            finally:
+                self._end_wait(wait)
+    
+    async def acquire_async(self):
+        """Espera sin bloquear el event loop hasta que haya turno"""
+        wait = self.reserve()
+        if wait > 0:
+            self._start_wait()
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._end_wait(wait)
+    
+    def metrics(self) -> Dict[str, Any]:
+        """Métricas acumuladas del bucket"""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "queue_depth": self.waiting,
+                "max_queue_depth": self.max_waiting,
+                "waited_requests": self.waited_requests,
+                "total_wait_seconds": round(self.total_wait, 3),
+                "max_wait_seconds": round(self.max_wait, 3),
+                "avg_wait_seconds": round(self.total_wait / self.waited_requests, 3) if self.waited_requests else 0.0,
+                "throttled_429": self.throttled
+            }
+
+
+def get_limiter(base_id: str) -> TokenBucket:
+    """Devuelve el limitador compartido de una base (lo crea la primera vez)"""
+    limiter = _limiters.get(base_id)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(base_id)
+            if limiter is None:
+                limiter = TokenBucket(RATE_LIMIT)
+                _limiters[base_id] = limiter
+    return limiter
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """
+    Segundos a esperar antes del reintento `attempt` (0, 1, 2, ...).
+    
+    Si Airtable envía `Retry-After` (en segundos) se respeta como mínimo;
+    si no, backoff exponencial con jitter completo para que las llamadas
+    que recibieron 429 a la vez no reintenten todas juntas.
+    """
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+    if retry_after:
+        try:
+            delay = float(retry_after) + random.uniform(0, BACKOFF_BASE)
+        except ValueError:
+            pass  # Formato fecha HTTP: usar el backoff calculado
+    return delay
+
+
+def get_metrics() -> Dict[str, Dict[str, Any]]:
+    """Métricas de todos los limitadores, por BASE ID"""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {base_id: limiter.metrics() for base_id, limiter in limiters.items()}
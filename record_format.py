@@ -0,0 +1,117 @@
+"""
+Formato de registros para el usuario a partir de plantillas Jinja.
+
+Cada tabla tiene una plantilla por formato en `plantillas/registros/` que
+describe un solo registro (recibe `i`, su número, y `fields`):
+
+    certificados_summary.txt.j2     1. C-1 - Coordinador: Ana - Total: 12 kg
+    certificados_detailed.txt.j2    bloque "=== Certificado #1 ===" con materiales
+    kardex_summary.txt.j2 / kardex_detailed.txt.j2
+    registro_detailed.txt.j2        tablas sin plantilla: todos los campos
+
+Las plantillas se compilan una vez al importar el módulo. `iter_formatted`
+es un generador: entrega el texto registro por registro, acepta cualquier
+iterable (p. ej. páginas de Airtable a medida que llegan) y con start/stop
+formatea solo una ventana (registros 100 a 200) sin recorrer el resto más
+allá de `stop`. Unir los bloques da exactamente el texto que armaba antes
+queries.format_records_for_display.
+
+Ejemplo:
+    >>> for chunk in iter_formatted(records, "Certificados", "detailed", start=100, stop=200):
+    ...     enviar(chunk)
+"""
+import os
+import json
+import textwrap
+from itertools import islice
+from typing import Dict, Any, Optional, Iterable, Iterator, Tuple
+from jinja2 import Environment, FileSystemLoader, Template
+
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plantillas", "registros")
+
+# (tabla, formato) -> plantilla; las tablas que no aparecen usan GENERIC_TEMPLATE
+TEMPLATE_NAMES: Dict[Tuple[str, str], str] = {
+    ("Certificados", "summary"): "certificados_summary.txt.j2",
+    ("Certificados", "detailed"): "certificados_detailed.txt.j2",
+    ("Kardex", "summary"): "kardex_summary.txt.j2",
+    ("Kardex", "detailed"): "kardex_detailed.txt.j2",
+}
+GENERIC_TEMPLATE = "registro_detailed.txt.j2"
+
+EMPTY_MESSAGE = "No hay registros para mostrar."
+
+_env = Environment(loader=FileSystemLoader(TEMPLATES_DIR), autoescape=False)
+
+# Plantillas compiladas una sola vez
+_templates: Dict[str, Template] = {
+    name: _env.get_template(name) for name in set(TEMPLATE_NAMES.values()) | {GENERIC_TEMPLATE}
+}
+
+
+def get_template(table_name: str, format_type: str) -> Template:
+    """Plantilla de un registro; cualquier formato distinto de "summary" es "detailed" """
+    kind = "summary" if format_type == "summary" else "detailed"
+    return _templates[TEMPLATE_NAMES.get((table_name, kind), GENERIC_TEMPLATE)]
+
+
+def _json_blocks(numbered: Iterable[Tuple[int, Dict[str, Any]]]) -> Iterator[str]:
+    """Los registros como una lista JSON con indent=2, un registro por bloque"""
+    first = True
+    for _, record in numbered:
+        text = textwrap.indent(json.dumps(record, indent=2, ensure_ascii=False), "  ")
+        yield ("[\n" if first else ",\n") + text
+        first = False
+    if not first:
+        yield "\n]"
+
+
+def iter_formatted(
+    records: Iterable[Dict[str, Any]],
+    table_name: str,
+    format_type: str = "summary",
+    start: int = 0,
+    stop: Optional[int] = None
+) -> Iterator[str]:
+    """
+    Genera el texto de los registros bloque por bloque.
+    
+    Args:
+        records: Registros de Airtable (lista o cualquier iterable)
+        table_name: Nombre de la tabla ("Certificados" o "Kardex")
+        format_type: "summary" (resumen), "detailed" (detallado) o "json"
+        start, stop: Ventana de registros a formatear (posiciones desde 0, como
+            un slice); la numeración conserva la posición original
+    
+    Yields:
+        El texto de cada registro (con el separador delante), o el mensaje de
+        "no hay registros" si la ventana está vacía
+    """
+    numbered = islice(enumerate(records, 1), start, stop)
+    
+    if format_type == "json":
+        blocks = _json_blocks(numbered)
+    else:
+        template = get_template(table_name, format_type)
+        blocks = (
+            ("\n" if position > 0 else "") + template.render(i=i, fields=record.get("fields", {}))
+            for position, (i, record) in enumerate(numbered)
+        )
+    
+    empty = True
+    for block in blocks:
+        empty = False
+        yield block
+    if empty:
+        yield EMPTY_MESSAGE
+
+
+def format_records(
+    records: Iterable[Dict[str, Any]],
+    table_name: str,
+    format_type: str = "summary",
+    start: int = 0,
+    stop: Optional[int] = None
+) -> str:
+    """Texto completo de los registros (o de la ventana start:stop)"""
+    return "".join(iter_formatted(records, table_name, format_type, start, stop))
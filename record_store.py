@@ -0,0 +1,423 @@
+"""
+Almacén columnar en memoria para Certificados y Kardex.
+
+En lugar de un diccionario de ~15 claves por registro, los campos que se
+filtran y se suman se guardan como columnas:
+
+- Materiales (kg): `array('d')`, 8 bytes por fila.
+- Coordinador, municipios, gestor, centro de acopio, tipo de movimiento y el
+  texto de la fecha: codificados con diccionario (`array('l')` de códigos y
+  la lista de valores distintos), así que cada nombre se guarda una sola vez.
+  Cada una tiene un índice invertido (texto -> posiciones de las filas) y
+  `municipio` tiene uno combinado de municipio generador y de devolución.
+- Fecha (fechadevolucion / fechakardex): timestamp UTC en `array('d')`
+  (NaN si está vacía o no es válida), con un índice ordenado (`DateIndex`)
+  para que un periodo sea una búsqueda binaria y no un recorrido completo.
+
+Los filtros de state.query se evalúan con los índices (`RecordStore.filter`),
+con la misma semántica que local_query: cada filtro da una lista ordenada de
+posiciones y se intersecan empezando por la más corta, buscando cada una de
+sus posiciones en las demás, sin recorrer las filas que no cumplen. El
+almacén tiene la misma interfaz que `aggregations.Columns` (`measures`,
+`group_codes`), así que `aggregations.aggregate` corre directamente sobre él.
+Los registros completos siguen en la copia local; el almacén devuelve
+posiciones y con `ids` se leen solo los registros que cumplen los filtros.
+
+Se construye desde la copia local (table_mirror) y se reconstruye cuando
+cambia la versión de datos de la tabla (`get_store`).
+"""
+import math
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional, Iterable, Sequence, Tuple
+
+import filter_ast
+import table_mirror
+from aggregations import MEASURES, DIMENSIONS, EMPTY_GROUP
+from airtable_values import field_text, parse_date, to_number
+
+
+# Campo de fecha principal de cada tabla (el mismo que filtran fecha_desde / fecha_hasta)
+DATE_FIELDS: Dict[str, str] = filter_ast.DATE_FIELDS
+
+# Campos con pocos valores distintos: se codifican con diccionario
+CATEGORICAL_FIELDS: Dict[str, List[str]] = {
+    "Certificados": ["nombrecoordinador", "municipiogenerador", "municipiodevolucion"],
+    "Kardex": ["Name (from Coordinador)", "MunicipioOrigen", "nombregestor", "NombreCentrodeAcopio", "TipoMovimiento"],
+}
+
+_EPOCH = datetime(1970, 1, 1)
+
+# table_name -> ((engine, versión de la copia local), almacén)
+_stores: Dict[str, Tuple[tuple, "RecordStore"]] = {}
+_stores_lock = threading.Lock()
+
+# Un lock por tabla para que una versión nueva se construya una sola vez
+_build_locks: Dict[str, threading.Lock] = {}
+
+
+def _timestamp(moment: Optional[datetime]) -> Optional[float]:
+    return None if moment is None else (moment - _EPOCH).total_seconds()
+
+
+def date_value(value: Any) -> float:
+    """Fecha de Airtable como timestamp UTC (NaN si está vacía o no es válida)"""
+    moment = parse_date(value)
+    if moment is None:
+        return math.nan
+    return (moment - _EPOCH).total_seconds()
+
+
+def date_from_value(value: float) -> Optional[datetime]:
+    """Inverso de date_value: timestamp UTC -> datetime (None si es NaN)"""
+    return None if math.isnan(value) else _EPOCH + timedelta(seconds=value)
+
+
+class EncodedColumn:
+    """Columna codificada con diccionario: un código entero por fila"""
+    
+    def __init__(self):
+        self.codes = array("l")
+        self.values: List[Any] = []  # Valor original de cada código
+        self.texts: List[str] = []   # Texto que compara Airtable con '=' (field_text)
+        self._index: Dict[str, int] = {}
+        self._postings: Optional[Dict[str, array]] = None
+    
+    def append(self, value: Any):
+        key = repr(value)
+        code = self._index.get(key)
+        if code is None:
+            code = self._index[key] = len(self.values)
+            self.values.append(value)
+            self.texts.append(field_text(value))
+        self.codes.append(code)
+        self._postings = None
+    
+    @property
+    def postings(self) -> Dict[str, array]:
+        """
+        Índice invertido: texto comparable -> posiciones (ordenadas) de las filas.
+        
+        Valores distintos con el mismo texto ("Ana" y ["Ana"]) comparten lista,
+        igual que en la fórmula. Se construye la primera vez que se usa.
+        """
+        if self._postings is None:
+            postings: Dict[str, array] = {}
+            by_code = [postings.setdefault(text, array("l")) for text in self.texts]
+            for row, code in enumerate(self.codes):
+                by_code[code].append(row)
+            self._postings = postings
+        return self._postings
+    
+    def select(self, rows: Iterable[int]) -> "EncodedColumn":
+        """Mismas filas indicadas, compartiendo el diccionario"""
+        selected = EncodedColumn()
+        selected.values, selected.texts, selected._index = self.values, self.texts, self._index
+        selected.codes = array("l", (self.codes[row] for row in rows))
+        return selected
+    
+    def memory_bytes(self) -> int:
+        total = self.codes.itemsize * len(self.codes) + sum(len(text) for text in self.texts)
+        if self._postings is not None:
+            total += sum(rows.itemsize * len(rows) for rows in self._postings.values())
+        return total
+
+
+def intersect(short: Sequence[int], long: Sequence[int]) -> List[int]:
+    """
+    Intersección de dos listas ordenadas de posiciones.
+    
+    Recorre solo la lista más corta y busca cada posición en la larga con
+    búsqueda binaria, avanzando desde la última encontrada.
+    """
+    if len(short) > len(long):
+        short, long = long, short
+    result = []
+    low, end = 0, len(long)
+    for row in short:
+        low = bisect_left(long, row, low, end)
+        if low == end:
+            break
+        if long[low] == row:
+            result.append(row)
+    return result
+
+
+class DateIndex:
+    """
+    Posiciones de las filas ordenadas por fecha (sin las fechas vacías).
+    
+    `range` usa límites estrictos, como IS_AFTER / IS_BEFORE: una fila con
+    exactamente la fecha del límite no entra, y un límite None deja el
+    rango abierto por ese lado.
+    """
+    
+    def __init__(self, dates: array):
+        order = sorted((row for row, moment in enumerate(dates) if not math.isnan(moment)), key=dates.__getitem__)
+        self.rows = array("l", order)
+        self.keys = array("d", (dates[row] for row in order))
+    
+    def range(self, after: Optional[float] = None, before: Optional[float] = None) -> List[int]:
+        """Posiciones (en orden de fila) con after < fecha < before"""
+        start = 0 if after is None else bisect_right(self.keys, after)
+        end = len(self.keys) if before is None else bisect_left(self.keys, before)
+        if start >= end:
+            return []
+        return sorted(self.rows[start:end])
+
+
+class RecordStore:
+    """Columnas de una tabla, construidas a partir de registros con forma de la API"""
+    
+    def __init__(self, table_name: str, records: Iterable[Dict[str, Any]] = ()):
+        if table_name not in DATE_FIELDS:
+            raise ValueError(f"Tabla sin almacén columnar: {table_name}")
+        self.table_name = table_name
+        self.date_field = DATE_FIELDS[table_name]
+        self.ids: List[str] = []
+        self.measures: Dict[str, array] = {measure: array("d") for measure in MEASURES[table_name]}
+        self.dates = array("d")
+        self.categorical: Dict[str, EncodedColumn] = {
+            field: EncodedColumn() for field in CATEGORICAL_FIELDS[table_name] + [self.date_field]
+        }
+        self._groups: Dict[str, tuple] = {}
+        self._date_index: Optional[DateIndex] = None
+        self._combined: Dict[Tuple[str, ...], Dict[str, array]] = {}
+        
+        for record in records:
+            self.append(record)
+    
+    def append(self, record: Dict[str, Any]):
+        """Agrega un registro ({"id", "fields"}) al final de las columnas"""
+        fields = record.get("fields", {})
+        self.ids.append(record["id"])
+        for measure, column in self.measures.items():
+            column.append(to_number(fields.get(measure)))
+        self.dates.append(date_value(fields.get(self.date_field)))
+        for field, column in self.categorical.items():
+            column.append(fields.get(field))
+        self._groups.clear()
+        self._date_index = None
+        self._combined.clear()
+    
+    @property
+    def size(self) -> int:
+        return len(self.ids)
+    
+    def memory_bytes(self) -> int:
+        """Memoria aproximada de las columnas (sin contar los ids)"""
+        total = sum(column.itemsize * len(column) for column in self.measures.values())
+        total += self.dates.itemsize * len(self.dates)
+        total += sum(column.memory_bytes() for column in self.categorical.values())
+        return total
+    
+    def _field_postings(self, field: str) -> Optional[Dict[str, array]]:
+        column = self.categorical.get(field)
+        return column.postings if column is not None else None
+    
+    def _combined_postings(self, fields: Tuple[str, ...]) -> Optional[Dict[str, array]]:
+        """Índice invertido de una igualdad sobre varios campos con OR (p. ej. municipio)"""
+        if fields not in self._combined:
+            indexes = [self._field_postings(field) for field in fields]
+            if any(index is None for index in indexes):
+                return None
+            texts = set().union(*indexes)
+            self._combined[fields] = {
+                text: array("l", sorted(set().union(*(index.get(text, ()) for index in indexes))))
+                for text in texts
+            }
+        return self._combined[fields]
+    
+    @property
+    def date_index(self) -> DateIndex:
+        """Índice ordenado de la fecha de la tabla (se construye la primera vez)"""
+        if self._date_index is None:
+            self._date_index = DateIndex(self.dates)
+        return self._date_index
+    
+    def date_range(self, fecha_desde: Any = None, fecha_hasta: Any = None) -> List[int]:
+        """
+        Posiciones con fecha estrictamente entre fecha_desde y fecha_hasta
+        (cualquiera de los dos puede ser None). Un límite que no es una fecha
+        válida no deja pasar ninguna fila, igual que la fórmula.
+        """
+        after = None if fecha_desde is None else date_value(fecha_desde)
+        before = None if fecha_hasta is None else date_value(fecha_hasta)
+        if (after is not None and math.isnan(after)) or (before is not None and math.isnan(before)):
+            return []
+        return self.date_index.range(after, before)
+    
+    def match(self, node: filter_ast.Node) -> Optional[Sequence[int]]:
+        """
+        Posiciones (ordenadas) de las filas que cumplen un nodo de filter_ast.
+        
+        Returns:
+            Lista ordenada de posiciones, o None si el nodo usa un campo que el
+            almacén no tiene (hay que evaluar los registros completos)
+        """
+        if isinstance(node, filter_ast.Equals):
+            index = self._field_postings(node.field)
+            return None if index is None else index.get(node.text, ())
+        
+        if isinstance(node, filter_ast.In):
+            index = self._field_postings(node.field)
+            if index is None:
+                return None
+            return sorted(set().union(*(index.get(text, ()) for text in node.texts)))
+        
+        if isinstance(node, filter_ast.DateRange):
+            if node.field != self.date_field:
+                return None
+            if not node.valid:
+                return []
+            return self.date_index.range(_timestamp(node.after), _timestamp(node.before))
+        
+        if isinstance(node, filter_ast.NumberRange):
+            values = self.measures.get(node.field)
+            if values is None:
+                return None
+            low = -math.inf if node.low is None else node.low
+            high = math.inf if node.high is None else node.high
+            return [row for row, value in enumerate(values) if low <= value <= high]
+        
+        if isinstance(node, filter_ast.Or):
+            children = node.children
+            # La misma igualdad sobre varios campos (municipio): índice combinado
+            if children and all(isinstance(child, filter_ast.Equals) for child in children) \
+                    and len({child.text for child in children}) == 1:
+                index = self._combined_postings(tuple(child.field for child in children))
+                if index is not None:
+                    return index.get(children[0].text, ())
+            parts = [self.match(child) for child in children]
+            if any(part is None for part in parts):
+                return None
+            return sorted(set().union(*parts))
+        
+        if isinstance(node, filter_ast.And):
+            candidates = []
+            for child in node.children:
+                rows = self.match(child)
+                if rows is None:
+                    return None
+                candidates.append(rows)
+            if not candidates:
+                return range(self.size)
+            
+            # Se parte de la lista más corta
+            candidates.sort(key=len)
+            rows = list(candidates[0])
+            for other in candidates[1:]:
+                if not rows:
+                    break
+                rows = intersect(rows, other)
+            return rows
+        
+        return None
+    
+    def filter(self, filters: Dict[str, Any]) -> Optional[List[int]]:
+        """
+        Posiciones (en orden) de las filas que cumplen los filtros de state.query.
+        
+        Usa el mismo árbol (filter_ast) que la fórmula de Airtable y el motor
+        local, así que la semántica es la misma: '=' de texto, fechas
+        estrictas y AND entre filtros.
+        
+        Returns:
+            Lista de posiciones, o None si algún filtro usa un campo que el
+            almacén no tiene (hay que evaluar los registros completos)
+        """
+        rows = self.match(filter_ast.compile_filters(filters, self.table_name))
+        return None if rows is None else list(rows)
+    
+    def group_codes(self, dimension: str):
+        """Devuelve (códigos por fila, etiquetas por código), como Columns.group_codes"""
+        if dimension not in self._groups:
+            field = DIMENSIONS[self.table_name].get(dimension)
+            if field is None or field not in self.categorical:
+                raise ValueError(f"No se puede agrupar {self.table_name} por '{dimension}'")
+            
+            column = self.categorical[field]
+            if dimension == "mes":
+                moments = (parse_date(value) for value in column.values)
+                code_labels = [moment.strftime("%Y-%m") if moment else EMPTY_GROUP for moment in moments]
+            else:
+                code_labels = [text or EMPTY_GROUP for text in column.texts]
+            
+            # Códigos de grupo en orden de aparición, como Columns; varios valores
+            # pueden dar la misma etiqueta ("Ana" y ["Ana"], dos días del mismo mes)
+            labels: List[str] = []
+            index: Dict[str, int] = {}
+            remap: Dict[int, int] = {}
+            codes = array("l")
+            for code in column.codes:
+                group = remap.get(code)
+                if group is None:
+                    label = code_labels[code]
+                    group = index.get(label)
+                    if group is None:
+                        group = index[label] = len(labels)
+                        labels.append(label)
+                    remap[code] = group
+                codes.append(group)
+            self._groups[dimension] = (codes, labels)
+        return self._groups[dimension]
+    
+    def select(self, rows: List[int]) -> "RecordStore":
+        """Nuevo almacén con solo las filas indicadas (para agregar lo filtrado)"""
+        subset = RecordStore(self.table_name)
+        subset.ids = [self.ids[row] for row in rows]
+        subset.measures = {measure: array("d", (column[row] for row in rows)) for measure, column in self.measures.items()}
+        subset.dates = array("d", (self.dates[row] for row in rows))
+        subset.categorical = {field: column.select(rows) for field, column in self.categorical.items()}
+        return subset
+
+
+def _cached_store(table_name: str, built_from: tuple) -> Optional[RecordStore]:
+    with _stores_lock:
+        cached = _stores.get(table_name)
+    if cached and cached[0] == built_from:
+        return cached[1]
+    return None
+
+
+def get_store(table_name: str) -> Optional[RecordStore]:
+    """
+    Almacén de una tabla, reconstruido solo cuando cambia la versión de la copia local.
+    
+    Si varios hilos piden la tabla justo después de una sincronización, uno
+    construye el almacén y los demás esperan ese mismo resultado.
+    
+    Returns:
+        RecordStore, o None si la copia local no está lista
+    """
+    if not table_mirror.is_configured():
+        return None
+    info = table_mirror.get_sync_info(table_name)
+    if not info["ready"]:
+        return None
+    
+    built_from = (table_mirror.engine, info["version"])
+    store = _cached_store(table_name, built_from)
+    if store is not None:
+        return store
+    
+    with _stores_lock:
+        build_lock = _build_locks.setdefault(table_name, threading.Lock())
+    with build_lock:
+        # Otro hilo pudo construirlo mientras se esperaba el lock
+        store = _cached_store(table_name, built_from)
+        if store is None:
+            store = RecordStore(table_name, table_mirror.iter_mirror_records(table_name))
+            with _stores_lock:
+                _stores[table_name] = (built_from, store)
+    return store
+
+
+def invalidate(table_name: Optional[str] = None):
+    """Descarta los almacenes construidos (de una tabla o de todas)"""
+    with _stores_lock:
+        for name in list(_stores):
+            if table_name is None or name == table_name:
+                del _stores[name]
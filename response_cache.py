@@ -0,0 +1,253 @@
+"""
+Caché persistente (SQLite) de las respuestas del agente conversacional.
+
+TextIt reintenta las peticiones que tardan y los directores repiten las
+mismas preguntas; cada repetición era una llamada completa a
+`responses.create`. Aquí se guarda el texto que devolvió el modelo con una
+clave que resume todo lo que determina la respuesta:
+
+- la pregunta normalizada (minúsculas, espacios y signos de los extremos),
+- los campos del estado que van en el prompt: status, step, pending_question,
+  query, issues y los mensajes previos del historial que ve el agente,
+- la versión de datos de cada tabla de la copia local (table_mirror), que
+  sube con cada sincronización que cambia registros,
+- el modelo y el prefijo fijo del prompt (prompts.py).
+
+En un acierto se aplica la respuesta guardada al estado igual que si viniera
+de OpenAI (`_apply_agent_response`), sin gastar tokens. Solo se guardan
+respuestas exitosas. Las entradas vencen con el TTL y, al pasar de
+RESPONSE_CACHE_MAX_ENTRIES, se descartan las usadas hace más tiempo (LRU).
+Con `extra["no_cache"]` se ignora la caché y la respuesta nueva reemplaza
+la guardada.
+
+Configuración (variables de entorno opcionales):
+    RESPONSE_CACHE_DATABASE_URL   URL de SQLAlchemy (default: sqlite:///./response_cache.db)
+    RESPONSE_CACHE_TTL            Segundos que vale una respuesta (default: 3600)
+    RESPONSE_CACHE_MAX_ENTRIES    Máximo de respuestas guardadas (default: 1000)
+    RESPONSE_CACHE_ENABLED        "0" para desactivarla
+"""
+import os
+import re
+import json
+import hashlib
+import threading
+import unicodedata
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional, Tuple
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+import prompts
+import table_mirror
+from conversation_state import ConversationState
+
+
+RESPONSE_CACHE_DATABASE_URL = os.getenv("RESPONSE_CACHE_DATABASE_URL", "sqlite:///./response_cache.db")
+CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") != "0"
+
+# Mensajes previos del historial que entran en la clave (el prompt incluye los últimos 3 con la pregunta)
+HISTORY_MESSAGES = 2
+
+# Campos de state.conversation que cambian el prompt (los demás son registro del último turno)
+CONVERSATION_FIELDS = ("status", "step", "pending_question")
+
+# Huella del prefijo fijo: si cambian las instrucciones, las respuestas guardadas dejan de valer
+PREFIX_HASH = hashlib.sha256((prompts.AGENT_SYSTEM_PROMPT + prompts.LEGACY_PREFIX).encode("utf-8")).hexdigest()
+
+Base = declarative_base()
+engine = None
+SessionLocal = None
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "bypassed": 0, "expired": 0, "evictions": 0}
+
+
+class CachedResponse(Base):
+    """Texto de una respuesta del agente para una clave"""
+    __tablename__ = "agent_response_cache"
+    
+    key = Column(String, primary_key=True)
+    response_text = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    last_used_at = Column(DateTime, nullable=False, index=True)
+    hits = Column(Integer, nullable=False, default=0)
+
+
+def configure(database_url: str = RESPONSE_CACHE_DATABASE_URL):
+    """(Re)configura la base de datos de la caché y crea la tabla"""
+    global engine, SessionLocal
+    engine = create_engine(database_url, connect_args={"check_same_thread": False})
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+
+def _open_session():
+    """Abre una sesión de la caché, configurándola la primera vez"""
+    if SessionLocal is None:
+        configure()
+    return SessionLocal()
+
+
+def _count(stat: str):
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+def normalize_question(question: str) -> str:
+    """Pregunta comparable: "¿Cuánto recolectó  Ana?" queda "cuánto recolectó ana" """
+    text = unicodedata.normalize("NFKC", question).casefold()
+    text = re.sub(r"\s+", " ", text)
+    return text.strip(" ¿?¡!.,;:")
+
+
+def data_versions() -> Dict[str, int]:
+    """Versión de datos de cada tabla de la copia local (vacío si no está configurada)"""
+    if not table_mirror.is_configured():
+        return {}
+    return {table_name: table_mirror.get_sync_info(table_name)["version"] for table_name in table_mirror.MIRRORED_TABLES}
+
+
+def _previous_messages(question: str, state: ConversationState) -> List[List[str]]:
+    """Mensajes del historial que ve el agente, sin la pregunta actual"""
+    history = state.history[-(HISTORY_MESSAGES + 1):]
+    if history and history[-1]["role"] == "user" and history[-1]["content"] == question:
+        history = history[:-1]
+    return [[message["role"], message["content"]] for message in history[-HISTORY_MESSAGES:]]
+
+
+def make_key(question: str, state: ConversationState, model: str) -> str:
+    """Hash canónico de la pregunta, los campos del estado, la versión de datos y el prompt"""
+    canonical = {
+        "question": normalize_question(question),
+        "conversation": {field: state.conversation.get(field) for field in CONVERSATION_FIELDS},
+        "query": state.query,
+        "issues": state.issues,
+        "history": _previous_messages(question, state),
+        "data": data_versions(),
+        "model": model,
+        "prefix": PREFIX_HASH,
+    }
+    payload = json.dumps(canonical, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get(key: str) -> Optional[str]:
+    """
+    Busca una respuesta guardada.
+    
+    Returns:
+        El texto de la respuesta, o None si no está o venció
+    """
+    if not CACHE_ENABLED:
+        return None
+    
+    db = _open_session()
+    try:
+        entry = db.get(CachedResponse, key)
+        if entry is None:
+            _count("misses")
+            return None
+        
+        now = datetime.utcnow()
+        if now - entry.created_at > timedelta(seconds=CACHE_TTL):
+            db.delete(entry)
+            db.commit()
+            _count("expired")
+            _count("misses")
+            return None
+        
+        entry.last_used_at = now
+        entry.hits += 1
+        db.commit()
+        _count("hits")
+        return entry.response_text
+    finally:
+        db.close()
+
+
+def put(key: str, response_text: str):
+    """Guarda una respuesta y descarta las vencidas y las menos usadas si se pasa del máximo"""
+    if not CACHE_ENABLED:
+        return
+    
+    now = datetime.utcnow()
+    db = _open_session()
+    try:
+        entry = db.get(CachedResponse, key)
+        if entry is None:
+            entry = CachedResponse(key=key, hits=0)
+            db.add(entry)
+        entry.response_text = response_text
+        entry.created_at = now
+        entry.last_used_at = now
+        db.flush()
+        
+        db.query(CachedResponse).filter(
+            CachedResponse.created_at < now - timedelta(seconds=CACHE_TTL)
+        ).delete(synchronize_session=False)
+        
+        excess = db.query(CachedResponse).count() - CACHE_MAX_ENTRIES
+        if excess > 0:
+            oldest = [
+                row.key for row in
+                db.query(CachedResponse.key).order_by(CachedResponse.last_used_at).limit(excess)
+            ]
+            db.query(CachedResponse).filter(CachedResponse.key.in_(oldest)).delete(synchronize_session=False)
+            with _stats_lock:
+                _stats["evictions"] += len(oldest)
+        db.commit()
+    finally:
+        db.close()
+
+
+def lookup(
+    question: str,
+    state: ConversationState,
+    model: str,
+    extra: Optional[dict] = None
+) -> Tuple[str, Optional[str]]:
+    """
+    Clave y respuesta guardada de un turno.
+    
+    Con extra["no_cache"] no se busca (la respuesta nueva se guarda igual).
+    
+    Returns:
+        Tupla (clave, texto de la respuesta o None)
+    """
+    key = make_key(question, state, model)
+    if (extra or {}).get("no_cache"):
+        _count("bypassed")
+        return key, None
+    return key, get(key)
+
+
+def clear():
+    """Borra todas las respuestas guardadas (no reinicia los contadores)"""
+    db = _open_session()
+    try:
+        db.query(CachedResponse).delete()
+        db.commit()
+    finally:
+        db.close()
+
+
+def get_metrics() -> Dict[str, Any]:
+    """Contadores de aciertos / fallos y respuestas guardadas"""
+    entries = 0
+    if SessionLocal is not None:
+        db = SessionLocal()
+        try:
+            entries = db.query(CachedResponse).count()
+        finally:
+            db.close()
+    with _stats_lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "hit_rate": round(_stats["hits"] / lookups, 3) if lookups else 0.0,
+            "entries": entries,
+            "max_entries": CACHE_MAX_ENTRIES,
+            "enabled": CACHE_ENABLED
+        }
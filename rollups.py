@@ -0,0 +1,130 @@
+"""
+Consolidados mensuales de la copia local, mantenidos de forma incremental.
+
+Las preguntas más frecuentes son totales por mes, coordinador, municipio y
+material. En lugar de recorrer todos los registros, table_mirror guarda en
+`mirror_monthly_rollups` una fila por combinación de:
+
+    Certificados   (mes, coordinador, municipio generador)
+    Kardex         (mes, coordinador, centro de acopio, gestor, TipoMovimiento)
+
+con el número de registros y la suma de cada material. Cada vez que la
+sincronización inserta, modifica o borra un registro se resta su aporte
+anterior y se suma el nuevo (`rollup_key` / `rollup_values`), así que no se
+recalcula nada y responder cuesta O(grupos) en lugar de O(registros).
+
+Ejemplo:
+    >>> rows = table_mirror.get_rollups("Certificados")
+    >>> summarize("Certificados", rows, "coordinador", where={"mes": "2024-03"})
+    [{'coordinador': 'Ana Gómez', 'registros': 12, 'rigidos': 340.0, ...}, ...]
+"""
+from typing import Dict, List, Any, Optional, Tuple
+
+from aggregations import MEASURES, EMPTY_GROUP
+from airtable_values import field_text, parse_date, to_number
+from filter_ast import DATE_FIELDS
+
+
+# Campo de fecha que define el mes de cada tabla (el mismo de los filtros de fecha)
+MONTH_FIELDS: Dict[str, str] = DATE_FIELDS
+
+# Columnas de la clave (además del mes), en el orden de la tabla de consolidados
+KEY_COLUMNS = ["coordinador", "municipio", "centro_acopio", "gestor", "tipo_movimiento"]
+
+# Dimensiones de cada tabla -> campo de Airtable (las que no aparecen quedan en "")
+ROLLUP_DIMENSIONS: Dict[str, Dict[str, str]] = {
+    "Certificados": {
+        "coordinador": "nombrecoordinador",
+        "municipio": "municipiogenerador",
+    },
+    "Kardex": {
+        "coordinador": "Name (from Coordinador)",
+        "centro_acopio": "NombreCentrodeAcopio",
+        "gestor": "nombregestor",
+        "tipo_movimiento": "TipoMovimiento",
+    },
+}
+
+# Decimales que se conservan al sumar y restar (evita arrastrar error de coma flotante)
+PRECISION = 6
+
+
+def has_rollups(table_name: str) -> bool:
+    return table_name in MONTH_FIELDS
+
+
+def rollup_key(table_name: str, fields: Dict[str, Any]) -> Tuple[str, ...]:
+    """Clave (mes, coordinador, municipio, centro_acopio, gestor, tipo_movimiento) de un registro"""
+    moment = parse_date(fields.get(MONTH_FIELDS[table_name]))
+    key = [moment.strftime("%Y-%m") if moment else EMPTY_GROUP]
+    dimensions = ROLLUP_DIMENSIONS[table_name]
+    for column in KEY_COLUMNS:
+        field = dimensions.get(column)
+        key.append((field_text(fields.get(field)) or EMPTY_GROUP) if field else "")
+    return tuple(key)
+
+
+def rollup_values(table_name: str, fields: Dict[str, Any]) -> Dict[str, float]:
+    """Aporte de un registro a su grupo: kg de cada material"""
+    return {measure: to_number(fields.get(measure)) for measure in MEASURES[table_name]}
+
+
+def add_values(totals: Dict[str, float], values: Dict[str, float], sign: int) -> Dict[str, float]:
+    """Suma (sign=1) o resta (sign=-1) el aporte de un registro a los totales de un grupo"""
+    return {
+        measure: round(totals.get(measure, 0.0) + sign * values.get(measure, 0.0), PRECISION)
+        for measure in set(totals) | set(values)
+    }
+
+
+def summarize(
+    table_name: str,
+    rows: List[Dict[str, Any]],
+    group_by: Optional[str] = None,
+    where: Optional[Dict[str, str]] = None,
+    measures: Optional[List[str]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Totales agrupados a partir de las filas de consolidados (table_mirror.get_rollups).
+    
+    Args:
+        table_name: "Certificados" o "Kardex"
+        rows: Filas de consolidados ({"mes", "coordinador", ..., "registros", materiales})
+        group_by: "mes", "coordinador", "municipio", "centro_acopio", "gestor",
+            "tipo_movimiento" o None para el total general
+        where: Igualdades sobre las mismas columnas, p. ej. {"mes": "2024-03"}
+        measures: Materiales a sumar (default: todos los de la tabla)
+    
+    Returns:
+        Mismo formato que aggregations.aggregate: una fila por grupo, ordenadas
+        por mes si group_by es "mes"; si no, por total de mayor a menor
+    """
+    measures = measures or MEASURES[table_name]
+    if group_by and group_by != "mes" and group_by not in ROLLUP_DIMENSIONS[table_name]:
+        raise ValueError(f"Los consolidados de {table_name} no se agrupan por '{group_by}'")
+    
+    groups: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        if where and any(row.get(column) != value for column, value in where.items()):
+            continue
+        label = row[group_by] if group_by else table_name
+        group = groups.get(label)
+        if group is None:
+            group = {group_by: label} if group_by else {}
+            group["registros"] = 0
+            group.update((measure, 0.0) for measure in measures)
+            groups[label] = group
+        group["registros"] += row["registros"]
+        for measure in measures:
+            group[measure] += row.get(measure, 0.0)
+    
+    result = list(groups.values())
+    for group in result:
+        for measure in measures:
+            group[measure] = round(group[measure], 2)
+    
+    if group_by == "mes":
+        result.sort(key=lambda group: group["mes"])
+    elif group_by:
+        result.sort(key=lambda group: group.get(measures[-1], 0), reverse=True)
+    return result
@@ -1,15 +1,26 @@
 import os
+import json
+import asyncio
 from datetime import datetime
 from typing import Optional
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from jinja2 import Environment, FileSystemLoader
+import airtable_client
+import rate_limit
+import query_cache
+import prompts
+import response_cache
+import table_mirror
+import query_export
+import snapshot_export
 from agent_core import run_agent
-from agent_with_context import run_agent_with_context
-from conversation_db import get_or_create_conversation, update_conversation
-from conversation_state import ConversationStatus
-from queries import execute_query_from_state
+from agent_with_context import run_agent_with_context_async, stream_agent_with_context, close_async_openai_client
+from conversation_db import aget_or_create_conversation, aupdate_conversation, find_conversation
+from conversation_state import ConversationState, ConversationStatus
+from query_planner import execute_planned_query_async
 
 app = FastAPI()
 
@@ -18,6 +29,7 @@ env = Environment(loader=FileSystemLoader('plantillas'))
 
 # Crear carpeta reportes si no existe
 os.makedirs('reportes', exist_ok=True)
+os.makedirs(snapshot_export.EXPORT_DIR, exist_ok=True)
 
 class ReporteData(BaseModel):
     nombre: str
@@ -58,6 +70,81 @@ class PreguntaConContextoData(BaseModel):
     conversation_id: Optional[str] = None
     extra: dict = {}
 
+# Turnos de /ask/stream que siguen corriendo (también si el cliente se desconectó)
+_turnos_en_curso: set = set()
+
+async def _finalizar_turno(state: ConversationState, mensaje_para_usuario: str, extra: dict) -> dict:
+    """
+    Cierra un turno de /ask o /ask/stream después de la respuesta del agente:
+    ejecuta la consulta si quedó lista, guarda el estado en la BD (una sola
+    vez) y arma la respuesta para el cliente.
+    """
+    # Decidir si ejecutar la consulta a Airtable automáticamente
+    # Condiciones: ready=True y last_run_at=None (no ejecutada aún)
+    if state.execution["ready"] and state.execution["last_run_at"] is None:
+        # Ejecutar la consulta (copia local, consolidados o Airtable según el plan);
+        # extra["max_staleness"] fija la antigüedad aceptada de la copia local en segundos
+        query_summary, query_records, query_error = await execute_planned_query_async(
+            state,
+            extra.get("max_staleness")
+        )
+        
+        # Actualizar el estado con los resultados de la ejecución
+        state.execution["last_run_at"] = datetime.utcnow().isoformat()
+        
+        if query_error:
+            # Hubo un error al ejecutar
+            state.execution["error"] = query_error
+            state.execution["result_summary"] = query_summary
+            # Mensaje al usuario informando del error
+            mensaje_para_usuario = query_summary
+        else:
+            # Ejecución exitosa
+            state.execution["result_summary"] = query_summary
+            state.execution["error"] = None
+            state.update_status(ConversationStatus.EXECUTED)
+            
+            # Construir mensaje para el usuario con el resumen de resultados
+            mensaje_para_usuario = query_summary
+            
+            # Agregar sugerencia para ajustar filtros
+            if query_records is not None and len(query_records) > 0:
+                mensaje_para_usuario += "\n\nSi quieres cambiar algún filtro o ver algo más específico, dime qué deseas ajustar."
+    
+    # Guardar el estado actualizado en la BD (respuesta del agente y ejecución)
+    await aupdate_conversation(state)
+    
+    # Indicador 'done': True cuando la consulta ya se ejecutó (ready=True y last_run_at no es None)
+    # Útil para clientes como TextIt para decidir si continuar preguntando o cerrar el flujo
+    done = (state.execution["ready"] and 
+            state.execution.get("last_run_at") is not None)
+    
+    return {
+        "message": mensaje_para_usuario,
+        "done": done,
+        "conversation_id": state.meta["conversation_id"],
+        "state": {
+            "status": state.conversation["status"],
+            "step": state.conversation["step"],
+            "pending_question": state.conversation["pending_question"],
+            "query_type": state.query["type"],
+            "query_table": state.query["table"],
+            "filters": state.query["filters"],
+            "issues": state.issues,
+            "ready_to_execute": state.execution["ready"],
+            "execution": {
+                "last_run_at": state.execution.get("last_run_at"),
+                "result_summary": state.execution.get("result_summary"),
+                "error": state.execution.get("error"),
+                "plan": state.execution.get("plan")
+            }
+        }
+    }
+
+def _sse_event(event: str, data: dict) -> str:
+    """Un evento de Server-Sent Events con datos JSON"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 @app.post("/ask")
 async def consultar_agente(data: PreguntaConContextoData):
     """
@@ -79,91 +166,182 @@ async def consultar_agente(data: PreguntaConContextoData):
     user_id = data.user_id or "default_user"
     
     # 1. Cargar o crear el estado de conversación desde la BD
-    state = get_or_create_conversation(user_id, data.conversation_id)
+    state = await aget_or_create_conversation(user_id, data.conversation_id)
     
     # 2. Actualizar el mensaje del usuario en el estado
     state.add_message("user", data.question)
     
-    # 3. Ejecutar el agente con contexto
-    mensaje_para_usuario, state_actualizado = run_agent_with_context(
+    # 3. Ejecutar el agente con contexto (Airtable y OpenAI asíncronos)
+    mensaje_para_usuario, state_actualizado = await run_agent_with_context_async(
         data.question,
         state,
         data.extra
     )
     
-    # 4. Guardar el estado actualizado en la BD (después de OpenAI)
-    update_conversation(state_actualizado)
+    # 4. Ejecutar la consulta si quedó lista, guardar el estado y preparar la respuesta
+    return await _finalizar_turno(state_actualizado, mensaje_para_usuario, data.extra)
+
+@app.post("/ask/stream")
+async def consultar_agente_stream(data: PreguntaConContextoData):
+    """
+    Igual que /ask, pero la respuesta del agente llega como Server-Sent Events
+    mientras OpenAI la genera.
     
-    # 5. Decidir si ejecutar la consulta a Airtable automáticamente
-    # Condiciones: ready=True y last_run_at=None (no ejecutada aún)
-    if state_actualizado.execution["ready"] and state_actualizado.execution["last_run_at"] is None:
-        # Ejecutar la consulta a Airtable
-        query_summary, query_records, query_error = execute_query_from_state(state_actualizado)
-        
-        # Actualizar el estado con los resultados de la ejecución
-        state_actualizado.execution["last_run_at"] = datetime.utcnow().isoformat()
-        
-        if query_error:
-            # Hubo un error al ejecutar
-            state_actualizado.execution["error"] = query_error
-            state_actualizado.execution["result_summary"] = query_summary
-            # Mensaje al usuario informando del error
-            mensaje_para_usuario = query_summary
-        else:
-            # Ejecución exitosa
-            state_actualizado.execution["result_summary"] = query_summary
-            state_actualizado.execution["error"] = None
-            state_actualizado.update_status(ConversationStatus.EXECUTED)
-            
-            # Construir mensaje para el usuario con el resumen de resultados
-            mensaje_para_usuario = query_summary
+    Eventos:
+        - delta: {"text": ...} fragmento del mensaje del agente
+        - done: el mismo JSON que devuelve /ask (message, done, state, ...).
+          Su "message" es el definitivo: puede diferir del texto de los
+          deltas si se ejecutó la consulta o se limpió el formato.
+    
+    El estado se guarda una sola vez, antes del evento done. El turno corre
+    en una tarea aparte: si el cliente se desconecta a mitad del stream, la
+    tarea termina igual y guarda la pregunta y la respuesta (que ya pudo
+    quedar en la caché de respuestas).
+    """
+    user_id = data.user_id or "default_user"
+    state = await aget_or_create_conversation(user_id, data.conversation_id)
+    state.add_message("user", data.question)
+    eventos_pendientes: asyncio.Queue = asyncio.Queue()
+    
+    async def turno():
+        try:
+            mensaje_para_usuario = ""
+            async for kind, text in stream_agent_with_context(data.question, state, data.extra):
+                if kind == "delta":
+                    eventos_pendientes.put_nowait(("delta", {"text": text}))
+                else:
+                    mensaje_para_usuario = text
             
-            # Agregar sugerencia para ajustar filtros
-            if query_records is not None and len(query_records) > 0:
-                mensaje_para_usuario += "\n\nSi quieres cambiar algún filtro o ver algo más específico, dime qué deseas ajustar."
-        
-        # Guardar estado actualizado con la información de ejecución
-        update_conversation(state_actualizado)
+            response = await _finalizar_turno(state, mensaje_para_usuario, data.extra)
+            eventos_pendientes.put_nowait(("done", response))
+        finally:
+            eventos_pendientes.put_nowait(None)
     
-    # 6. Preparar respuesta para el cliente
-    # Indicador 'done': True cuando la consulta ya se ejecutó (ready=True y last_run_at no es None)
-    # Útil para clientes como TextIt para decidir si continuar preguntando o cerrar el flujo
-    done = (state_actualizado.execution["ready"] and 
-            state_actualizado.execution.get("last_run_at") is not None)
+    tarea = asyncio.create_task(turno())
+    # Referencia fuerte mientras corre (el stream puede cerrarse antes)
+    _turnos_en_curso.add(tarea)
+    tarea.add_done_callback(_turnos_en_curso.discard)
     
-    response = {
-        "message": mensaje_para_usuario,
-        "done": done,
-        "conversation_id": state_actualizado.meta["conversation_id"],
-        "state": {
-            "status": state_actualizado.conversation["status"],
-            "step": state_actualizado.conversation["step"],
-            "pending_question": state_actualizado.conversation["pending_question"],
-            "query_type": state_actualizado.query["type"],
-            "query_table": state_actualizado.query["table"],
-            "filters": state_actualizado.query["filters"],
-            "issues": state_actualizado.issues,
-            "ready_to_execute": state_actualizado.execution["ready"],
-            "execution": {
-                "last_run_at": state_actualizado.execution.get("last_run_at"),
-                "result_summary": state_actualizado.execution.get("result_summary"),
-                "error": state_actualizado.execution.get("error")
-            }
-        }
-    }
+    async def eventos():
+        while True:
+            evento = await eventos_pendientes.get()
+            if evento is None:
+                break
+            yield _sse_event(*evento)
+        await tarea  # Propaga el error si el turno falló
     
-    return response
+    # Sin buffer en proxies (nginx) para que cada evento salga apenas se genera
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/export/{conversation_id}")
+async def exportar_consulta(
+    conversation_id: str,
+    user_id: str = "default_user",
+    format: str = "csv",
+    max_staleness: Optional[float] = None
+):
+    """
+    Exporta los registros de la consulta de una conversación en CSV o NDJSON.
+    
+    Vuelve a ejecutar el state.query guardado y envía los registros por
+    bloques a medida que llegan las páginas (memoria constante).
+    
+    Recibe:
+        - conversation_id: ID de la conversación
+        - user_id: ID del usuario dueño de la conversación
+        - format: "csv" (default) o "ndjson"
+        - max_staleness: Antigüedad aceptada de la copia local en segundos
+    """
+    if format not in query_export.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato no soportado: {format}")
+    
+    state = await asyncio.to_thread(find_conversation, user_id, conversation_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Conversación no encontrada")
+    
+    pages, error = await query_export.aopen_export(state, max_staleness)
+    if error:
+        raise HTTPException(status_code=409, detail=error)
+    
+    return StreamingResponse(
+        query_export.aencode_pages(pages, format, state.query.get("fields")),
+        media_type=query_export.EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{query_export.export_filename(state, format)}"'}
+    )
+
+@app.post("/snapshots")
+async def exportar_instantaneas(format: str = "parquet"):
+    """
+    Escribe instantáneas de Certificados y Kardex (Parquet o Arrow IPC,
+    particionadas por año y mes) desde la copia local, para análisis sin
+    consultar Airtable ni al bot. Los archivos quedan en /snapshots/files.
+    """
+    try:
+        summaries = await asyncio.to_thread(snapshot_export.write_snapshots, None, format)
+    except snapshot_export.SnapshotExportError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"status": "ok", "snapshots": summaries}
 
 @app.post("/ask_legacy")
-async def consultar_agente_legacy(data: PreguntaData):
-    """Endpoint legacy sin contexto (retrocompatibilidad)"""
+def consultar_agente_legacy(data: PreguntaData):
+    """
+    Endpoint legacy sin contexto (retrocompatibilidad).
+    
+    Es síncrono a propósito: FastAPI lo ejecuta en el pool de hilos,
+    así que no bloquea el event loop que atiende /ask.
+    """
     result = run_agent(data.question, data.extra)
     return result
 
+@app.on_event("startup")
+async def iniciar_sincronizacion():
+    """Inicializa la copia local de Airtable y lanza su sincronización en segundo plano"""
+    app.state.mirror_task = None
+    if table_mirror.sync_enabled():
+        try:
+            await asyncio.to_thread(table_mirror.configure)
+        except Exception as e:
+            print(f"Advertencia: No se pudo inicializar la copia local: {e}")
+            return
+        app.state.mirror_task = asyncio.create_task(table_mirror.run_sync_loop())
+
+@app.on_event("shutdown")
+async def cerrar_conexiones():
+    """Detiene la sincronización, espera los turnos en curso y cierra los pools de conexiones HTTP (Airtable y OpenAI)"""
+    if getattr(app.state, "mirror_task", None):
+        app.state.mirror_task.cancel()
+    # Deja terminar (y guardar) los turnos de /ask/stream cuyo cliente se desconectó
+    await asyncio.gather(*_turnos_en_curso, return_exceptions=True)
+    airtable_client.close_session()
+    await airtable_client.aclose_async_client()
+    await close_async_openai_client()
+
 @app.get("/health")
 async def health():
     """Health check endpoint"""
     return {"status": "ok"}
 
+@app.get("/metrics")
+async def metrics():
+    """Métricas del limitador de Airtable, de las cachés (consultas, respuestas, prefijo de OpenAI) y estado de la copia local"""
+    mirror = {}
+    for table_name in table_mirror.MIRRORED_TABLES:
+        # get_sync_info consulta SQLite: fuera del event loop
+        mirror[table_name] = await asyncio.to_thread(table_mirror.get_sync_info, table_name)
+    return {
+        "airtable_rate_limit": rate_limit.get_metrics(),
+        "query_cache": query_cache.get_metrics(),
+        "openai_prompt_cache": prompts.get_metrics(),
+        "response_cache": await asyncio.to_thread(response_cache.get_metrics),
+        "mirror": mirror
+    }
+
 # Montar carpeta reportes como archivos estáticos
 app.mount("/reportes", StaticFiles(directory="reportes"), name="reportes")
+
+# Instantáneas para análisis (snapshot_export.py)
+app.mount("/snapshots/files", StaticFiles(directory=snapshot_export.EXPORT_DIR), name="snapshots")
@@ -0,0 +1,198 @@
+"""
+Instantáneas en Parquet (o Arrow IPC) de Certificados y Kardex para análisis.
+
+Los analistas sacaban datos preguntándole al bot una y otra vez. Este módulo
+escribe las columnas del almacén columnar (record_store) en archivos
+comprimidos, particionados al estilo Hive por año y mes de la fecha de la
+tabla:
+
+    exports/Certificados/anio=2024/mes=3/part-0.parquet
+    exports/Kardex/anio=2024/mes=3/part-0.parquet
+
+Tipos de las columnas:
+    id                  string
+    fechadevolucion /   timestamp[ms] (nulo si está vacía o no es válida;
+    fechakardex         esas filas van a anio=__HIVE_DEFAULT_PARTITION__)
+    materiales (kg)     float64 (los `array('d')` del almacén sin copiarlos)
+    coordinador, ...    dictionary<int32, string> (lookups unidos con ", ")
+    anio, mes           columnas de partición (nombres de los directorios)
+
+Cada exportación reemplaza por completo la anterior de esa tabla (se escribe
+en un directorio temporal y se intercambia al final). Las exportaciones se
+hacen de a una: dos POST /snapshots a la vez no escriben los mismos archivos.
+
+pyarrow está en requirements.txt pero solo se importa al exportar; sin él
+write_table lanza SnapshotExportError (POST /snapshots responde 503).
+
+Uso:
+    python snapshot_export.py                      # Parquet en ./exports
+    python snapshot_export.py --format arrow --output /tmp/snapshots
+
+Configuración (variables de entorno opcionales):
+    SNAPSHOT_EXPORT_DIR          Directorio de salida (default: ./exports)
+    SNAPSHOT_EXPORT_COMPRESSION  Compresión (default: zstd)
+"""
+import os
+import shutil
+import argparse
+import threading
+from typing import Dict, List, Any, Optional
+
+import record_store
+import table_mirror
+from record_store import RecordStore, CATEGORICAL_FIELDS, date_from_value
+
+
+EXPORT_DIR = os.getenv("SNAPSHOT_EXPORT_DIR", "./exports")
+EXPORT_COMPRESSION = os.getenv("SNAPSHOT_EXPORT_COMPRESSION", "zstd")
+
+# Formato -> formato de pyarrow.dataset y extensión de los archivos
+EXPORT_FORMATS: Dict[str, tuple] = {
+    "parquet": ("parquet", "parquet"),
+    "arrow": ("ipc", "arrow"),
+}
+
+PARTITION_COLUMNS = ["anio", "mes"]
+
+# Serializa las exportaciones (comparten el directorio temporal y el de destino)
+_export_lock = threading.Lock()
+
+
+class SnapshotExportError(Exception):
+    """No se puede exportar (falta pyarrow o la copia local no está lista)"""
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+    except ImportError:
+        raise SnapshotExportError(
+            "Para exportar instantáneas hay que instalar pyarrow (está en requirements.txt: pip install -r requirements.txt)"
+        )
+    return pyarrow
+
+
+def _float_column(pa, values):
+    """array('d') -> float64 de Arrow compartiendo el mismo buffer"""
+    return pa.Array.from_buffers(pa.float64(), len(values), [None, pa.py_buffer(values)])
+
+
+def _dictionary_column(pa, column):
+    """EncodedColumn -> dictionary<int32, string>, un solo código por texto (vacío = nulo)"""
+    labels: List[str] = []
+    index: Dict[str, int] = {}
+    remap: List[Optional[int]] = []
+    for text in column.texts:
+        if not text:
+            remap.append(None)
+            continue
+        if text not in index:
+            index[text] = len(labels)
+            labels.append(text)
+        remap.append(index[text])
+    indices = pa.array([remap[code] for code in column.codes], pa.int32())
+    return pa.DictionaryArray.from_arrays(indices, pa.array(labels, pa.string()))
+
+
+def store_table(store: RecordStore):
+    """Tabla de Arrow con las columnas del almacén y las de partición (anio, mes)"""
+    pa = _pyarrow()
+    moments = [date_from_value(value) for value in store.dates]
+    
+    columns = {
+        "id": pa.array(store.ids, pa.string()),
+        store.date_field: pa.array(moments, pa.timestamp("ms")),
+    }
+    for field in CATEGORICAL_FIELDS[store.table_name]:
+        columns[field] = _dictionary_column(pa, store.categorical[field])
+    for measure, values in store.measures.items():
+        columns[measure] = _float_column(pa, values)
+    columns["anio"] = pa.array([moment.year if moment else None for moment in moments], pa.int16())
+    columns["mes"] = pa.array([moment.month if moment else None for moment in moments], pa.int8())
+    return pa.table(columns)
+
+
+def write_table(
+    table_name: str,
+    output_dir: Optional[str] = None,
+    export_format: str = "parquet",
+    compression: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Escribe la instantánea de una tabla desde la copia local.
+    
+    Args:
+        table_name: "Certificados" o "Kardex"
+        output_dir: Directorio base (default: SNAPSHOT_EXPORT_DIR)
+        export_format: "parquet" o "arrow" (Arrow IPC / Feather v2)
+        compression: Códec (default: SNAPSHOT_EXPORT_COMPRESSION)
+    
+    Returns:
+        Diccionario con table, format, rows, version, path y files
+    
+    Raises:
+        SnapshotExportError: Si falta pyarrow, el formato no existe o la copia local no está lista
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise SnapshotExportError(f"Formato no soportado: {export_format}")
+    pa = _pyarrow()
+    dataset_format, extension = EXPORT_FORMATS[export_format]
+    
+    store = record_store.get_store(table_name)
+    if store is None:
+        raise SnapshotExportError(f"La copia local de {table_name} no está lista")
+    version = table_mirror.get_sync_info(table_name)["version"]
+    
+    target = os.path.join(output_dir or EXPORT_DIR, table_name)
+    staging = f"{target}.tmp"
+    file_format = pa.dataset.ParquetFileFormat() if dataset_format == "parquet" else pa.dataset.IpcFileFormat()
+    files: List[str] = []
+    
+    with _export_lock:
+        shutil.rmtree(staging, ignore_errors=True)
+        pa.dataset.write_dataset(
+            store_table(store),
+            staging,
+            format=file_format,
+            file_options=file_format.make_write_options(compression=compression or EXPORT_COMPRESSION),
+            partitioning=PARTITION_COLUMNS,
+            partitioning_flavor="hive",
+            basename_template=f"part-{{i}}.{extension}",
+            file_visitor=lambda written: files.append(os.path.relpath(written.path, staging)),
+        )
+        
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(staging, target)
+    return {
+        "table": table_name,
+        "format": export_format,
+        "rows": store.size,
+        "version": version,
+        "path": target,
+        "files": sorted(files),
+    }
+
+
+def write_snapshots(
+    output_dir: Optional[str] = None,
+    export_format: str = "parquet",
+    compression: Optional[str] = None
+) -> Dict[str, Dict[str, Any]]:
+    """Escribe las instantáneas de todas las tablas con almacén columnar"""
+    return {
+        table_name: write_table(table_name, output_dir, export_format, compression)
+        for table_name in record_store.DATE_FIELDS
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta Certificados y Kardex desde la copia local")
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="parquet")
+    parser.add_argument("--output", default=EXPORT_DIR)
+    parser.add_argument("--compression", default=EXPORT_COMPRESSION)
+    args = parser.parse_args()
+    
+    table_mirror.configure()
+    for summary in write_snapshots(args.output, args.format, args.compression).values():
+        print(f"{summary['table']}: {summary['rows']} filas en {len(summary['files'])} archivos ({summary['path']})")
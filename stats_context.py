@@ -0,0 +1,215 @@
+"""
+Contexto estadístico para el modelo en lugar de registros crudos.
+
+Con los registros en el prompt, responder sobre un año entero costaba tantos
+tokens como filas hubiera (y solo cabían los últimos 100). Aquí los
+resúmenes se calculan en el servidor sobre el almacén columnar
+(record_store) para el periodo pedido, y al modelo solo le llegan tablas de
+tamaño acotado:
+
+- Periodo y número de registros.
+- Total por material.
+- Totales por coordinador (TOP_COORDINADORES) y municipios principales (TOP_MUNICIPIOS).
+- Mes a mes, con la variación del total frente al mes anterior (MAX_MONTHS).
+- Comparación con el periodo anterior de la misma duración (si hay desde y hasta).
+- Registros atípicos por total (z robusto con mediana y MAD, MAX_OUTLIERS).
+- Algunos registros de ejemplo (EXEMPLAR_ROWS), los de total más cercano a la mediana.
+
+El tamaño del contexto no depende del número de registros del periodo.
+
+Ejemplo:
+    >>> text, metadata = build_context(record_store.get_store("Certificados"), "2023-12-31", "2025-01-01")
+"""
+import statistics
+from bisect import bisect_right
+from typing import Dict, List, Any, Optional, Tuple
+
+import prompt_encoding
+from aggregations import MEASURES, aggregate, totals, format_table
+from record_store import RecordStore, CATEGORICAL_FIELDS, date_value
+from table_snapshot import field_defaults
+
+
+TOP_COORDINADORES = 15
+TOP_MUNICIPIOS = 10
+MAX_MONTHS = 24
+MAX_OUTLIERS = 5
+EXEMPLAR_ROWS = 3
+ROW_BUDGET = 2000
+
+# |z robusto| a partir del cual un total se considera atípico
+OUTLIER_THRESHOLD = 3.5
+
+# Escala de la MAD para que sea comparable con la desviación estándar
+MAD_SCALE = 1.4826
+
+NOT_AVAILABLE = "n/d"
+
+
+def period_rows(store: RecordStore, fecha_desde: Any = None, fecha_hasta: Any = None) -> List[int]:
+    """Filas del periodo (límites estrictos, como los filtros); sin límites, todas"""
+    if fecha_desde is None and fecha_hasta is None:
+        return list(range(store.size))
+    return store.date_range(fecha_desde, fecha_hasta)
+
+
+def previous_rows(store: RecordStore, fecha_desde: Any, fecha_hasta: Any) -> Optional[List[int]]:
+    """
+    Filas del periodo anterior de la misma duración, que termina en
+    fecha_desde (incluida). None si el periodo no tiene los dos límites.
+    """
+    if fecha_desde is None or fecha_hasta is None:
+        return None
+    after, before = date_value(fecha_desde), date_value(fecha_hasta)
+    if not after < before:
+        return None
+    index = store.date_index
+    start = bisect_right(index.keys, after - (before - after))
+    end = bisect_right(index.keys, after)
+    return sorted(index.rows[start:end])
+
+
+def percent_change(current: float, previous: float) -> Any:
+    if not previous:
+        return NOT_AVAILABLE
+    return round(100.0 * (current - previous) / previous, 1)
+
+
+def month_over_month(months: List[Dict[str, Any]], measure: str) -> List[Dict[str, Any]]:
+    """Filas de aggregate(..., "mes") con la variación de `measure` frente al mes anterior"""
+    result = []
+    previous = None
+    for row in months:
+        row = dict(row)
+        row["variacion_%"] = NOT_AVAILABLE if previous is None else percent_change(row[measure], previous[measure])
+        result.append(row)
+        previous = row
+    return result
+
+
+def period_delta(current: Dict[str, Any], previous: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Una fila por medida: periodo, anterior y variación porcentual"""
+    return [
+        {"medida": key, "periodo": current[key], "anterior": previous[key],
+         "variacion_%": percent_change(current[key], previous[key])}
+        for key in current
+    ]
+
+
+def outliers(store: RecordStore, rows: List[int], measure: str) -> List[int]:
+    """Filas con |z robusto| > OUTLIER_THRESHOLD, de mayor a menor desviación"""
+    values = store.measures[measure]
+    if len(rows) < 3:
+        return []
+    sample = [values[row] for row in rows]
+    median = statistics.median(sample)
+    mad = statistics.median(abs(value - median) for value in sample) * MAD_SCALE
+    if not mad:
+        return []
+    scored = [(abs(values[row] - median) / mad, row) for row in rows]
+    flagged = [(score, row) for score, row in scored if score > OUTLIER_THRESHOLD]
+    flagged.sort(key=lambda item: (-item[0], item[1]))
+    return [row for _, row in flagged[:MAX_OUTLIERS]]
+
+
+def exemplars(store: RecordStore, rows: List[int], measure: str) -> List[int]:
+    """EXEMPLAR_ROWS filas con el total más cercano a la mediana, en orden de fila"""
+    if not rows:
+        return []
+    values = store.measures[measure]
+    median = statistics.median(values[row] for row in rows)
+    closest = sorted(rows, key=lambda row: (abs(values[row] - median), row))[:EXEMPLAR_ROWS]
+    return sorted(closest)
+
+
+def row_dicts(store: RecordStore, rows: List[int]) -> List[Dict[str, Any]]:
+    """Filas del almacén como diccionarios planos (id, fecha, categorías, materiales)"""
+    fields = [store.date_field] + CATEGORICAL_FIELDS[store.table_name]
+    result = []
+    for row in rows:
+        item: Dict[str, Any] = {"id": store.ids[row]}
+        for field in fields:
+            column = store.categorical[field]
+            item[field] = column.texts[column.codes[row]]
+        for measure, values in store.measures.items():
+            item[measure] = values[row]
+        result.append(item)
+    return result
+
+
+def build_context(
+    store: RecordStore,
+    fecha_desde: Any = None,
+    fecha_hasta: Any = None,
+    whole_table: bool = True,
+    truncated: bool = False
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Resúmenes de una tabla para el periodo, listos para el prompt.
+    
+    Args:
+        store: Almacén de la tabla (record_store.get_store o RecordStore(registros))
+        fecha_desde, fecha_hasta: Periodo (límites estrictos; None = abierto)
+        whole_table: El almacén tiene la tabla completa (la copia local); si
+            no, son solo los registros traídos de Airtable para el periodo
+        truncated: Los registros traídos se cortaron en un máximo: las cifras
+            son de una muestra y no son totales
+    
+    Returns:
+        Tupla (texto, metadatos con rows_in_period, rows_total, truncated y tokens)
+    """
+    table_name = store.table_name
+    measure = MEASURES[table_name][-1]
+    rows = period_rows(store, fecha_desde, fecha_hasta)
+    subset = store.select(rows)
+    
+    period = " ".join(part for part in (
+        f"desde {fecha_desde}" if fecha_desde is not None else "",
+        f"hasta {fecha_hasta}" if fecha_hasta is not None else "",
+    ) if part) or "todos los registros"
+    if truncated:
+        count = f"al menos {len(rows)} (muestra parcial de {store.size} registros de Airtable; las cifras no son totales)"
+    elif whole_table:
+        count = f"{len(rows)} (de {store.size} en la tabla)"
+    else:
+        count = str(len(rows))
+    sections = [f"Periodo: {period}. Registros en el periodo: {count}."]
+    
+    if rows:
+        sections += ["\nTotal por material (kg):", format_table([totals(subset)])]
+        sections += ["\nPor coordinador:", format_table(aggregate(subset, "coordinador"), TOP_COORDINADORES)]
+        sections += ["\nMunicipios principales:", format_table(aggregate(subset, "municipio"), TOP_MUNICIPIOS)]
+        
+        months = month_over_month(aggregate(subset, "mes"), measure)
+        if len(months) > MAX_MONTHS:
+            months = months[-MAX_MONTHS:]
+            sections.append(f"\nMes a mes (últimos {MAX_MONTHS} meses, variación de {measure}):")
+        else:
+            sections.append(f"\nMes a mes (variación de {measure}):")
+        sections.append(format_table(months))
+        
+        previous = previous_rows(store, fecha_desde, fecha_hasta)
+        if previous is not None:
+            sections.append(f"\nFrente al periodo anterior de la misma duración ({len(previous)} registros):")
+            sections.append(format_table(period_delta(totals(subset), totals(store.select(previous)))))
+        
+        # Pocas filas (MAX_OUTLIERS, EXEMPLAR_ROWS): el presupuesto no recorta nada
+        defaults = field_defaults(table_name)
+        atypical = outliers(store, rows, measure)
+        sections.append(f"\nRegistros atípicos por {measure}:")
+        sections.append(
+            prompt_encoding.encode_table(row_dicts(store, atypical), defaults, ROW_BUDGET).text if atypical else "(ninguno)"
+        )
+        
+        sections.append("\nRegistros de ejemplo (total cercano a la mediana):")
+        sections.append(
+            prompt_encoding.encode_table(row_dicts(store, exemplars(store, rows, measure)), defaults, ROW_BUDGET).text
+        )
+    
+    text = "\n".join(sections)
+    return text, {
+        "rows_in_period": len(rows),
+        "rows_total": store.size,
+        "truncated": truncated,
+        "tokens": prompt_encoding.count_tokens(text),
+    }
@@ -0,0 +1,527 @@
+"""
+Copia local (SQLite) de las tablas Certificados y Kardex de Airtable.
+
+La primera sincronización de cada tabla es un backfill completo; las
+siguientes son incrementales y solo piden los registros modificados desde la
+última marca de agua (`LAST_MODIFIED_TIME()` de Airtable). Así las consultas
+y el contexto del agente se pueden responder desde disco en milisegundos.
+
+- El backfill es reanudable: el cursor `offset` de Airtable se guarda después
+  de cada página, y si el servidor se reinicia continúa donde quedó.
+- La marca de agua (watermark) y una versión de datos se guardan por tabla en
+  `mirror_sync_state`; la versión sube cada vez que cambia algún registro.
+- Los registros borrados en Airtable no aparecen en la sincronización
+  incremental; se eliminan en el siguiente backfill completo, que se repite
+  cada MIRROR_FULL_SYNC_HOURS.
+- Los consolidados mensuales (`mirror_monthly_rollups`, ver rollups.py) se
+  actualizan en la misma transacción que cada página de registros.
+
+El servidor ejecuta `run_sync_loop()` en segundo plano. Para sincronizar a mano:
+    python -c "from table_mirror import sync_all; print(sync_all())"
+
+Configuración (variables de entorno opcionales):
+    MIRROR_DATABASE_URL        URL de SQLAlchemy (default: sqlite:///./mirror.db)
+    MIRROR_SYNC_ENABLED        "0" para desactivar la sincronización en el servidor
+    MIRROR_SYNC_INTERVAL       Segundos entre sincronizaciones (default: 300)
+    MIRROR_FULL_SYNC_HOURS     Horas entre backfills completos (default: 24)
+"""
+import os
+import json
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional, Iterator, Tuple, Callable
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, UniqueConstraint
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+import airtable_client
+import rollups
+from airtable_client import AirtableAPIError
+
+
+MIRRORED_TABLES = ["Certificados", "Kardex"]
+
+MIRROR_DATABASE_URL = os.getenv("MIRROR_DATABASE_URL", "sqlite:///./mirror.db")
+SYNC_INTERVAL = int(os.getenv("MIRROR_SYNC_INTERVAL", "300"))
+FULL_SYNC_HOURS = int(os.getenv("MIRROR_FULL_SYNC_HOURS", "24"))
+
+# La marca de agua se retrasa este margen para tolerar diferencias de reloj
+# con Airtable; los registros del margen se vuelven a pedir (el upsert es idempotente)
+WATERMARK_OVERLAP = timedelta(seconds=60)
+
+# Airtable responde 422 cuando un cursor `offset` ya expiró
+OFFSET_EXPIRED_STATUS = 422
+
+Base = declarative_base()
+engine = None
+SessionLocal = None
+
+# (table_name, params, offset) -> (registros, offset siguiente)
+FetchPage = Callable[[str, Dict[str, Any], Optional[str]], Tuple[List[Dict[str, Any]], Optional[str]]]
+
+
+class MirrorRecord(Base):
+    """Un registro de Airtable tal como se descargó"""
+    __tablename__ = "mirror_records"
+    __table_args__ = (UniqueConstraint("table_name", "record_id"),)
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    table_name = Column(String, index=True, nullable=False)
+    record_id = Column(String, nullable=False)
+    created_time = Column(String)
+    fields_json = Column(Text, nullable=False)
+    synced_at = Column(DateTime, nullable=False)
+    backfill_run = Column(String)  # Último backfill que vio este registro
+    
+    def to_airtable(self) -> Dict[str, Any]:
+        """Devuelve el registro con la misma forma que la API de Airtable"""
+        return {
+            "id": self.record_id,
+            "createdTime": self.created_time,
+            "fields": json.loads(self.fields_json)
+        }
+
+
+class SyncState(Base):
+    """Estado de sincronización de una tabla"""
+    __tablename__ = "mirror_sync_state"
+    
+    table_name = Column(String, primary_key=True)
+    watermark = Column(String)  # ISO UTC; se piden registros modificados después
+    version = Column(Integer, nullable=False, default=0)
+    last_sync_at = Column(DateTime)
+    backfill_completed_at = Column(DateTime)
+    backfill_run = Column(String)  # Inicio (ISO) del backfill en curso; None si no hay
+    backfill_offset = Column(String)  # Cursor de Airtable del backfill en curso
+
+
+class MonthlyRollup(Base):
+    """Totales de un grupo (mes + dimensiones) de una tabla; ver rollups.py"""
+    __tablename__ = "mirror_monthly_rollups"
+    __table_args__ = (
+        UniqueConstraint("table_name", "month", *rollups.KEY_COLUMNS),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    table_name = Column(String, index=True, nullable=False)
+    month = Column(String, nullable=False)  # YYYY-MM o "(sin dato)"
+    coordinador = Column(String, nullable=False, default="")
+    municipio = Column(String, nullable=False, default="")
+    centro_acopio = Column(String, nullable=False, default="")
+    gestor = Column(String, nullable=False, default="")
+    tipo_movimiento = Column(String, nullable=False, default="")
+    registros = Column(Integer, nullable=False, default=0)
+    totals_json = Column(Text, nullable=False, default="{}")  # kg por material
+    
+    def to_dict(self) -> Dict[str, Any]:
+        row = {"mes": self.month}
+        for column in rollups.KEY_COLUMNS:
+            row[column] = getattr(self, column)
+        row["registros"] = self.registros
+        row.update(json.loads(self.totals_json))
+        return row
+
+
+def configure(database_url: str = MIRROR_DATABASE_URL):
+    """
+    (Re)configura la base de datos de la copia local y crea las tablas.
+    
+    El servidor la llama al arrancar; importar el módulo no crea el archivo.
+    """
+    global engine, SessionLocal
+    engine = create_engine(database_url, connect_args={"check_same_thread": False})
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    Base.metadata.create_all(bind=engine)
+    
+    # Copias creadas antes de existir los consolidados: se calculan una vez
+    db = SessionLocal()
+    try:
+        for table_name in MIRRORED_TABLES:
+            has_records = db.query(MirrorRecord.id).filter(MirrorRecord.table_name == table_name).first()
+            has_rollups = db.query(MonthlyRollup.id).filter(MonthlyRollup.table_name == table_name).first()
+            if has_records and not has_rollups:
+                _rebuild_rollups(db, table_name)
+                db.commit()
+    finally:
+        db.close()
+
+
+def is_configured() -> bool:
+    """Indica si la base de datos de la copia local ya fue inicializada"""
+    return SessionLocal is not None
+
+
+def _open_session():
+    """Abre una sesión de la copia local, configurándola la primera vez"""
+    if SessionLocal is None:
+        configure()
+    return SessionLocal()
+
+
+def _airtable_timestamp(moment: datetime) -> str:
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def _default_fetch_page() -> FetchPage:
+    """fetch_page contra la API real usando las credenciales del entorno"""
+    api_key = os.getenv("AIRTABLE_API_KEY")
+    base_id = os.getenv("AIRTABLE_BASE_ID")
+    
+    def fetch_page(table_name, params, offset):
+        return airtable_client.fetch_page(base_id, api_key, table_name, params, offset)
+    
+    return fetch_page
+
+
+def _get_sync_state(db, table_name: str) -> SyncState:
+    state = db.get(SyncState, table_name)
+    if state is None:
+        state = SyncState(table_name=table_name, version=0)
+        db.add(state)
+        db.commit()
+    return state
+
+
+def _apply_rollup(db, table_name: str, fields: Dict[str, Any], sign: int, groups: Dict[tuple, MonthlyRollup]):
+    """
+    Suma (sign=1) o resta (sign=-1) el aporte de un registro a su consolidado.
+    
+    `groups` guarda las filas ya leídas o creadas en esta transacción (la
+    sesión no hace autoflush, así que una consulta no vería las nuevas).
+    """
+    if not rollups.has_rollups(table_name):
+        return
+    key = rollups.rollup_key(table_name, fields)
+    group = groups.get(key)
+    if group is None:
+        columns = dict(zip(["month"] + rollups.KEY_COLUMNS, key))
+        group = db.query(MonthlyRollup).filter_by(table_name=table_name, **columns).first()
+        if group is None:
+            group = MonthlyRollup(table_name=table_name, registros=0, totals_json="{}", **columns)
+            db.add(group)
+        groups[key] = group
+    
+    totals = rollups.add_values(json.loads(group.totals_json), rollups.rollup_values(table_name, fields), sign)
+    group.registros += sign
+    group.totals_json = json.dumps(totals, ensure_ascii=False, sort_keys=True)
+
+
+def _drop_empty_rollups(db, groups: Dict[tuple, MonthlyRollup]):
+    """Borra los grupos que se quedaron sin registros"""
+    db.flush()
+    for group in groups.values():
+        if group.registros <= 0:
+            db.delete(group)
+
+
+def _rebuild_rollups(db, table_name: str):
+    """Recalcula desde cero los consolidados de una tabla. No hace commit."""
+    db.query(MonthlyRollup).filter(MonthlyRollup.table_name == table_name).delete(synchronize_session=False)
+    groups: Dict[tuple, MonthlyRollup] = {}
+    for row in db.query(MirrorRecord).filter(MirrorRecord.table_name == table_name).yield_per(500):
+        _apply_rollup(db, table_name, json.loads(row.fields_json), 1, groups)
+
+
+def _upsert_records(db, table_name: str, records: List[Dict[str, Any]], backfill_run: Optional[str]) -> int:
+    """
+    Inserta o actualiza una página de registros. No hace commit.
+    
+    Returns:
+        Número de registros nuevos o con campos distintos a los guardados
+    """
+    if not records:
+        return 0
+    
+    now = datetime.utcnow()
+    ids = [r["id"] for r in records]
+    existing = {
+        row.record_id: row
+        for row in db.query(MirrorRecord).filter(
+            MirrorRecord.table_name == table_name,
+            MirrorRecord.record_id.in_(ids)
+        )
+    }
+    
+    changed = 0
+    groups: Dict[tuple, MonthlyRollup] = {}
+    for record in records:
+        fields = record.get("fields", {})
+        fields_json = json.dumps(fields, ensure_ascii=False, sort_keys=True)
+        row = existing.get(record["id"])
+        if row is None:
+            _apply_rollup(db, table_name, fields, 1, groups)
+            db.add(MirrorRecord(
+                table_name=table_name,
+                record_id=record["id"],
+                created_time=record.get("createdTime"),
+                fields_json=fields_json,
+                synced_at=now,
+                backfill_run=backfill_run
+            ))
+            changed += 1
+        else:
+            if row.fields_json != fields_json:
+                _apply_rollup(db, table_name, json.loads(row.fields_json), -1, groups)
+                _apply_rollup(db, table_name, fields, 1, groups)
+                row.fields_json = fields_json
+                changed += 1
+            row.synced_at = now
+            if backfill_run:
+                row.backfill_run = backfill_run
+    
+    _drop_empty_rollups(db, groups)
+    return changed
+
+
+def _needs_backfill(state: SyncState, full: bool) -> bool:
+    if full or state.backfill_run or state.backfill_completed_at is None:
+        return True
+    return datetime.utcnow() - state.backfill_completed_at > timedelta(hours=FULL_SYNC_HOURS)
+
+
+def _run_backfill(db, state: SyncState, fetch_page: FetchPage) -> Dict[str, Any]:
+    """Descarga la tabla completa, reanudando un backfill interrumpido si lo hay"""
+    table_name = state.table_name
+    if not state.backfill_run:
+        state.backfill_run = datetime.utcnow().isoformat()
+        state.backfill_offset = None
+        db.commit()
+    
+    offset = state.backfill_offset
+    resumed = offset is not None
+    pages = 0
+    changed = 0
+    
+    while True:
+        try:
+            records, next_offset = fetch_page(table_name, {"pageSize": airtable_client.AIRTABLE_PAGE_SIZE}, offset)
+        except AirtableAPIError as e:
+            if e.status_code == OFFSET_EXPIRED_STATUS and resumed and pages == 0:
+                # El cursor guardado expiró: empezar el backfill de nuevo
+                state.backfill_run = datetime.utcnow().isoformat()
+                state.backfill_offset = None
+                db.commit()
+                offset = None
+                resumed = False
+                continue
+            raise
+        
+        # La página y el cursor se guardan en la misma transacción
+        changed += _upsert_records(db, table_name, records, state.backfill_run)
+        state.backfill_offset = next_offset
+        db.commit()
+        pages += 1
+        
+        if not next_offset:
+            break
+        offset = next_offset
+    
+    # Lo que no vio este backfill fue borrado en Airtable
+    unseen = db.query(MirrorRecord).filter(
+        MirrorRecord.table_name == table_name,
+        (MirrorRecord.backfill_run != state.backfill_run) | (MirrorRecord.backfill_run.is_(None))
+    )
+    groups: Dict[tuple, MonthlyRollup] = {}
+    for row in unseen:
+        _apply_rollup(db, table_name, json.loads(row.fields_json), -1, groups)
+    deleted = unseen.delete(synchronize_session=False)
+    _drop_empty_rollups(db, groups)
+    
+    started = datetime.fromisoformat(state.backfill_run)
+    now = datetime.utcnow()
+    state.watermark = _airtable_timestamp(started - WATERMARK_OVERLAP)
+    state.backfill_run = None
+    state.backfill_offset = None
+    state.backfill_completed_at = now
+    state.last_sync_at = now
+    if changed or deleted:
+        state.version += 1
+    db.commit()
+    
+    return {"mode": "backfill", "resumed": resumed, "pages": pages, "changed": changed, "deleted": deleted}
+
+
+def _run_incremental(db, state: SyncState, fetch_page: FetchPage) -> Dict[str, Any]:
+    """Descarga solo los registros modificados después de la marca de agua"""
+    table_name = state.table_name
+    started = datetime.utcnow()
+    params = {
+        "pageSize": airtable_client.AIRTABLE_PAGE_SIZE,
+        "filterByFormula": f"IS_AFTER(LAST_MODIFIED_TIME(), '{state.watermark}')"
+    }
+    
+    offset = None
+    pages = 0
+    changed = 0
+    while True:
+        records, offset = fetch_page(table_name, params, offset)
+        changed += _upsert_records(db, table_name, records, None)
+        db.commit()
+        pages += 1
+        if not offset:
+            break
+    
+    # La marca de agua solo avanza si la sincronización terminó completa
+    state.watermark = _airtable_timestamp(started - WATERMARK_OVERLAP)
+    state.last_sync_at = datetime.utcnow()
+    if changed:
+        state.version += 1
+    db.commit()
+    
+    return {"mode": "incremental", "pages": pages, "changed": changed, "deleted": 0}
+
+
+def sync_table(table_name: str, full: bool = False, fetch_page: Optional[FetchPage] = None) -> Dict[str, Any]:
+    """
+    Sincroniza una tabla con Airtable (backfill o incremental según su estado).
+    
+    Args:
+        table_name: "Certificados" o "Kardex"
+        full: Forzar un backfill completo
+        fetch_page: Función para pedir páginas (por defecto la API real);
+            las pruebas pasan aquí una Airtable simulada
+    
+    Returns:
+        Diccionario con el modo, páginas pedidas, registros cambiados y borrados
+    """
+    fetch_page = fetch_page or _default_fetch_page()
+    db = _open_session()
+    try:
+        state = _get_sync_state(db, table_name)
+        if _needs_backfill(state, full):
+            result = _run_backfill(db, state, fetch_page)
+        else:
+            result = _run_incremental(db, state, fetch_page)
+        result["version"] = state.version
+        result["watermark"] = state.watermark
+        return result
+    finally:
+        db.close()
+
+
+def sync_all(full: bool = False, fetch_page: Optional[FetchPage] = None) -> Dict[str, Dict[str, Any]]:
+    """Sincroniza todas las tablas de MIRRORED_TABLES"""
+    return {table_name: sync_table(table_name, full, fetch_page) for table_name in MIRRORED_TABLES}
+
+
+def get_sync_info(table_name: str) -> Dict[str, Any]:
+    """
+    Estado de la copia local de una tabla.
+    
+    Returns:
+        Diccionario con ready (hay al menos un backfill completo), version,
+        watermark, last_sync_at y age_seconds (antigüedad de la última sincronización)
+    """
+    not_ready = {"ready": False, "version": 0, "watermark": None, "last_sync_at": None, "age_seconds": None}
+    if not is_configured():
+        return not_ready
+    
+    db = SessionLocal()
+    try:
+        state = db.get(SyncState, table_name)
+        if state is None:
+            return not_ready
+        
+        age = None
+        if state.last_sync_at:
+            age = (datetime.utcnow() - state.last_sync_at).total_seconds()
+        
+        return {
+            "ready": state.backfill_completed_at is not None,
+            "version": state.version,
+            "watermark": state.watermark,
+            "last_sync_at": state.last_sync_at.isoformat() if state.last_sync_at else None,
+            "age_seconds": age
+        }
+    finally:
+        db.close()
+
+
+def count_records(table_name: str) -> int:
+    """Número de registros de la tabla en la copia local"""
+    db = _open_session()
+    try:
+        return db.query(MirrorRecord).filter(MirrorRecord.table_name == table_name).count()
+    finally:
+        db.close()
+
+
+def iter_mirror_records(table_name: str, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+    """
+    Recorre los registros de la copia local con la forma de la API de Airtable
+    ({"id", "createdTime", "fields"}), en orden de creación.
+    
+    Lee por lotes para no cargar la tabla completa en memoria.
+    """
+    db = _open_session()
+    try:
+        query = db.query(MirrorRecord).filter(
+            MirrorRecord.table_name == table_name
+        ).order_by(MirrorRecord.created_time, MirrorRecord.record_id)
+        for row in query.yield_per(batch_size):
+            yield row.to_airtable()
+    finally:
+        db.close()
+
+
+def get_rollups(table_name: str) -> List[Dict[str, Any]]:
+    """
+    Consolidados mensuales de una tabla (ver rollups.summarize para agruparlos).
+    
+    Returns:
+        Una fila por grupo: {"mes", "coordinador", "municipio", "centro_acopio",
+        "gestor", "tipo_movimiento", "registros", <material>: kg, ...}
+    """
+    db = _open_session()
+    try:
+        query = db.query(MonthlyRollup).filter(MonthlyRollup.table_name == table_name)
+        return [group.to_dict() for group in query]
+    finally:
+        db.close()
+
+
+def get_mirror_records(table_name: str, record_ids: List[str], batch_size: int = 500) -> List[Dict[str, Any]]:
+    """
+    Lee de la copia local solo los registros indicados, en el mismo orden de
+    `record_ids` (los que ya no existan se omiten).
+    """
+    found: Dict[str, Dict[str, Any]] = {}
+    db = _open_session()
+    try:
+        for start in range(0, len(record_ids), batch_size):
+            batch = record_ids[start:start + batch_size]
+            rows = db.query(MirrorRecord).filter(
+                MirrorRecord.table_name == table_name,
+                MirrorRecord.record_id.in_(batch)
+            )
+            for row in rows:
+                found[row.record_id] = row.to_airtable()
+    finally:
+        db.close()
+    return [found[record_id] for record_id in record_ids if record_id in found]
+
+
+def sync_enabled() -> bool:
+    """La sincronización en segundo plano requiere credenciales y no estar desactivada"""
+    return (
+        os.getenv("MIRROR_SYNC_ENABLED", "1") != "0"
+        and bool(os.getenv("AIRTABLE_API_KEY"))
+        and bool(os.getenv("AIRTABLE_BASE_ID"))
+    )
+
+
+async def run_sync_loop(interval: int = SYNC_INTERVAL):
+    """
+    Tarea de fondo del servidor: sincroniza las tablas cada `interval` segundos.
+    
+    La sincronización usa el cliente síncrono en un hilo aparte, así que no
+    bloquea el event loop. Los errores se registran y se reintenta en la
+    siguiente vuelta (el backfill continúa desde el último cursor guardado).
+    """
+    while True:
+        try:
+            result = await asyncio.to_thread(sync_all)
+            print(f"Sincronización de la copia local: {result}")
+        except Exception as e:
+            print(f"Advertencia: falló la sincronización de la copia local: {type(e).__name__}: {e}")
+        await asyncio.sleep(interval)
+
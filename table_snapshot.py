@@ -0,0 +1,258 @@
+"""
+Instantáneas de las tablas Certificados y Kardex para el contexto del agente.
+
+El agente con contexto solo usa cuántos registros tiene cada tabla para armar
+el prompt, así que no tiene sentido descargar y transformar 200 registros en
+cada turno. Este módulo guarda el conteo y los metadatos de cada tabla en una
+caché con TTL y pide las filas solo cuando alguna etapa las necesita
+(`TableSnapshot.get_records()`).
+
+Fuente de los datos:
+- La copia local (table_mirror.py) si ya completó un backfill: el conteo es
+  una consulta a SQLite y no se llama a Airtable.
+- Si no, Airtable: se piden hasta `max_records` registros (como antes) y se
+  cuentan; esos registros quedan en la instantánea por si se necesitan.
+
+El conteo significa lo mismo con las dos fuentes: registros hasta
+`max_records`, con `truncated` si la tabla tiene más (en Airtable se pide un
+registro de más para saberlo). `count_label()` es el texto que ve el agente
+("100" o "más de 100").
+
+Configuración (variables de entorno opcionales):
+    SNAPSHOT_TTL_SECONDS   Segundos que se reutiliza una instantánea (default: 300)
+"""
+import os
+import time
+import asyncio
+import threading
+from datetime import datetime
+from itertools import islice
+from typing import Dict, List, Any, Optional, Tuple
+
+import airtable_client
+import table_mirror
+
+
+SNAPSHOT_TTL = float(os.getenv("SNAPSHOT_TTL_SECONDS", "300"))
+
+# Campos que usa el agente por tabla: (nombre en el agente, campo en Airtable, valor por defecto)
+CERTIFICADOS_FIELDS: List[Tuple[str, str, Any]] = [
+    ("pre_consecutivo", "pre_consecutivo", "N/A"),
+    ("fechadevolucion", "fechadevolucion", "N/A"),
+    ("nombrecoordinador", "nombrecoordinador", "N/A"),
+    ("rigidos", "rigidos", 0),
+    ("flexibles", "flexibles", 0),
+    ("metalicos", "metalicos", 0),
+    ("embalaje", "embalaje", 0),
+    ("total", "total", 0),
+    ("municipiogenerador", "municipiogenerador", "N/A"),
+    ("municipiodevolucion", "municipiodevolucion", "N/A"),
+    ("observaciones", "observaciones", ""),
+]
+
+KARDEX_FIELDS: List[Tuple[str, str, Any]] = [
+    ("idkardex", "idkardex", "N/A"),
+    ("fechakardex", "fechakardex", "N/A"),
+    ("TipoMovimiento", "TipoMovimiento", "N/A"),
+    ("coordinador", "Name (from Coordinador)", "N/A"),
+    ("MunicipioOrigen", "MunicipioOrigen", "N/A"),
+    ("Reciclaje", "Reciclaje", 0),
+    ("Incineración", "Incineración", 0),
+    ("PlasticoContaminado", "PlasticoContaminado", 0),
+    ("Flexibles", "Flexibles", 0),
+    ("Lonas", "Lonas", 0),
+    ("Carton", "Carton", 0),
+    ("Metal", "Metal", 0),
+    ("Total", "Total", 0),
+    ("CentrodeAcopio", "NombreCentrodeAcopio", "N/A"),
+    ("gestor", "nombregestor", "N/A"),
+    ("Observaciones", "Observaciones", ""),
+]
+
+TABLE_FIELDS: Dict[str, List[Tuple[str, str, Any]]] = {
+    "Certificados": CERTIFICADOS_FIELDS,
+    "Kardex": KARDEX_FIELDS,
+}
+
+_snapshots: Dict[Tuple[str, int], "TableSnapshot"] = {}
+_snapshots_lock = threading.Lock()
+
+
+def projection(table_name: str) -> List[str]:
+    """
+    Campos de Airtable que usa el agente en una tabla, para enviarlos como `fields[]`.
+    
+    Así Airtable no devuelve adjuntos (certificadopdf), lookups ni columnas que
+    reshape_records descartaría de todos modos.
+    """
+    return [airtable_field for _, airtable_field, _ in TABLE_FIELDS[table_name]]
+
+
+def field_defaults(table_name: str) -> Dict[str, Any]:
+    """Valor por defecto de cada campo del agente (el que pone reshape_records si falta)"""
+    return {key: default for key, _, default in TABLE_FIELDS[table_name]}
+
+
+def reshape_records(table_name: str, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Reduce los registros de Airtable a los campos que usa el agente (TABLE_FIELDS)"""
+    mapping = TABLE_FIELDS[table_name]
+    rows = []
+    for record in records:
+        fields = record.get("fields", {})
+        row = {"tabla": table_name}
+        for key, airtable_field, default in mapping:
+            row[key] = fields.get(airtable_field, default)
+        rows.append(row)
+    
+    return rows
+
+
+class TableSnapshot:
+    """
+    Conteo y metadatos de una tabla en un momento dado.
+    
+    Las filas se cargan la primera vez que se llama a get_records()
+    (o vienen ya cargadas si el conteo se hizo contra Airtable).
+    """
+    
+    def __init__(
+        self,
+        table_name: str,
+        max_records: int,
+        count: int,
+        source: str,
+        records: Optional[List[Dict[str, Any]]] = None,
+        truncated: bool = False
+    ):
+        self.table_name = table_name
+        self.max_records = max_records
+        self.count = count  # hasta max_records
+        self.truncated = truncated  # la tabla tiene más de max_records registros
+        self.source = source  # "mirror" o "airtable"
+        self.fetched_at = datetime.utcnow()
+        self._created = time.monotonic()
+        self._records = records
+        self._lock = threading.Lock()
+    
+    def age_seconds(self) -> float:
+        return time.monotonic() - self._created
+    
+    def is_fresh(self, ttl: float = None) -> bool:
+        return self.age_seconds() < (SNAPSHOT_TTL if ttl is None else ttl)
+    
+    def get_records(self) -> List[Dict[str, Any]]:
+        """Filas ya transformadas con reshape_records (máximo max_records)"""
+        with self._lock:
+            if self._records is None:
+                self._records = _fetch_records(self.table_name, self.max_records, self.source)
+            return reshape_records(self.table_name, self._records)
+    
+    def count_label(self) -> str:
+        """Conteo para el prompt: "40", o "más de 100" si la tabla pasa de max_records"""
+        return f"más de {self.count}" if self.truncated else str(self.count)
+    
+    def metadata(self) -> Dict[str, Any]:
+        return {
+            "table": self.table_name,
+            "count": self.count,
+            "truncated": self.truncated,
+            "source": self.source,
+            "fetched_at": self.fetched_at.isoformat(),
+            "age_seconds": round(self.age_seconds(), 1),
+            "rows_loaded": self._records is not None
+        }
+
+
+def _mirror_ready(table_name: str) -> bool:
+    return table_mirror.is_configured() and table_mirror.get_sync_info(table_name)["ready"]
+
+
+def _fetch_records(table_name: str, max_records: int, source: str) -> List[Dict[str, Any]]:
+    """Descarga hasta max_records registros de la fuente indicada"""
+    if source == "mirror":
+        return list(islice(table_mirror.iter_mirror_records(table_name), max_records))
+    
+    records = []
+    for page in airtable_client.iter_record_pages(
+        os.getenv("AIRTABLE_BASE_ID"),
+        os.getenv("AIRTABLE_API_KEY"),
+        table_name,
+        {"fields[]": projection(table_name)},
+        max_records=max_records
+    ):
+        records.extend(page)
+    return records
+
+
+def _mirror_snapshot(table_name: str, max_records: int, total: int) -> TableSnapshot:
+    """Instantánea de la copia local con el conteo acotado igual que el de Airtable"""
+    return TableSnapshot(table_name, max_records, min(total, max_records), "mirror", truncated=total > max_records)
+
+
+def _airtable_snapshot(table_name: str, max_records: int, records: List[Dict[str, Any]]) -> TableSnapshot:
+    """Instantánea de los registros pedidos a Airtable (max_records + 1 para saber si hay más)"""
+    return TableSnapshot(
+        table_name, max_records, min(len(records), max_records), "airtable",
+        records[:max_records], truncated=len(records) > max_records
+    )
+
+
+def _build_snapshot(table_name: str, max_records: int) -> TableSnapshot:
+    if _mirror_ready(table_name):
+        return _mirror_snapshot(table_name, max_records, table_mirror.count_records(table_name))
+    
+    return _airtable_snapshot(table_name, max_records, _fetch_records(table_name, max_records + 1, "airtable"))
+
+
+async def _abuild_snapshot(table_name: str, max_records: int) -> TableSnapshot:
+    if await asyncio.to_thread(_mirror_ready, table_name):
+        total = await asyncio.to_thread(table_mirror.count_records, table_name)
+        return _mirror_snapshot(table_name, max_records, total)
+    
+    records = []
+    async for page in airtable_client.aiter_record_pages(
+        os.getenv("AIRTABLE_BASE_ID"),
+        os.getenv("AIRTABLE_API_KEY"),
+        table_name,
+        {"fields[]": projection(table_name)},
+        max_records=max_records + 1
+    ):
+        records.extend(page)
+    return _airtable_snapshot(table_name, max_records, records)
+
+
+def _cached(table_name: str, max_records: int) -> Optional[TableSnapshot]:
+    with _snapshots_lock:
+        snapshot = _snapshots.get((table_name, max_records))
+    if snapshot is not None and snapshot.is_fresh():
+        return snapshot
+    return None
+
+
+def _store(snapshot: TableSnapshot) -> TableSnapshot:
+    with _snapshots_lock:
+        _snapshots[(snapshot.table_name, snapshot.max_records)] = snapshot
+    return snapshot
+
+
+def get_snapshot(table_name: str, max_records: int = 100) -> TableSnapshot:
+    """
+    Devuelve la instantánea de una tabla, reutilizando la de la caché si no venció.
+    
+    Raises:
+        AirtableAPIError: Si hay que consultar Airtable y responde con error
+    """
+    return _cached(table_name, max_records) or _store(_build_snapshot(table_name, max_records))
+
+
+async def aget_snapshot(table_name: str, max_records: int = 100) -> TableSnapshot:
+    """Versión asíncrona de get_snapshot (no bloquea el event loop)"""
+    return _cached(table_name, max_records) or _store(await _abuild_snapshot(table_name, max_records))
+
+
+def invalidate(table_name: Optional[str] = None):
+    """Descarta las instantáneas en caché (de una tabla o de todas)"""
+    with _snapshots_lock:
+        for key in list(_snapshots):
+            if table_name is None or key[0] == table_name:
+                del _snapshots[key]
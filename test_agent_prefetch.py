@@ -0,0 +1,154 @@
+"""
+Pruebas de la consulta en paralelo de tablas del agente legacy (agent_core._fetch_tables).
+No requieren conexión: usan una sesión simulada con latencia por tabla.
+"""
+import time
+import airtable_client
+import record_store
+import table_mirror
+from agent_core import _fetch_tables, _load_stores, _table_section
+from test_filter_ast import airtable_dates
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self._payload = payload
+        self.status_code = status_code
+        self.text = str(payload)
+
+    def json(self):
+        return self._payload
+
+
+class SlowSession:
+    """Cada tabla tarda `delays[tabla]` segundos; las de `failing` responden 500"""
+
+    def __init__(self, delays, failing=()):
+        self.delays = delays
+        self.failing = failing
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        table_name = url.rsplit("/", 1)[-1]
+        assert params["fields[]"], "se esperaba la proyección de campos"
+        time.sleep(self.delays.get(table_name, 0))
+        if table_name in self.failing:
+            return FakeResponse({"error": "SERVER_ERROR"}, 500)
+        return FakeResponse({"records": [{"id": "rec1", "fields": {"total": 5, "Total": 7}}]})
+
+
+def run_with_session(session, timeout=None):
+    airtable_client._session, original = session, airtable_client._session
+    try:
+        start = time.monotonic()
+        tables, errors = _fetch_tables("appPrefetchTest", "key", ["Certificados", "Kardex"], 10, timeout)
+        return tables, errors, time.monotonic() - start
+    finally:
+        airtable_client._session = original
+
+
+def test_tables_are_fetched_concurrently():
+    print("\n=== TEST: las dos tablas se consultan a la vez ===")
+    tables, errors, elapsed = run_with_session(SlowSession({"Certificados": 0.3, "Kardex": 0.3}))
+    print(f"Tiempo total: {elapsed:.2f}s")
+    assert errors == {}
+    assert tables["Certificados"][0]["fields"]["total"] == 5
+    assert tables["Kardex"][0]["fields"]["Total"] == 7
+    assert elapsed < 0.55
+
+
+def test_failing_table_does_not_abort_the_other():
+    print("\n=== TEST: una tabla con error no impide usar la otra ===")
+    tables, errors, _ = run_with_session(SlowSession({}, failing=("Kardex",)))
+    print(f"Errores: {errors}")
+    assert len(tables["Certificados"]) == 1
+    assert tables["Kardex"] == []
+    assert errors["Kardex"].startswith("Error 500")
+
+
+def test_slow_table_times_out():
+    print("\n=== TEST: una tabla lenta se abandona al vencer el timeout ===")
+    tables, errors, elapsed = run_with_session(SlowSession({"Kardex": 1.0}), timeout=0.2)
+    print(f"Tiempo total: {elapsed:.2f}s - errores: {errors}")
+    assert len(tables["Certificados"]) == 1
+    assert "Kardex" in errors
+    assert elapsed < 0.6
+
+
+class PagedAirtable:
+    """Airtable simulada: aplica las fechas de filterByFormula, ordena, pagina de a 100 y respeta maxRecords"""
+
+    def __init__(self, records):
+        self.records = records
+        self.calls = []
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        self.calls.append(dict(params))
+        date_field = params["sort[0][field]"]
+        matched = [r for r in self.records if airtable_dates(params.get("filterByFormula", ""), r["fields"])]
+        matched.sort(key=lambda r: r["fields"][date_field], reverse=params["sort[0][direction]"] == "desc")
+        matched = matched[:int(params.get("maxRecords") or len(matched))]
+        start = int(params.get("offset") or 0)
+        end = start + int(params["pageSize"])
+        payload = {"records": matched[start:end]}
+        if end < len(matched):
+            payload["offset"] = str(end)
+        return FakeResponse(payload)
+
+
+def certificados_across_years():
+    """150 certificados de 2024 (total 2 c/u) y 120 de 2023 (total 5 c/u), intercalados"""
+    records = []
+    for i in range(270):
+        year, total = (2024, 2) if i % 9 < 5 else (2023, 5)
+        records.append({"id": f"rec{i:04d}", "createdTime": "2024-01-01T00:00:00.000Z", "fields": {
+            "fechadevolucion": f"{year}-{i % 12 + 1:02d}-{i % 28 + 1:02d}", "nombrecoordinador": "Ana", "total": total}})
+    return records
+
+
+def load_certificados(session, max_records):
+    airtable_client._session, original = session, airtable_client._session
+    table_mirror.engine = table_mirror.SessionLocal = None  # sin copia local
+    record_store.invalidate()
+    try:
+        stores, errors, sources, truncated = _load_stores(
+            "appPrefetchTest", "key", ["Certificados"], max_records, "2023-12-31", "2025-01-01"
+        )
+    finally:
+        airtable_client._session = original
+    assert errors == {} and sources == {"Certificados": "airtable"}
+    return _table_section("Certificados", stores["Certificados"], None, "2023-12-31", "2025-01-01",
+                          "airtable", truncated["Certificados"])
+
+
+def test_fallback_fetches_the_whole_period():
+    print("\n=== TEST: sin copia local se trae todo el periodo de Airtable, no solo 100 registros ===")
+    records = certificados_across_years()
+    in_2024 = [r for r in records if r["fields"]["fechadevolucion"].startswith("2024")]
+    assert len(in_2024) == 150
+    session = PagedAirtable(records)
+    text, metadata = load_certificados(session, 5000)
+    print(text.split("\n")[1])
+    assert len(session.calls) > 1
+    assert "IS_BEFORE({fechadevolucion}, '2025-01-01')" in session.calls[0]["filterByFormula"]
+    assert metadata["rows_in_period"] == 150 and not metadata["truncated"]
+    assert "no las recalcules" in text
+    assert "Registros en el periodo: 150." in text
+    assert "| 150 |" in text and "| 300 |" in text  # registros y total de 2024 (150 x 2 kg)
+
+
+def test_fallback_cap_is_labelled_as_sample():
+    print("\n=== TEST: si se corta en max_records la sección es una muestra parcial ===")
+    text, metadata = load_certificados(PagedAirtable(certificados_across_years()), 100)
+    print(text.split("\n")[0])
+    assert metadata["truncated"] and metadata["rows_total"] == 100
+    assert "MUESTRA PARCIAL" in text and "no las recalcules" not in text
+    assert "al menos 100" in text
+
+
+if __name__ == "__main__":
+    test_tables_are_fetched_concurrently()
+    test_failing_table_does_not_abort_the_other()
+    test_slow_table_times_out()
+    test_fallback_fetches_the_whole_period()
+    test_fallback_cap_is_labelled_as_sample()
+    print("\n✅ Pruebas completadas")
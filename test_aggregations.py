@@ -0,0 +1,102 @@
+"""
+Pruebas del motor de agregación (aggregations.py).
+Compara los consolidados con sumas hechas registro por registro.
+"""
+import aggregations
+from aggregations import Columns, aggregate, totals, consolidated_report
+
+
+def record(fields):
+    return {"id": "rec", "createdTime": "2024-01-01T00:00:00.000Z", "fields": fields}
+
+
+CERTIFICADOS = [
+    record({"nombrecoordinador": "Ana", "municipiogenerador": "Ibagué", "fechadevolucion": "2024-01-10",
+            "rigidos": 10, "flexibles": 2.5, "metalicos": 1, "embalaje": 0, "total": 13.5}),
+    record({"nombrecoordinador": "Juan", "municipiogenerador": "Espinal", "fechadevolucion": "2024-01-20",
+            "rigidos": 4, "total": 4}),
+    record({"nombrecoordinador": "Ana", "municipiogenerador": "Honda", "fechadevolucion": "2024-02-03",
+            "rigidos": 1, "flexibles": 1, "total": 2}),
+    record({"nombrecoordinador": ["Ana"], "municipiogenerador": ["Ibagué"], "total": "3"}),
+    record({"municipiogenerador": "Ibagué", "total": 1}),
+]
+
+KARDEX = [
+    record({"Name (from Coordinador)": ["Ana"], "nombregestor": ["Gestor A"], "fechakardex": "2024-03-01",
+            "Reciclaje": 5, "Incineración": 2, "Total": 7}),
+    record({"Name (from Coordinador)": ["Juan"], "nombregestor": ["Gestor A"], "fechakardex": "2024-03-15",
+            "Reciclaje": 1, "Metal": 3, "Total": 4}),
+]
+
+
+def test_group_by_coordinator_matches_manual_sums():
+    print("\n=== TEST: consolidado por coordinador ===")
+    rows = aggregate(Columns("Certificados", CERTIFICADOS), "coordinador")
+    print(rows)
+    by_name = {row["coordinador"]: row for row in rows}
+    assert by_name["Ana"]["registros"] == 3
+    assert by_name["Ana"]["total"] == 13.5 + 2 + 3
+    assert by_name["Ana"]["flexibles"] == 3.5
+    assert by_name["Juan"]["total"] == 4
+    assert by_name["(sin dato)"]["registros"] == 1
+    assert rows[0]["coordinador"] == "Ana"  # ordenado por total
+
+
+def test_group_by_month_and_totals():
+    print("\n=== TEST: consolidado por mes y total general ===")
+    columns = Columns("Certificados", CERTIFICADOS)
+    months = [row["mes"] for row in aggregate(columns, "mes")]
+    assert months == ["(sin dato)", "2024-01", "2024-02"]
+    overall = totals(columns)
+    assert overall["registros"] == 5
+    assert overall["total"] == sum(float(r["fields"].get("total", 0)) for r in CERTIFICADOS)
+
+
+def test_kardex_group_by_gestor():
+    print("\n=== TEST: Kardex por gestor ===")
+    rows = aggregate(Columns("Kardex", KARDEX), "gestor")
+    assert rows == [{"gestor": "Gestor A", "registros": 2, "Reciclaje": 6.0, "Incineración": 2.0,
+                     "PlasticoContaminado": 0.0, "Flexibles": 0.0, "Lonas": 0.0, "Carton": 0.0,
+                     "Metal": 3.0, "Total": 11.0}]
+
+
+def test_unknown_dimension():
+    print("\n=== TEST: dimensión no válida ===")
+    try:
+        aggregate(Columns("Certificados", CERTIFICADOS), "gestor")
+        raise AssertionError("se esperaba ValueError")
+    except ValueError:
+        pass
+
+
+def test_consolidated_report_text():
+    print("\n=== TEST: texto del consolidado ===")
+    text = consolidated_report("Kardex", KARDEX)
+    print(text)
+    assert "Total general (Kardex):" in text
+    assert "Por gestor:" in text
+    assert "Gestor A | 2 | 6 | 2 | 0 | 0 | 0 | 0 | 3 | 11" in text
+
+
+def test_vectorized_sums_match_python_loop():
+    print("\n=== TEST: las sumas con numpy coinciden con el recorrido en Python ===")
+    columns = Columns("Kardex", KARDEX * 50)
+    vectorized = aggregate(columns, "gestor")
+    saved, aggregations.numpy = aggregations.numpy, None
+    try:
+        python_loop = aggregate(columns, "gestor")
+    finally:
+        aggregations.numpy = saved
+    print(f"numpy instalado: {saved is not None}")
+    assert vectorized == python_loop
+    assert aggregate(Columns("Kardex", []), "gestor") == []
+
+
+if __name__ == "__main__":
+    test_group_by_coordinator_matches_manual_sums()
+    test_group_by_month_and_totals()
+    test_kardex_group_by_gestor()
+    test_unknown_dimension()
+    test_consolidated_report_text()
+    test_vectorized_sums_match_python_loop()
+    print("\n✅ Pruebas completadas")
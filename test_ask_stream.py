@@ -0,0 +1,191 @@
+"""
+Pruebas del modo streaming de /ask (Server-Sent Events) sin conexión:
+OpenAI, los conteos de tablas y la BD de conversaciones se sustituyen por dobles.
+
+Verifica que los fragmentos llegan antes de que termine la respuesta de
+OpenAI, que el evento final trae el mismo JSON que /ask y que el estado se
+guarda una sola vez, también si el cliente se desconecta antes del final.
+"""
+import os
+import json
+import asyncio
+import tempfile
+from types import SimpleNamespace
+from fastapi.testclient import TestClient
+import agent_with_context
+import response_cache
+import server
+from conversation_state import ConversationState
+
+
+CHUNKS = ["Necesito que ", "me indiques ", "el periodo."]
+
+
+class FakeStream:
+    """Eventos de la API de Responses con stream=True; anota cuándo terminó"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.finished = False
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield SimpleNamespace(type="response.output_text.delta", delta=chunk)
+            await asyncio.sleep(0)
+        usage = SimpleNamespace(input_tokens=2000, output_tokens=12,
+                                input_tokens_details=SimpleNamespace(cached_tokens=1536))
+        yield SimpleNamespace(type="response.completed",
+                              response=SimpleNamespace(output_text="".join(self.chunks), usage=usage))
+        self.finished = True
+
+
+class StreamEnv:
+    """Credenciales de prueba, caché de respuestas en memoria y dobles de OpenAI, conteos y BD"""
+
+    def __init__(self, chunks=CHUNKS):
+        self.streams = []
+        self.chunks = chunks
+        self.saved_states = []
+        self.state = ConversationState(user_id="director", conversation_id="conv-stream")
+
+    async def create(self, **kwargs):
+        assert kwargs.get("stream") is True
+        self.streams.append(FakeStream(self.chunks))
+        return self.streams[-1]
+
+    async def get_or_create(self, user_id, conversation_id=None):
+        return self.state
+
+    async def update(self, state):
+        self.saved_states.append(json.loads(json.dumps(state.to_dict())))
+
+    def __enter__(self):
+        names = ("AIRTABLE_API_KEY", "AIRTABLE_BASE_ID", "OPENAI_API_KEY")
+        self.saved_env = {name: os.environ.get(name) for name in names}
+        os.environ.update(AIRTABLE_API_KEY="key_test", AIRTABLE_BASE_ID="app_test", OPENAI_API_KEY="sk_test")
+
+        async def load_counts_async(max_records):
+            return {"Certificados": 10, "Kardex": 20}, None
+
+        self.saved = (agent_with_context.get_async_openai_client, agent_with_context._load_counts_async,
+                      server.aget_or_create_conversation, server.aupdate_conversation)
+        agent_with_context.get_async_openai_client = lambda: SimpleNamespace(responses=SimpleNamespace(create=self.create))
+        agent_with_context._load_counts_async = load_counts_async
+        server.aget_or_create_conversation = self.get_or_create
+        server.aupdate_conversation = self.update
+        response_cache.configure(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'response_cache.db')}")
+        return self
+
+    def __exit__(self, *exc):
+        (agent_with_context.get_async_openai_client, agent_with_context._load_counts_async,
+         server.aget_or_create_conversation, server.aupdate_conversation) = self.saved
+        for name, value in self.saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def parse_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_deltas_arrive_before_completion():
+    print("\n=== TEST: el primer fragmento sale antes de que OpenAI termine ===")
+    with StreamEnv() as env:
+        async def first_event():
+            events = agent_with_context.stream_agent_with_context("certificados de Ana", env.state)
+            kind, text = await events.__anext__()
+            finished = env.streams[0].finished
+            rest = [event async for event in events]
+            return (kind, text, finished), rest
+
+        (kind, text, finished), rest = asyncio.run(first_event())
+        assert (kind, text, finished) == ("delta", CHUNKS[0], False)
+        assert rest[-1] == ("message", "".join(CHUNKS))
+        assert env.state.history[-1]["role"] == "agent"
+        assert env.state.history[-1]["content"] == "".join(CHUNKS)
+
+
+def test_stream_endpoint_matches_ask():
+    print("\n=== TEST: /ask/stream emite deltas y un evento final igual a /ask, guardando una vez ===")
+    with StreamEnv() as env:
+        client = TestClient(server.app)
+        response = client.post("/ask/stream", json={"question": "certificados de Ana", "user_id": "director",
+                                                    "conversation_id": "conv-stream"})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = parse_events(response.text)
+        print(events[-1][1]["message"], events[-1][1]["state"]["status"])
+
+        assert [data["text"] for kind, data in events if kind == "delta"] == CHUNKS
+        kind, final = events[-1]
+        assert kind == "done" and final["message"] == "".join(CHUNKS)
+        assert final["conversation_id"] == "conv-stream" and final["done"] is False
+        assert set(final["state"]) >= {"status", "step", "filters", "issues", "execution"}
+
+        # Una sola escritura, al final y con la respuesta del agente ya en el historial
+        assert len(env.saved_states) == 1
+        assert env.saved_states[0]["history"][-1]["content"] == "".join(CHUNKS)
+
+        # La misma pregunta otra vez: sale de la caché de respuestas, en un solo delta
+        env.state = ConversationState(user_id="director", conversation_id="conv-stream")
+        events = parse_events(client.post("/ask/stream", json={"question": "certificados de Ana"}).text)
+        assert len(env.streams) == 1
+        assert events[0] == ("delta", {"text": "".join(CHUNKS)}) and events[-1][0] == "done"
+
+
+def test_openai_error_ends_stream():
+    print("\n=== TEST: un error de OpenAI termina el stream con el evento final ===")
+    with StreamEnv() as env:
+        async def failing_create(**kwargs):
+            raise RuntimeError("timeout")
+
+        agent_with_context.get_async_openai_client = lambda: SimpleNamespace(
+            responses=SimpleNamespace(create=failing_create)
+        )
+        events = parse_events(TestClient(server.app).post("/ask/stream", json={"question": "hola"}).text)
+        kind, final = events[-1]
+        assert kind == "done" and final["message"] == "Error al consultar OpenAI: timeout"
+        assert final["state"]["execution"]["error"] == "Error al consultar OpenAI: timeout"
+        assert len(env.saved_states) == 1
+
+
+def test_disconnect_still_saves_turn():
+    print("\n=== TEST: si el cliente se desconecta antes de done el turno se guarda igual ===")
+    with StreamEnv() as env:
+        async def disconnect_after_first_delta():
+            data = server.PreguntaConContextoData(question="certificados de Ana", user_id="director",
+                                                  conversation_id="conv-stream")
+            response = await server.consultar_agente_stream(data)
+            first = await response.body_iterator.__anext__()
+            await response.body_iterator.aclose()  # el cliente cierra la conexión
+            saved_before = len(env.saved_states)
+            await asyncio.gather(*server._turnos_en_curso)
+            return first, saved_before
+
+        first, saved_before = asyncio.run(disconnect_after_first_delta())
+        assert first.startswith("event: delta") and saved_before == 0
+        assert len(env.saved_states) == 1
+        history = env.saved_states[0]["history"]
+        assert [message["role"] for message in history[-2:]] == ["user", "agent"]
+        assert history[-1]["content"] == "".join(CHUNKS)
+
+        # El reintento parte del estado guardado (con el turno en el historial),
+        # así que no reutiliza la respuesta de un estado que no lo tenía
+        env.state = ConversationState.from_dict(env.saved_states[0])
+        events = parse_events(TestClient(server.app).post("/ask/stream", json={"question": "certificados de Ana"}).text)
+        assert len(env.streams) == 2 and events[-1][0] == "done"
+        assert [message["role"] for message in env.saved_states[-1]["history"]] == ["user", "agent"] * 2
+
+
+if __name__ == "__main__":
+    test_deltas_arrive_before_completion()
+    test_stream_endpoint_matches_ask()
+    test_openai_error_ends_stream()
+    test_disconnect_still_saves_turn()
+    print("\n✅ Pruebas completadas")
@@ -0,0 +1,124 @@
+"""
+Pruebas del árbol de filtros (filter_ast.py): fórmula, escape, descripción
+y memorización. No requiere conexión.
+"""
+import re
+import filter_ast
+import record_store
+from local_query import run_query
+from queries import _build_query_params, _build_filter_description
+
+
+def test_formula_matches_previous_format():
+    print("\n=== TEST: la fórmula conserva el formato de siempre ===")
+    filters = {"coordinador": "Ana Gómez", "fecha_desde": "2024-01-01", "municipio": "Ibagué"}
+    formula = _build_query_params(filters, [], [])["filterByFormula"]
+    print(f"Fórmula: {formula}")
+    assert formula == (
+        "AND({nombrecoordinador}='Ana Gómez', IS_AFTER({fechadevolucion}, '2024-01-01'), "
+        "OR({municipiogenerador}='Ibagué', {municipiodevolucion}='Ibagué'))"
+    )
+    assert _build_query_params({"fecha_hasta": "2024-12-31"}, [], [])["filterByFormula"] == \
+        "IS_BEFORE({fechadevolucion}, '2024-12-31')"
+    assert "filterByFormula" not in _build_query_params({}, [], [])
+
+
+def test_values_are_escaped():
+    print("\n=== TEST: comillas y barras invertidas se escapan ===")
+    formula = filter_ast.compile_filters({"coordinador": "Pat O'Neil", "observaciones": "a\\b"}).formula()
+    print(f"Fórmula: {formula}")
+    assert formula == "AND({nombrecoordinador}='Pat O\\'Neil', {observaciones}='a\\\\b')"
+    injected = filter_ast.compile_filters({"coordinador": "x') , TRUE(), ('"}).formula()
+    assert injected == "{nombrecoordinador}='x\\') , TRUE(), (\\''"
+
+
+def test_in_lists_and_ranges():
+    print("\n=== TEST: listas IN, rangos numéricos y fechas no válidas ===")
+    tree = filter_ast.compile_filters({"coordinador": ["Ana", "Juan"], "total_min": 10, "total_max": 20.5})
+    assert tree.formula() == (
+        "AND(OR({nombrecoordinador}='Ana', {nombrecoordinador}='Juan'), AND({total}>=10, {total}<=20.5))"
+    )
+    assert tree.describe() == "coordinador Ana o Juan, total mínimo 10 y máximo 20.5"
+    predicate = tree.predicate()
+    assert predicate({"nombrecoordinador": "Juan", "total": 10})
+    assert not predicate({"nombrecoordinador": "Juan", "total": 21})
+    assert not predicate({"nombrecoordinador": "Luis", "total": 15})
+
+    invalid = filter_ast.compile_filters({"fecha_desde": "ayer"})
+    assert invalid.formula() == "FALSE()"
+    assert not invalid.predicate()({"fechadevolucion": "2024-01-01"})
+    assert filter_ast.compile_filters({"coordinador": []}).formula() == "FALSE()"
+
+
+def test_description_comes_from_tree():
+    print("\n=== TEST: la descripción sale del mismo árbol ===")
+    filters = {
+        "fecha_desde": "2024-01-01", "fecha_hasta": "2024-03-31", "coordinador": "Ana",
+        "municipio": "Honda", "municipio_generador": "Espinal", "municipio_devolucion": "Ibagué",
+        "pre_consecutivo": "C-1",
+    }
+    description = _build_filter_description(filters)
+    print(f"Descripción: {description}")
+    assert description == (
+        "desde 2024-01-01, hasta 2024-03-31, coordinador Ana, municipio Honda, municipio generador Espinal, "
+        "municipio de devolución Ibagué, pre_consecutivo = C-1"
+    )
+    assert _build_filter_description({}) == ""
+
+
+def test_compiled_once_per_query():
+    print("\n=== TEST: cada consulta se compila una sola vez ===")
+    filters = {"coordinador": "Memo", "fecha_desde": "2024-05-01"}
+    first = filter_ast.compile_filters(filters)
+    before = filter_ast._compile_cached.cache_info()
+    second = filter_ast.compile_filters(dict(filters))
+    after = filter_ast._compile_cached.cache_info()
+    assert second is first
+    assert after.hits == before.hits + 1
+    assert first.predicate() is second.predicate()
+
+
+DATE_CONDITION = re.compile(r"IS_(AFTER|BEFORE)\(\{([^}]+)\}, '([^']*)'\)")
+
+
+def airtable_dates(formula, fields):
+    """Evalúa como Airtable una fórmula AND de IS_AFTER / IS_BEFORE (lo que generan las fechas)"""
+    for kind, field, limit in DATE_CONDITION.findall(formula):
+        value = fields.get(field)
+        if not value:
+            return False
+        if kind == "AFTER" and not value > limit or kind == "BEFORE" and not value < limit:
+            return False
+    return True
+
+
+def test_kardex_dates_same_field_remote_and_local():
+    print("\n=== TEST: Kardex filtra fechas por fechakardex en la fórmula y en local ===")
+    records = [
+        {"id": f"rec{i}", "createdTime": "2024-01-01T00:00:00.000Z",
+         "fields": {"idkardex": f"K{i}", "fechakardex": f"2024-{month:02d}-15", "Total": i}}
+        for i, month in enumerate([1, 3, 5, 7, 9, 11, 2, 6])
+    ] + [{"id": "recSinFecha", "createdTime": "2024-01-01T00:00:00.000Z", "fields": {"Total": 1}}]
+    filters = {"fecha_desde": "2024-02-28", "fecha_hasta": "2024-08-01"}
+
+    formula = _build_query_params(filters, [], [], "Kardex")["filterByFormula"]
+    print(f"Fórmula: {formula}")
+    assert "{fechakardex}" in formula and "fechadevolucion" not in formula
+
+    remote = [record["id"] for record in records if airtable_dates(formula, record["fields"])]
+    predicate = filter_ast.compile_filters(filters, "Kardex").predicate()
+    local = [record["id"] for record in records if predicate(record["fields"])]
+    store = record_store.RecordStore("Kardex", records)
+    assert remote == local == ["rec1", "rec2", "rec3", "rec7"]
+    assert [record["id"] for record in run_query(records, filters, table_name="Kardex")] == local
+    assert [store.ids[row] for row in store.filter(filters)] == local
+
+
+if __name__ == "__main__":
+    test_formula_matches_previous_format()
+    test_values_are_escaped()
+    test_in_lists_and_ranges()
+    test_description_comes_from_tree()
+    test_compiled_once_per_query()
+    test_kardex_dates_same_field_remote_and_local()
+    print("\n✅ Pruebas completadas")
@@ -0,0 +1,257 @@
+"""
+Pruebas del motor de consultas local (local_query.py).
+
+Compara, filtro por filtro, los registros de execute_query_from_state
+(fórmula enviada a una Airtable simulada que evalúa filterByFormula) con los
+de execute_query_from_mirror (predicados locales sobre la copia SQLite).
+No requiere conexión.
+"""
+import os
+import re
+import tempfile
+from datetime import datetime
+import airtable_client
+import query_cache
+import table_mirror
+from conversation_state import ConversationState
+from queries import execute_query_from_state, execute_query_from_mirror, format_records_for_display
+
+
+RECORDS = [
+    {"pre_consecutivo": "C-1", "fechadevolucion": "2024-01-10", "nombrecoordinador": "Ana Gómez",
+     "municipiogenerador": "Ibagué", "municipiodevolucion": "Espinal", "total": 12.5},
+    {"pre_consecutivo": "C-2", "fechadevolucion": "2024-01-15", "nombrecoordinador": "Juan Pérez",
+     "municipiogenerador": "Espinal", "municipiodevolucion": "Ibagué", "total": 30},
+    {"pre_consecutivo": "C-3", "fechadevolucion": "2024-02-01T15:30:00.000Z", "nombrecoordinador": "Ana Gómez",
+     "municipiogenerador": "Honda", "municipiodevolucion": "Honda", "total": 8},
+    {"pre_consecutivo": "C-4", "nombrecoordinador": "Juan Pérez", "municipiogenerador": "Ibagué", "total": 1},
+    {"pre_consecutivo": "C-5", "fechadevolucion": "2024-03-20", "nombrecoordinador": ["Ana Gómez"],
+     "municipiogenerador": ["Ibagué", "Honda"], "total": 4},
+    {"pre_consecutivo": "C-6", "fechadevolucion": "2024-01-15", "nombrecoordinador": "Luis Díaz",
+     "municipiogenerador": "Mariquita", "municipiodevolucion": "Ibagué", "total": 0},
+    {"pre_consecutivo": "C-7", "fechadevolucion": "2024-02-20", "nombrecoordinador": "Pat O'Neil",
+     "municipiogenerador": "San Luis \\ Norte", "total": 17},
+]
+
+FILTER_CASES = [
+    {},
+    {"coordinador": "Ana Gómez"},
+    {"municipio": "Ibagué"},
+    {"municipio_generador": "Ibagué"},
+    {"municipio_devolucion": "Honda"},
+    {"fecha_desde": "2024-01-15"},
+    {"fecha_hasta": "2024-01-15"},
+    {"fecha_desde": "2024-01-01", "fecha_hasta": "2024-02-28", "coordinador": "Juan Pérez"},
+    {"municipio_generador": "Ibagué, Honda"},
+    {"pre_consecutivo": "C-3"},
+    {"total": "30"},
+    {"coordinador": "Nadie"},
+    {"coordinador": "Pat O'Neil"},
+    {"municipio": "San Luis \\ Norte"},
+    {"coordinador": ["Ana Gómez", "Luis Díaz"]},
+    {"municipio": ["Honda", "Espinal"], "fecha_desde": "2024-01-01"},
+    {"total_min": 8},
+    {"total_min": 4, "total_max": "12.5", "coordinador": "Ana Gómez"},
+    {"fecha_desde": "no es fecha"},
+]
+
+
+def _text(value):
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return ", ".join(_text(v) for v in value)
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _date(value):
+    text = _text(value[0] if isinstance(value, list) else value)
+    if not text:
+        return None
+    text = text.replace("Z", "")
+    return datetime.fromisoformat(text)
+
+
+class FormulaEvaluator:
+    """Evalúa el subconjunto de fórmulas de Airtable que genera queries.py"""
+
+    TOKEN = re.compile(r"\s*(?:(\{[^}]*\})|('(?:[^'\\]|\\.)*')|([A-Z_]+)|(-?\d+(?:\.\d+)?)|(>=|<=)|(.))")
+
+    def __init__(self, formula):
+        self.tokens = [m.group(0).strip() for m in self.TOKEN.finditer(formula) if m.group(0).strip()]
+        self.pos = 0
+
+    def next(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def parse(self):
+        token = self.next()
+        if token == "FALSE":
+            assert self.next() == "(" and self.next() == ")"
+            return ("FALSE", [])
+        if token in ("AND", "OR", "IS_AFTER", "IS_BEFORE"):
+            assert self.next() == "("
+            args = [self.parse()]
+            while self.tokens[self.pos] == ",":
+                self.pos += 1
+                args.append(self.parse())
+            assert self.next() == ")"
+            return (token, args)
+        if self.pos < len(self.tokens) and self.tokens[self.pos] in ("=", ">=", "<="):
+            operator = self.next()
+            return (operator, [self.atom(token), self.atom(self.next())])
+        return self.atom(token)
+
+    @staticmethod
+    def atom(token):
+        if token.startswith("{"):
+            return ("field", token[1:-1])
+        if token.startswith("'"):
+            return ("str", re.sub(r"\\(.)", r"\1", token[1:-1]))
+        return ("num", float(token))
+
+    def evaluate(self, node, fields):
+        kind, args = node
+        if kind == "field":
+            return fields.get(args)
+        if kind in ("str", "num"):
+            return args
+        if kind == "FALSE":
+            return False
+        if kind == "AND":
+            return all(self.evaluate(a, fields) for a in args)
+        if kind == "OR":
+            return any(self.evaluate(a, fields) for a in args)
+        if kind == "=":
+            return _text(self.evaluate(args[0], fields)) == _text(self.evaluate(args[1], fields))
+        if kind in (">=", "<="):
+            left, right = self.evaluate(args[0], fields) or 0, self.evaluate(args[1], fields)
+            return left >= right if kind == ">=" else left <= right
+        left, right = _date(self.evaluate(args[0], fields)), _date(self.evaluate(args[1], fields))
+        if left is None or right is None:
+            return False
+        return left > right if kind == "IS_AFTER" else left < right
+
+
+class FakeAirtable:
+    """Lista de registros que aplica filterByFormula, fields[] y maxRecords"""
+
+    def __init__(self, rows):
+        self.records = [
+            {"id": f"rec{i:03d}", "createdTime": f"2024-01-01T00:00:{i:02d}.000Z", "fields": fields}
+            for i, fields in enumerate(rows)
+        ]
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        params = params or {}
+        records = self.records
+        formula = params.get("filterByFormula")
+        if formula:
+            evaluator = FormulaEvaluator(formula)
+            tree = evaluator.parse()
+            records = [r for r in records if evaluator.evaluate(tree, r["fields"])]
+        if params.get("maxRecords"):
+            records = records[:int(params["maxRecords"])]
+        if params.get("fields[]"):
+            wanted = params["fields[]"]
+            records = [dict(r, fields={k: v for k, v in r["fields"].items() if k in wanted}) for r in records]
+        return FakeResponse({"records": records})
+
+    def fetch_page(self, table_name, params, offset):
+        return self.records, None
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self._payload = payload
+        self.status_code = 200
+        self.text = str(payload)
+
+    def json(self):
+        return self._payload
+
+
+def make_state(filters, fields=None, limit=None):
+    state = ConversationState(user_id="test_local", conversation_id="test_local_1")
+    state.query["table"] = "Certificados"
+    state.query["filters"] = filters
+    state.query["fields"] = fields or []
+    state.query["limit"] = limit
+    return state
+
+
+def run_both(fake, state):
+    saved = (airtable_client._session, os.environ.get("AIRTABLE_API_KEY"), os.environ.get("AIRTABLE_BASE_ID"),
+             query_cache.CACHE_ENABLED)
+    airtable_client._session = fake
+    os.environ["AIRTABLE_API_KEY"] = "test"
+    os.environ["AIRTABLE_BASE_ID"] = "test"
+    query_cache.CACHE_ENABLED = False
+    try:
+        return execute_query_from_state(state), execute_query_from_mirror(state)
+    finally:
+        airtable_client._session = saved[0]
+        query_cache.CACHE_ENABLED = saved[3]
+        for key, value in zip(("AIRTABLE_API_KEY", "AIRTABLE_BASE_ID"), saved[1:3]):
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def setup_mirror(fake):
+    table_mirror.configure(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'mirror_test.db')}")
+    table_mirror.sync_table("Certificados", fetch_page=fake.fetch_page)
+
+
+def test_local_results_match_formula():
+    print("\n=== TEST: los filtros locales devuelven lo mismo que la fórmula ===")
+    fake = FakeAirtable(RECORDS)
+    setup_mirror(fake)
+    try:
+        for filters in FILTER_CASES:
+            (remote_summary, remote, remote_error), (local_summary, local, local_error) = run_both(fake, make_state(filters))
+            print(f"{filters}: {[r['id'] for r in local]}")
+            assert remote_error is None and local_error is None
+            assert [r["id"] for r in local] == [r["id"] for r in remote], filters
+            assert local == remote
+            assert local_summary == remote_summary
+            for format_type in ("summary", "detailed"):
+                assert format_records_for_display(local, "Certificados", format_type) == \
+                    format_records_for_display(remote, "Certificados", format_type)
+    finally:
+        table_mirror.engine = table_mirror.SessionLocal = None
+
+
+def test_local_fields_and_limit():
+    print("\n=== TEST: fields[] y límite igual que Airtable ===")
+    fake = FakeAirtable(RECORDS)
+    setup_mirror(fake)
+    try:
+        state = make_state({"municipio": "Ibagué"}, fields=["pre_consecutivo", "total"], limit=2)
+        (_, remote, _), (_, local, _) = run_both(fake, state)
+        assert local == remote
+        assert len(local) == 2
+        assert set(local[0]["fields"]) == {"pre_consecutivo", "total"}
+    finally:
+        table_mirror.engine = table_mirror.SessionLocal = None
+
+
+def test_mirror_not_ready():
+    print("\n=== TEST: sin copia local devuelve un error amigable ===")
+    table_mirror.engine = table_mirror.SessionLocal = None
+    summary, records, error = execute_query_from_mirror(make_state({"coordinador": "Ana Gómez"}))
+    print(f"Resumen: {summary}")
+    assert records is None
+    assert "no está lista" in error
+
+
+if __name__ == "__main__":
+    test_local_results_match_formula()
+    test_local_fields_and_limit()
+    test_mirror_not_ready()
+    print("\n✅ Pruebas completadas")
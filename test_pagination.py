@@ -0,0 +1,165 @@
+"""
+Prueba de la paginación de Airtable (iter_record_pages) sin conexión a internet.
+Reemplaza la sesión compartida de airtable_client por una API simulada
+con páginas de 100 registros y cursor `offset`.
+"""
+import os
+import asyncio
+import httpx
+import airtable_client
+from conversation_state import ConversationState
+from airtable_client import iter_record_pages, iter_records
+from queries import execute_query_from_state, execute_query_from_state_async
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self._payload = payload
+        self.status_code = status_code
+        self.text = str(payload)
+
+    def json(self):
+        return self._payload
+
+
+class FakeAirtable:
+    """Sirve `total` registros en páginas, respetando pageSize, maxRecords y offset"""
+
+    def __init__(self, total):
+        self.records = [
+            {"id": f"rec{i:05d}", "createdTime": "2024-01-01T00:00:00.000Z",
+             "fields": {"pre_consecutivo": f"C-{i}", "total": 1}}
+            for i in range(total)
+        ]
+        self.calls = 0
+
+    def page(self, params):
+        self.calls += 1
+        start = int(params.get("offset", 0))
+        page_size = int(params.get("pageSize", 100))
+        end_limit = int(params.get("maxRecords") or len(self.records))
+        end = min(start + page_size, end_limit, len(self.records))
+        payload = {"records": self.records[start:end]}
+        if end < min(end_limit, len(self.records)):
+            payload["offset"] = str(end)
+        return payload
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        return FakeResponse(self.page(params or {}))
+
+    def async_client(self):
+        """Cliente httpx asíncrono que responde con las mismas páginas"""
+        def handler(request):
+            return httpx.Response(200, json=self.page(dict(request.url.params)))
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def set_test_env():
+    saved_env = {k: os.environ.get(k) for k in ("AIRTABLE_API_KEY", "AIRTABLE_BASE_ID")}
+    os.environ["AIRTABLE_API_KEY"] = "test"
+    os.environ["AIRTABLE_BASE_ID"] = "test"
+    return saved_env
+
+
+def restore_env(saved_env):
+    for key, value in saved_env.items():
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+
+
+def test_iter_pages_follows_offset():
+    print("\n=== TEST: iter_record_pages sigue el cursor offset ===")
+    fake = FakeAirtable(250)
+    airtable_client._session, original = fake, airtable_client._session
+    try:
+        pages = list(iter_record_pages("base", "key", "Certificados"))
+    finally:
+        airtable_client._session = original
+
+    print(f"Páginas: {[len(p) for p in pages]} - llamadas: {fake.calls}")
+    assert [len(p) for p in pages] == [100, 100, 50]
+    assert fake.calls == 3
+
+
+def test_iter_records_stop_early():
+    print("\n=== TEST: detener la iteración no pide más páginas ===")
+    fake = FakeAirtable(1000)
+    airtable_client._session, original = fake, airtable_client._session
+    try:
+        for i, record in enumerate(iter_records("base", "key", "Certificados")):
+            if i == 150:
+                break
+    finally:
+        airtable_client._session = original
+
+    print(f"Llamadas a la API: {fake.calls}")
+    assert fake.calls == 2
+
+
+def test_execute_query_collects_all_pages():
+    print("\n=== TEST: execute_query_from_state junta todas las páginas ===")
+    fake = FakeAirtable(320)
+    airtable_client._session, original = fake, airtable_client._session
+    saved_env = set_test_env()
+    try:
+        state = ConversationState(user_id="test_pagination", conversation_id="test_pagination_1")
+        state.query["table"] = "Certificados"
+        state.query["limit"] = 300
+        summary, records, error = execute_query_from_state(state)
+    finally:
+        airtable_client._session = original
+        restore_env(saved_env)
+
+    print(f"Resumen: {summary}")
+    assert error is None
+    assert len(records) == 300
+
+
+def test_execute_query_default_limit_spans_pages():
+    print("\n=== TEST: con el límite por defecto se piden todas las páginas ===")
+    fake = FakeAirtable(250)
+    airtable_client._session, original = fake, airtable_client._session
+    saved_env = set_test_env()
+    try:
+        state = ConversationState(user_id="test_pagination", conversation_id="test_pagination_3")
+        state.query["table"] = "Certificados"
+        summary, records, error = execute_query_from_state(state)
+    finally:
+        airtable_client._session = original
+        restore_env(saved_env)
+
+    print(f"Resumen: {summary} - llamadas: {fake.calls}")
+    assert error is None
+    assert len(records) == 250
+    assert fake.calls == 3
+
+
+def test_execute_query_async():
+    print("\n=== TEST: execute_query_from_state_async con cliente asíncrono ===")
+    fake = FakeAirtable(180)
+    airtable_client._async_client, original = fake.async_client(), airtable_client._async_client
+    saved_env = set_test_env()
+    try:
+        state = ConversationState(user_id="test_pagination", conversation_id="test_pagination_2")
+        state.query["table"] = "Kardex"
+        state.query["limit"] = 500
+        summary, records, error = asyncio.run(execute_query_from_state_async(state))
+    finally:
+        airtable_client._async_client = original
+        restore_env(saved_env)
+
+    print(f"Resumen: {summary}")
+    assert error is None
+    assert len(records) == 180
+    assert fake.calls == 2
+
+
+if __name__ == "__main__":
+    test_iter_pages_follows_offset()
+    test_iter_records_stop_early()
+    test_execute_query_collects_all_pages()
+    test_execute_query_default_limit_spans_pages()
+    test_execute_query_async()
+    print("\n✅ Pruebas completadas")
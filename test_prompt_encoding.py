@@ -0,0 +1,88 @@
+"""
+Pruebas de la codificación compacta para el prompt (prompt_encoding.py).
+
+Verifica que la tabla ocupa mucho menos que el JSON indentado, que no se
+pierde ningún valor y que el presupuesto de tokens se respeta de forma
+determinista.
+"""
+import json
+import random
+import prompt_encoding
+from table_snapshot import reshape_records, field_defaults
+from test_record_store import random_certificados, make_records
+
+
+def parse(text):
+    """Lee la tabla codificada: (constantes, filas como diccionarios)"""
+    lines = text.splitlines()
+    constants = dict(part.split(": ", 1) for part in lines[0].split(", ") if ": " in part)
+    columns = lines[1].split("|")
+    rows = [dict(zip(columns, line.split("|"))) for line in lines[2:] if not line.startswith("(")]
+    return constants, rows
+
+
+def certificados(count, seed=7):
+    rows = random_certificados(count, seed)
+    rng = random.Random(seed)
+    for row in rows:
+        if rng.random() < 0.3:
+            del row["municipiodevolucion"]
+        if rng.random() < 0.3:
+            row["rigidos"] = 0
+    return reshape_records("Certificados", make_records(rows))
+
+
+def test_compact_table_is_smaller_than_json():
+    print("\n=== TEST: la tabla usa una fracción de los tokens del JSON indentado ===")
+    rows = certificados(100)
+    encoded = prompt_encoding.encode_table(rows, field_defaults("Certificados"), budget=100000)
+    json_tokens = prompt_encoding.count_tokens(json.dumps(rows, indent=2, ensure_ascii=False))
+    print(f"JSON: {json_tokens} tokens, tabla: {encoded.tokens} tokens")
+    print("\n".join(encoded.text.splitlines()[:4]))
+    assert encoded.tokens * 2.5 < json_tokens
+    assert encoded.rows_included == encoded.rows_total == 100 and encoded.strategy is None
+
+
+def test_no_values_are_lost():
+    print("\n=== TEST: todos los valores distintos del valor por defecto se conservan ===")
+    rows = certificados(40)
+    rows[3]["observaciones"] = "Entrega | parcial\nsegunda línea"
+    defaults = field_defaults("Certificados")
+    constants, parsed = parse(prompt_encoding.encode_table(rows, defaults, budget=100000).text)
+    assert constants == {"tabla": "Certificados"}
+    assert len(parsed) == len(rows)
+    for row, line in zip(rows, parsed):
+        for key, value in row.items():
+            if key in constants:
+                continue
+            expected = "" if value in (None, "", defaults.get(key)) else prompt_encoding.cell(value)
+            assert line.get(key, "") == expected, (key, value)
+    assert parsed[3]["observaciones"] == "Entrega / parcial segunda línea"
+
+
+def test_budget_is_enforced_deterministically():
+    print("\n=== TEST: el presupuesto se respeta con muestra uniforme o cortando ===")
+    rows = certificados(200)
+    defaults = field_defaults("Certificados")
+    sampled = prompt_encoding.encode_table(rows, defaults, budget=800, strategy="sample")
+    print(f"Muestra: {sampled.metadata()}")
+    assert sampled.tokens <= 800 and 0 < sampled.rows_included < 200
+    assert sampled.text == prompt_encoding.encode_table(rows, defaults, budget=800, strategy="sample").text
+    assert sampled.text.endswith(f"(se muestran {sampled.rows_included} de 200 registros: muestra uniforme)")
+
+    # La muestra cubre todo el rango: aparecen la primera fila y alguna de la segunda mitad
+    _, parsed = parse(sampled.text)
+    consecutivos = [int(row["pre_consecutivo"][2:]) for row in parsed]
+    assert consecutivos[0] == 0 and max(consecutivos) >= 100
+
+    truncated = prompt_encoding.encode_table(rows, defaults, budget=800, strategy="truncate")
+    _, parsed = parse(truncated.text)
+    assert truncated.tokens <= 800
+    assert [int(row["pre_consecutivo"][2:]) for row in parsed] == list(range(truncated.rows_included))
+
+
+if __name__ == "__main__":
+    test_compact_table_is_smaller_than_json()
+    test_no_values_are_lost()
+    test_budget_is_enforced_deterministically()
+    print("\n✅ Pruebas completadas")
@@ -0,0 +1,86 @@
+"""
+Pruebas del armado de prompts con prefijo fijo (prompts.py) sin conexión.
+
+Verifica que la parte fija de la entrada es idéntica en todos los turnos y
+va antes de los datos del turno, que los segmentos no se leen de disco en
+cada petición y que se acumulan los tokens servidos desde la caché.
+"""
+import builtins
+from types import SimpleNamespace
+import prompts
+from agent_with_context import _build_agent_input
+from conversation_state import ConversationState
+
+
+def fake_response(input_tokens, cached_tokens, output_tokens=50):
+    return SimpleNamespace(
+        output_text="ok",
+        usage=SimpleNamespace(
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            input_tokens_details=SimpleNamespace(cached_tokens=cached_tokens)
+        )
+    )
+
+
+def test_static_prefix_comes_first():
+    print("\n=== TEST: el system message es idéntico en todos los turnos y los datos van al final ===")
+    first = ConversationState(user_id="u1", conversation_id="c1")
+    second = ConversationState(user_id="u2", conversation_id="c2")
+    second.add_message("user", "certificados de Ana")
+    second.add_message("agent", "¿De qué periodo?")
+    second.query["table"] = "Certificados"
+
+    a = _build_agent_input("¿Cuánto recolectó Ana?", first, 10, 20)
+    b = _build_agent_input("enero de 2024", second, 11, 20)
+    assert a[0] == b[0] == {"role": "system", "content": prompts.AGENT_SYSTEM_PROMPT}
+    assert prompts.BUSINESS_CONTEXT and prompts.BUSINESS_CONTEXT.strip() in a[0]["content"]
+    assert prompts.RESPONSE_INSTRUCTIONS in a[0]["content"]
+
+    # Lo volátil no aparece en el prefijo y la pregunta es lo último
+    assert "STATE JSON" not in a[0]["content"]
+    assert b[1]["content"].startswith("=== DATOS DISPONIBLES ===")
+    assert b[1]["content"].rstrip().endswith("enero de 2024")
+
+    legacy = prompts.legacy_prompt("=== DATOS ===", "¿Quién recolectó más?")
+    assert legacy.startswith(prompts.LEGACY_PREFIX)
+    assert legacy.endswith("El Director de Campolimpio pregunta: ¿Quién recolectó más?")
+
+
+def test_segments_are_not_read_per_request():
+    print("\n=== TEST: armar el prompt no abre archivos ===")
+    state = ConversationState(user_id="u1", conversation_id="c1")
+
+    def no_open(*args, **kwargs):
+        raise AssertionError(f"se abrió un archivo: {args[0]}")
+
+    builtins.open, original = no_open, builtins.open
+    try:
+        messages = _build_agent_input("hola", state, 1, 1)
+    finally:
+        builtins.open = original
+    assert messages[0]["content"] == prompts.AGENT_SYSTEM_PROMPT
+
+
+def test_cached_tokens_are_recorded():
+    print("\n=== TEST: se acumulan los tokens servidos desde la caché de prefijo ===")
+    before = prompts.get_metrics()
+    assert prompts.record_usage(fake_response(3000, 2048)) == {
+        "input_tokens": 3000, "cached_tokens": 2048, "output_tokens": 50
+    }
+    prompts.record_usage(fake_response(1000, 0))
+    # Respuestas sin `usage` (p. ej. dobles de prueba) cuentan como cero
+    prompts.record_usage(SimpleNamespace(output_text="ok"))
+    after = prompts.get_metrics()
+    print(after)
+    assert after["responses"] - before["responses"] == 3
+    assert after["input_tokens"] - before["input_tokens"] == 4000
+    assert after["cached_tokens"] - before["cached_tokens"] == 2048
+    assert 0 < after["cached_ratio"] <= 1 and after["prefix_tokens"]["agent"] > 1024
+
+
+if __name__ == "__main__":
+    test_static_prefix_comes_first()
+    test_segments_are_not_read_per_request()
+    test_cached_tokens_are_recorded()
+    print("\n✅ Pruebas completadas")
@@ -0,0 +1,168 @@
+"""
+Pruebas de la caché de resultados (query_cache.py) sin conexión.
+Reemplaza la sesión compartida de airtable_client por una API simulada.
+"""
+import os
+import tempfile
+import airtable_client
+import query_cache
+import table_mirror
+from conversation_state import ConversationState
+from queries import execute_query_from_state
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self._payload = payload
+        self.status_code = status_code
+        self.text = str(payload)
+
+    def json(self):
+        return self._payload
+
+
+class CountingSession:
+    """Devuelve siempre los mismos `count` registros y cuenta las llamadas"""
+
+    def __init__(self, count=3):
+        self.count = count
+        self.calls = 0
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        self.calls += 1
+        records = [{"id": f"rec{i}", "fields": {"pre_consecutivo": f"C-{i}", "total": i}} for i in range(self.count)]
+        return FakeResponse({"records": records})
+
+
+def make_state(filters):
+    state = ConversationState(user_id="test_cache", conversation_id="test_cache_1")
+    state.query["table"] = "Certificados"
+    state.query["filters"] = filters
+    return state
+
+
+def run_queries(session, *states):
+    saved = (airtable_client._session, os.environ.get("AIRTABLE_API_KEY"), os.environ.get("AIRTABLE_BASE_ID"))
+    airtable_client._session = session
+    os.environ["AIRTABLE_API_KEY"] = "test"
+    os.environ["AIRTABLE_BASE_ID"] = "test"
+    try:
+        return [execute_query_from_state(state) for state in states]
+    finally:
+        airtable_client._session = saved[0]
+        for key, value in zip(("AIRTABLE_API_KEY", "AIRTABLE_BASE_ID"), saved[1:]):
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def test_key_is_canonical():
+    print("\n=== TEST: la clave no depende del orden de filtros ni de campos ===")
+    a = {"table": "Kardex", "filters": {"coordinador": "Ana", "fecha_desde": "2024-01-01"},
+         "fields": ["Total", "idkardex"], "sort": [], "limit": None, "validated": True}
+    b = {"table": "Kardex", "filters": {"fecha_desde": "2024-01-01", "coordinador": "Ana"},
+         "fields": ["idkardex", "Total"], "sort": [], "limit": None, "validated": False}
+    assert query_cache.make_key(a) == query_cache.make_key(b)
+    assert query_cache.make_key(a) != query_cache.make_key(dict(a, limit=10))
+
+
+def test_repeated_query_skips_airtable():
+    print("\n=== TEST: una consulta repetida no llama a Airtable ===")
+    query_cache.clear()
+    table_mirror.engine = table_mirror.SessionLocal = None
+    session = CountingSession()
+    before = query_cache.get_metrics()
+    first, second = run_queries(
+        session,
+        make_state({"coordinador": "Juan", "municipio": "Ibagué"}),
+        make_state({"municipio": "Ibagué", "coordinador": "Juan"})
+    )
+    metrics = query_cache.get_metrics()
+    print(f"Métricas: {metrics}")
+    assert session.calls == 1
+    assert first == second
+    assert metrics["hits"] - before["hits"] == 1
+    assert metrics["misses"] - before["misses"] == 1
+
+
+def test_data_version_change_invalidates():
+    print("\n=== TEST: solo una sincronización que cambia registros invalida la caché ===")
+    query_cache.clear()
+    table_mirror.configure(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'mirror_test.db')}")
+    try:
+        page = [{"id": "rec1", "createdTime": "2024-01-01T00:00:00.000Z", "fields": {"total": 1}}]
+        table_mirror.sync_table("Certificados", fetch_page=lambda table_name, params, offset: (page, None))
+
+        session = CountingSession()
+        run_queries(session, make_state({"coordinador": "Juan"}), make_state({"coordinador": "Juan"}))
+        assert session.calls == 1
+
+        # Sincronización sin cambios: la marca de agua avanza pero la versión no
+        table_mirror.sync_table("Certificados", fetch_page=lambda table_name, params, offset: ([], None))
+        run_queries(session, make_state({"coordinador": "Juan"}))
+        assert session.calls == 1
+
+        # Sincronización que modifica un registro: sube la versión
+        changed = [{"id": "rec1", "createdTime": "2024-01-01T00:00:00.000Z", "fields": {"total": 2}}]
+        result = table_mirror.sync_table("Certificados", fetch_page=lambda table_name, params, offset: (changed, None))
+        assert result["changed"] == 1
+        run_queries(session, make_state({"coordinador": "Juan"}))
+        assert session.calls == 2
+    finally:
+        table_mirror.engine = table_mirror.SessionLocal = None
+
+
+def test_cached_records_are_copies():
+    print("\n=== TEST: modificar los registros devueltos no cambia la entrada guardada ===")
+    query_cache.clear()
+    records = [{"id": "rec1", "fields": {"total": 1}}]
+    query_cache.put("k", "Certificados", "resumen", records)
+    records[0]["fields"]["total"] = 99
+
+    _, first = query_cache.get("k", "Certificados")
+    first[0]["fields"]["total"] = 50
+    _, second = query_cache.get("k", "Certificados")
+    assert second[0]["fields"]["total"] == 1
+    query_cache.clear()
+
+
+def test_lru_eviction_respects_memory_cap():
+    print("\n=== TEST: se descartan las entradas menos usadas al pasar el límite ===")
+    query_cache.clear()
+    saved_max, query_cache.CACHE_MAX_BYTES = query_cache.CACHE_MAX_BYTES, 600
+    try:
+        records = [{"id": f"rec{i}", "fields": {"total": i}} for i in range(6)]
+        for key in ("a", "b", "c"):
+            query_cache.put(key, "Certificados", "resumen", records)
+            query_cache.get("a", "Certificados")  # "a" siempre es la más reciente
+
+        metrics = query_cache.get_metrics()
+        print(f"Métricas: {metrics}")
+        assert metrics["bytes"] <= 600
+        assert query_cache.get("a", "Certificados") is not None
+        assert query_cache.get("b", "Certificados") is None
+    finally:
+        query_cache.CACHE_MAX_BYTES = saved_max
+        query_cache.clear()
+
+
+def test_expired_entry_is_a_miss():
+    print("\n=== TEST: una entrada vencida no se usa ===")
+    query_cache.clear()
+    saved_ttl, query_cache.CACHE_TTL = query_cache.CACHE_TTL, -1
+    try:
+        query_cache.put("k", "Kardex", "resumen", [])
+        assert query_cache.get("k", "Kardex") is None
+    finally:
+        query_cache.CACHE_TTL = saved_ttl
+
+
+if __name__ == "__main__":
+    test_key_is_canonical()
+    test_repeated_query_skips_airtable()
+    test_data_version_change_invalidates()
+    test_cached_records_are_copies()
+    test_lru_eviction_respects_memory_cap()
+    test_expired_entry_is_a_miss()
+    print("\n✅ Pruebas completadas")
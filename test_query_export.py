@@ -0,0 +1,136 @@
+"""
+Pruebas de la exportación en streaming (query_export.py) sin conexión.
+
+Verifica que CSV y NDJSON contienen los mismos registros que la consulta,
+que se envía un bloque por página y que la copia local se lee por lotes.
+"""
+import io
+import os
+import csv
+import json
+import asyncio
+import query_export
+from conversation_state import ConversationState
+from local_query import run_query
+from test_rollups import CERTIFICADOS, make_records
+from test_query_planner import setup_mirror, teardown_mirror
+
+
+def make_state(filters=None, **query):
+    state = ConversationState("user_export", "conv_export")
+    state.query.update(table="Certificados", filters=filters or {}, **query)
+    return state
+
+
+def export(state, export_format, max_staleness=None):
+    async def collect():
+        pages, error = await query_export.aopen_export(state, max_staleness)
+        assert error is None, error
+        return [chunk async for chunk in query_export.aencode_pages(pages, export_format, state.query.get("fields"))]
+    return asyncio.run(collect())
+
+
+class AirtableEnv:
+    """Define credenciales de prueba mientras dura el bloque"""
+
+    def __enter__(self):
+        self.saved = {name: os.environ.get(name) for name in ("AIRTABLE_API_KEY", "AIRTABLE_BASE_ID")}
+        os.environ.update(AIRTABLE_API_KEY="key_test", AIRTABLE_BASE_ID="app_test")
+
+    def __exit__(self, *exc):
+        for name, value in self.saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+class FakePages:
+    """Sustituye aiter_record_pages: entrega las páginas dadas y guarda los parámetros"""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def __call__(self, base_id, api_key, table_name, params=None, max_records=None):
+        self.calls.append((table_name, params, max_records))
+
+        async def pages():
+            for page in self.pages:
+                yield page
+        return pages()
+
+
+def test_csv_from_local_mirror_in_batches():
+    print("\n=== TEST: CSV desde la copia local, por lotes ===")
+    records = make_records(CERTIFICADOS * 3)
+    setup_mirror(records)
+    query_export.EXPORT_BATCH_SIZE, original = 4, query_export.EXPORT_BATCH_SIZE
+    try:
+        state = make_state({"coordinador": "Juan Pérez"}, fields=["nombrecoordinador", "total"])
+        chunks = export(state, "csv", 600)
+        print("".join(chunks))
+        expected = run_query(records, state.query["filters"])
+        assert len(chunks) == 2
+
+        rows = list(csv.reader(io.StringIO("".join(chunks))))
+        assert rows[0] == ["id", "createdTime", "nombrecoordinador", "total"]
+        assert [row[0] for row in rows[1:]] == [record["id"] for record in expected]
+        # Los lookups (listas) se unen con ", "
+        assert rows[2][2] == "Juan Pérez"
+    finally:
+        query_export.EXPORT_BATCH_SIZE = original
+        teardown_mirror()
+
+
+def test_ndjson_streams_remote_pages():
+    print("\n=== TEST: NDJSON con un bloque por página de Airtable ===")
+    pages = [make_records(CERTIFICADOS[:2]), make_records(CERTIFICADOS[2:], "pag")]
+    fake = FakePages(pages)
+    query_export.aiter_record_pages, original = fake, query_export.aiter_record_pages
+    try:
+        state = make_state({"coordinador": "Ana Gómez"}, limit=50)
+        with AirtableEnv():
+            chunks = export(state, "ndjson", 0)
+        assert len(chunks) == 2
+        lines = [json.loads(line) for line in "".join(chunks).splitlines()]
+        assert [line["id"] for line in lines] == [record["id"] for page in pages for record in page]
+        assert lines[0]["fields"]["nombrecoordinador"] == "Ana Gómez"
+
+        table_name, params, max_records = fake.calls[0]
+        assert table_name == "Certificados" and max_records == 50
+        assert params["filterByFormula"] == "{nombrecoordinador}='Ana Gómez'"
+    finally:
+        query_export.aiter_record_pages = original
+
+
+def test_csv_columns_from_first_page():
+    print("\n=== TEST: sin fields, las columnas salen de la primera página ===")
+    fake = FakePages([make_records(CERTIFICADOS)])
+    query_export.aiter_record_pages, original = fake, query_export.aiter_record_pages
+    try:
+        with AirtableEnv():
+            rows = list(csv.reader(io.StringIO("".join(export(make_state(), "csv", 0)))))
+            fake.pages = []
+            empty = export(make_state(fields=["total"]), "csv", 0)
+        assert rows[0][:5] == ["id", "createdTime", "fechadevolucion", "nombrecoordinador", "municipiogenerador"]
+        assert "metalicos" in rows[0] and len(rows) == len(CERTIFICADOS) + 1
+        assert empty == ["id,createdTime,total\r\n"]
+    finally:
+        query_export.aiter_record_pages = original
+
+
+def test_export_without_table_is_an_error():
+    print("\n=== TEST: una conversación sin tabla no se puede exportar ===")
+    state = ConversationState("user_export", "conv_vacia")
+    pages, error = asyncio.run(query_export.aopen_export(state))
+    assert pages is None and "table" in error
+    assert query_export.export_filename(make_state(), "csv") == "Certificados_conv_export.csv"
+
+
+if __name__ == "__main__":
+    test_csv_from_local_mirror_in_batches()
+    test_ndjson_streams_remote_pages()
+    test_csv_columns_from_first_page()
+    test_export_without_table_is_an_error()
+    print("\n✅ Pruebas completadas")
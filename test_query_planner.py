@@ -0,0 +1,162 @@
+"""
+Pruebas del planificador de consultas (query_planner.py) sin conexión.
+
+Verifica la elección del plan según la tolerancia y la frescura de la copia
+local, que los tres planes dan los mismos totales y que el plan ejecutado
+queda en state.execution.
+"""
+import os
+import asyncio
+import tempfile
+import record_store
+import table_mirror
+import query_planner
+from aggregations import Columns, aggregate
+from conversation_state import ConversationState
+from local_query import run_query
+from test_rollups import CERTIFICADOS, make_records
+
+
+FRESH = {"ready": True, "age_seconds": 30.0}
+
+
+def make_state(filters=None, group_by=None, **query):
+    state = ConversationState("user_planner")
+    state.query.update(table="Certificados", filters=filters or {}, group_by=group_by, **query)
+    return state
+
+
+def setup_mirror(records):
+    record_store.invalidate()
+    table_mirror.configure(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'mirror_test.db')}")
+    table_mirror.sync_table("Certificados", fetch_page=lambda table_name, params, offset: (records, None))
+
+
+def teardown_mirror():
+    table_mirror.engine = table_mirror.SessionLocal = None
+    record_store.invalidate()
+
+
+def fake_remote(records, calls):
+    def execute(state):
+        calls.append(state.query)
+        return ("remoto", run_query(records, state.query.get("filters", {})), None)
+    return execute
+
+
+def test_choose_plan():
+    print("\n=== TEST: el plan depende de la tolerancia, la frescura y la consulta ===")
+    grouped = {"table": "Certificados", "filters": {"coordinador": "Ana Gómez"}, "group_by": "mes"}
+    plain = {"table": "Certificados", "filters": {"coordinador": "Ana Gómez"}}
+    dated = dict(grouped, filters={"fecha_desde": "2024-01-01"})
+
+    assert query_planner.choose_plan(grouped, FRESH, 600)["source"] == "rollup"
+    assert query_planner.choose_plan(plain, FRESH, 600)["source"] == "local"
+    assert query_planner.choose_plan(dated, FRESH, 600)["source"] == "local"
+    assert query_planner.choose_plan(dict(grouped, limit=5), FRESH, 600)["source"] == "local"
+    assert query_planner.choose_plan(dict(grouped, group_by="municipio_devolucion"), FRESH, 600)["source"] == "local"
+
+    assert query_planner.choose_plan(grouped, FRESH, 0)["source"] == "remote"
+    assert query_planner.choose_plan(grouped, FRESH, 10)["source"] == "remote"
+    assert query_planner.choose_plan(grouped, {"ready": False, "age_seconds": None}, 600)["source"] == "remote"
+    plan = query_planner.choose_plan(plain, FRESH, 600)
+    print(f"Plan: {plan}")
+    assert plan["mirror_age_seconds"] == 30.0 and plan["max_staleness"] == 600
+
+    assert query_planner.rollup_where("Certificados", {"coordinador": "Ana", "municipio_generador": ""}) == \
+        {"coordinador": "Ana", "municipio": "(sin dato)"}
+    assert query_planner.rollup_where("Certificados", {"coordinador": ["Ana", "Juan"]}) is None
+    assert query_planner.rollup_where("Certificados", {"municipio": "Honda"}) is None
+
+
+def test_plans_give_same_totals():
+    print("\n=== TEST: consolidados, copia local y Airtable dan los mismos totales ===")
+    records = make_records(CERTIFICADOS)
+    calls = []
+    setup_mirror(records)
+    query_planner.execute_query_from_state, original = fake_remote(records, calls), query_planner.execute_query_from_state
+    try:
+        for filters, group_by in [({}, "coordinador"), ({"coordinador": "Ana Gómez"}, "mes"),
+                                  ({"fecha_desde": "2024-01-15"}, "municipio")]:
+            expected = aggregate(Columns("Certificados", run_query(records, filters)), group_by)
+            for max_staleness in (600, 0):
+                state = make_state(filters, group_by)
+                summary, rows, error = query_planner.execute_planned_query(state, max_staleness)
+                print(f"{filters} por {group_by} ({state.execution['plan']['source']}):\n{summary}")
+                assert error is None
+                assert rows == expected, (filters, group_by, max_staleness)
+                assert state.execution["plan"]["elapsed_ms"] >= 0
+        assert len(calls) == 3
+    finally:
+        query_planner.execute_query_from_state = original
+        teardown_mirror()
+
+
+def test_records_from_local_mirror():
+    print("\n=== TEST: sin group_by la copia local devuelve los registros ===")
+    records = make_records(CERTIFICADOS)
+    setup_mirror(records)
+    try:
+        state = make_state({"coordinador": "Ana Gómez"})
+        summary, rows, error = query_planner.execute_planned_query(state, 600)
+        assert state.execution["plan"]["source"] == "local"
+        assert [row["id"] for row in rows] == [records[0]["id"], records[1]["id"]]
+    finally:
+        teardown_mirror()
+
+
+def test_failed_local_plan_falls_back_to_remote():
+    print("\n=== TEST: si falla el plan local se consulta Airtable ===")
+    records = make_records(CERTIFICADOS)
+    calls = []
+    setup_mirror(records)
+    query_planner.execute_query_from_state, original = fake_remote(records, calls), query_planner.execute_query_from_state
+    query_planner.execute_query_from_mirror, original_mirror = (
+        lambda state: ("falló", None, "disco lleno"), query_planner.execute_query_from_mirror)
+    try:
+        state = make_state({"coordinador": "Ana Gómez"})
+        summary, rows, error = query_planner.execute_planned_query(state, 600)
+        plan = state.execution["plan"]
+        print(f"Plan: {plan}")
+        assert error is None and len(rows) == 2 and len(calls) == 1
+        assert plan["source"] == "remote" and plan["fallback"] == "local: disco lleno"
+    finally:
+        query_planner.execute_query_from_state = original
+        query_planner.execute_query_from_mirror = original_mirror
+        teardown_mirror()
+
+
+def test_async_plan_and_invalid_group_by():
+    print("\n=== TEST: versión asíncrona y agrupación no válida ===")
+    records = make_records(CERTIFICADOS)
+    calls = []
+    setup_mirror(records)
+
+    async def fake_remote_async(state):
+        return fake_remote(records, calls)(state)
+
+    query_planner.execute_query_from_state_async, original = fake_remote_async, query_planner.execute_query_from_state_async
+    try:
+        state = make_state({}, "coordinador")
+        summary, rows, error = asyncio.run(query_planner.execute_planned_query_async(state, 600))
+        assert state.execution["plan"]["source"] == "rollup" and not calls
+
+        state = make_state({}, "coordinador")
+        summary, rows, error = asyncio.run(query_planner.execute_planned_query_async(state, "0"))
+        assert state.execution["plan"]["source"] == "remote" and len(calls) == 1
+        assert rows == aggregate(Columns("Certificados", records), "coordinador")
+
+        summary, rows, error = query_planner.execute_planned_query(make_state({}, "gestor"), 600)
+        assert rows is None and "group_by" in error
+    finally:
+        query_planner.execute_query_from_state_async = original
+        teardown_mirror()
+
+
+if __name__ == "__main__":
+    test_choose_plan()
+    test_plans_give_same_totals()
+    test_records_from_local_mirror()
+    test_failed_local_plan_falls_back_to_remote()
+    test_async_plan_and_invalid_group_by()
+    print("\n✅ Pruebas completadas")
@@ -0,0 +1,97 @@
+"""
+Pruebas del limitador de Airtable (rate_limit.py) y del reintento ante 429.
+No requieren conexión: usan una sesión simulada.
+"""
+import time
+import airtable_client
+import rate_limit
+from rate_limit import TokenBucket, backoff_delay
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None, headers=None):
+        self.status_code = status_code
+        self._payload = payload or {}
+        self.headers = headers or {}
+        self.text = str(self._payload)
+    
+    def json(self):
+        return self._payload
+
+
+class FlakySession:
+    """Responde 429 las primeras `failures` veces y luego 200"""
+    
+    def __init__(self, failures, retry_after="0"):
+        self.failures = failures
+        self.retry_after = retry_after
+        self.calls = 0
+    
+    def get(self, url, params=None, headers=None, timeout=None):
+        self.calls += 1
+        if self.calls <= self.failures:
+            return FakeResponse(429, {"error": {"message": "rate limited"}}, {"Retry-After": self.retry_after})
+        return FakeResponse(200, {"records": [{"id": "rec1", "fields": {}}]})
+
+
+def test_bucket_spaces_out_bursts():
+    print("\n=== TEST: el token bucket encola las ráfagas ===")
+    bucket = TokenBucket(rate=20, capacity=2)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    elapsed = time.monotonic() - start
+    metrics = bucket.metrics()
+    
+    print(f"6 llamadas en {elapsed:.2f}s - métricas: {metrics}")
+    # 2 inmediatas + 4 a 20 req/s => al menos ~0.2s
+    assert elapsed >= 0.18
+    assert metrics["waited_requests"] == 4
+    assert metrics["queue_depth"] == 0
+
+
+def test_backoff_honours_retry_after():
+    print("\n=== TEST: backoff respeta Retry-After ===")
+    assert backoff_delay(0, "2") >= 2
+    assert backoff_delay(3) <= rate_limit.BACKOFF_BASE * 8
+    assert backoff_delay(20) <= rate_limit.BACKOFF_MAX
+
+
+def test_get_retries_429():
+    print("\n=== TEST: get() reintenta las respuestas 429 ===")
+    session = FlakySession(failures=2)
+    airtable_client._session, original = session, airtable_client._session
+    try:
+        response = airtable_client.get("appRetryTest", "key", "Certificados")
+    finally:
+        airtable_client._session = original
+    
+    metrics = rate_limit.get_metrics()["appRetryTest"]
+    print(f"Código final: {response.status_code} - llamadas: {session.calls} - métricas: {metrics}")
+    assert response.status_code == 200
+    assert session.calls == 3
+    assert metrics["throttled_429"] == 2
+
+
+def test_get_gives_up_after_max_retries():
+    print("\n=== TEST: get() devuelve el 429 tras agotar los reintentos ===")
+    session = FlakySession(failures=100)
+    airtable_client._session, original = session, airtable_client._session
+    saved_retries, rate_limit.MAX_RETRIES = rate_limit.MAX_RETRIES, 1
+    try:
+        response = airtable_client.get("appGiveUpTest", "key", "Kardex")
+    finally:
+        airtable_client._session = original
+        rate_limit.MAX_RETRIES = saved_retries
+    
+    print(f"Código final: {response.status_code} - llamadas: {session.calls}")
+    assert response.status_code == 429
+    assert session.calls == 2
+
+
+if __name__ == "__main__":
+    test_bucket_spaces_out_bursts()
+    test_backoff_honours_retry_after()
+    test_get_retries_429()
+    test_get_gives_up_after_max_retries()
+    print("\n✅ Pruebas completadas")
@@ -0,0 +1,160 @@
+"""
+Pruebas del formato de registros con plantillas (record_format.py).
+
+Compara el texto de las plantillas con la implementación anterior de
+format_records_for_display y verifica que las ventanas no recorren más
+registros de los necesarios.
+"""
+import json
+import random
+import record_format
+from typing import Dict, List, Any
+from queries import format_records_for_display
+
+
+def legacy_format(
+    records: List[Dict[str, Any]],
+    table_name: str,
+    format_type: str = "summary"
+) -> str:
+    """Implementación anterior de queries.format_records_for_display, como referencia"""
+    if not records:
+        return "No hay registros para mostrar."
+
+    if format_type == "json":
+        return json.dumps(records, indent=2, ensure_ascii=False)
+
+    # Formato de resumen o detallado
+    output_lines = []
+
+    if table_name == "Certificados":
+        for i, record in enumerate(records, 1):
+            fields = record.get("fields", {})
+            if format_type == "summary":
+                output_lines.append(
+                    f"{i}. {fields.get('pre_consecutivo', 'N/A')} - "
+                    f"Coordinador: {fields.get('nombrecoordinador', 'N/A')} - "
+                    f"Total: {fields.get('total', 0)} kg"
+                )
+            else:  # detailed
+                output_lines.append(f"\n=== Certificado #{i} ===")
+                output_lines.append(f"Consecutivo: {fields.get('pre_consecutivo', 'N/A')}")
+                output_lines.append(f"Fecha devolución: {fields.get('fechadevolucion', 'N/A')}")
+                output_lines.append(f"Coordinador: {fields.get('nombrecoordinador', 'N/A')}")
+                output_lines.append(f"Municipio generador: {fields.get('municipiogenerador', 'N/A')}")
+                output_lines.append(f"Municipio devolución: {fields.get('municipiodevolucion', 'N/A')}")
+                output_lines.append(f"Materiales:")
+                output_lines.append(f"  - Rígidos: {fields.get('rigidos', 0)} kg")
+                output_lines.append(f"  - Flexibles: {fields.get('flexibles', 0)} kg")
+                output_lines.append(f"  - Metálicos: {fields.get('metalicos', 0)} kg")
+                output_lines.append(f"  - Embalaje: {fields.get('embalaje', 0)} kg")
+                output_lines.append(f"Total: {fields.get('total', 0)} kg")
+
+    elif table_name == "Kardex":
+        for i, record in enumerate(records, 1):
+            fields = record.get("fields", {})
+            if format_type == "summary":
+                output_lines.append(
+                    f"{i}. {fields.get('idkardex', 'N/A')} - "
+                    f"{fields.get('TipoMovimiento', 'N/A')} - "
+                    f"Total: {fields.get('Total', 0)} kg"
+                )
+            else:  # detailed
+                output_lines.append(f"\n=== Movimiento #{i} ===")
+                output_lines.append(f"ID Kardex: {fields.get('idkardex', 'N/A')}")
+                output_lines.append(f"Fecha: {fields.get('fechakardex', 'N/A')}")
+                output_lines.append(f"Tipo movimiento: {fields.get('TipoMovimiento', 'N/A')}")
+                output_lines.append(f"Coordinador: {fields.get('Name (from Coordinador)', 'N/A')}")
+                output_lines.append(f"Municipio origen: {fields.get('MunicipioOrigen', 'N/A')}")
+                output_lines.append(f"Centro de acopio: {fields.get('NombreCentrodeAcopio', 'N/A')}")
+                output_lines.append(f"Gestor: {fields.get('nombregestor', 'N/A')}")
+                output_lines.append(f"Disposición:")
+                output_lines.append(f"  - Reciclaje: {fields.get('Reciclaje', 0)} kg")
+                output_lines.append(f"  - Incineración: {fields.get('Incineración', 0)} kg")
+                output_lines.append(f"  - Plástico contaminado: {fields.get('PlasticoContaminado', 0)} kg")
+                output_lines.append(f"Materiales:")
+                output_lines.append(f"  - Flexibles: {fields.get('Flexibles', 0)} kg")
+                output_lines.append(f"  - Lonas: {fields.get('Lonas', 0)} kg")
+                output_lines.append(f"  - Cartón: {fields.get('Carton', 0)} kg")
+                output_lines.append(f"  - Metal: {fields.get('Metal', 0)} kg")
+                output_lines.append(f"Total: {fields.get('Total', 0)} kg")
+    else:
+        # Tabla desconocida - formato genérico
+        for i, record in enumerate(records, 1):
+            fields = record.get("fields", {})
+            output_lines.append(f"\n=== Registro #{i} ===")
+            for key, value in fields.items():
+                output_lines.append(f"{key}: {value}")
+
+    return "\n".join(output_lines)
+
+
+def random_records(table_name, count, seed=11):
+    rng = random.Random(seed)
+    fields = {
+        "Certificados": ["pre_consecutivo", "fechadevolucion", "nombrecoordinador", "municipiogenerador",
+                         "municipiodevolucion", "rigidos", "flexibles", "metalicos", "embalaje", "total"],
+        "Kardex": ["idkardex", "fechakardex", "TipoMovimiento", "Name (from Coordinador)", "MunicipioOrigen",
+                   "NombreCentrodeAcopio", "nombregestor", "Reciclaje", "Incineración", "PlasticoContaminado",
+                   "Flexibles", "Lonas", "Carton", "Metal", "Total"],
+        "Otra": ["nombre", "valor", "notas"],
+    }[table_name]
+    values = [None, "", "Ana Gómez", ["Juan Pérez"], ["A", "B"], 0, 12, 3.5, 100.0, "{{ x }}", "línea\ncon salto", True]
+    records = []
+    for i in range(count):
+        chosen = {name: rng.choice(values) for name in fields if rng.random() < 0.8}
+        records.append({"id": f"rec{i:03d}", "createdTime": "2024-01-01T00:00:00.000Z", "fields": chosen})
+    return records
+
+
+def test_templates_match_previous_output():
+    print("\n=== TEST: las plantillas dan el mismo texto que la implementación anterior ===")
+    for table_name in ("Certificados", "Kardex", "Otra"):
+        records = random_records(table_name, 60)
+        for format_type in ("summary", "detailed", "json", "otro"):
+            for subset in (records, records[:1], []):
+                expected = legacy_format(subset, table_name, format_type)
+                assert format_records_for_display(subset, table_name, format_type) == expected, \
+                    (table_name, format_type, len(subset))
+    print(format_records_for_display(random_records("Kardex", 1), "Kardex", "detailed"))
+
+
+def test_windows_keep_numbering():
+    print("\n=== TEST: una ventana formatea solo sus registros y conserva la numeración ===")
+    records = random_records("Certificados", 300)
+    for format_type in ("summary", "detailed"):
+        blocks = list(record_format.iter_formatted(records, "Certificados", format_type))
+        assert "".join(blocks) == legacy_format(records, "Certificados", format_type)
+        window = record_format.format_records(records, "Certificados", format_type, start=100, stop=200)
+        # Mismos bloques que en el listado completo, sin el separador del primero
+        assert window == "".join(blocks[100:200])[1:]
+    assert record_format.format_records(records, "Certificados", "summary", 100, 101).startswith("101. ")
+
+    json_window = record_format.format_records(records, "Certificados", "json", start=5, stop=8)
+    assert json.loads(json_window) == records[5:8]
+    assert record_format.format_records(records, "Certificados", "summary", start=400) == record_format.EMPTY_MESSAGE
+
+
+def test_generator_is_lazy():
+    print("\n=== TEST: el generador no recorre registros más allá de la ventana ===")
+    records = random_records("Kardex", 500)
+    consumed = []
+
+    def source():
+        for record in records:
+            consumed.append(record["id"])
+            yield record
+
+    chunks = record_format.iter_formatted(source(), "Kardex", "detailed", start=10, stop=20)
+    first = next(chunks)
+    assert first.startswith("\n=== Movimiento #11 ===")
+    assert len(consumed) == 11
+    rest = list(chunks)
+    assert len(rest) == 9 and len(consumed) == 20
+
+
+if __name__ == "__main__":
+    test_templates_match_previous_output()
+    test_windows_keep_numbering()
+    test_generator_is_lazy()
+    print("\n✅ Pruebas completadas")
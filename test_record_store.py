@@ -0,0 +1,255 @@
+"""
+Pruebas del almacén columnar (record_store.py) sin conexión.
+
+Compara los filtros por columnas con local_query y las agregaciones con
+aggregations.Columns, y verifica que las columnas ocupan mucho menos que
+los diccionarios por fila.
+"""
+import os
+import sys
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime
+import record_store
+import table_mirror
+from aggregations import Columns, aggregate, totals
+from local_query import run_query
+from test_local_query import RECORDS, FILTER_CASES
+
+
+COORDINADORES = ["Ana Gómez", "Juan Pérez", "Luis Díaz", "Marta Ruiz"]
+MUNICIPIOS = ["Ibagué", "Espinal", "Honda", "Mariquita", "Melgar", "Chaparral"]
+
+
+def make_records(rows):
+    return [{"id": f"rec{i:05d}", "createdTime": "2024-01-01T00:00:00.000Z", "fields": fields}
+            for i, fields in enumerate(rows)]
+
+
+def random_certificados(count, seed=7):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        rows.append({
+            "pre_consecutivo": f"C-{i}",
+            "fechadevolucion": f"{rng.randint(2019, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "nombrecoordinador": rng.choice(COORDINADORES),
+            "municipiogenerador": rng.choice(MUNICIPIOS),
+            "municipiodevolucion": rng.choice(MUNICIPIOS),
+            "rigidos": rng.randint(0, 500),
+            "flexibles": round(rng.uniform(0, 80), 2),
+            "metalicos": rng.randint(0, 30),
+            "embalaje": rng.randint(0, 10),
+            "total": rng.randint(0, 600),
+            "observaciones": "Entrega completa" if i % 3 else "",
+        })
+    return rows
+
+
+def test_filters_match_local_query():
+    print("\n=== TEST: los filtros por columnas devuelven lo mismo que local_query ===")
+    records = make_records(RECORDS) + make_records(random_certificados(300))
+    for i, record in enumerate(records):
+        record["id"] = f"rec{i:05d}"
+    store = record_store.RecordStore("Certificados", records)
+    cases = [case for case in FILTER_CASES if set(case) <= {"coordinador", "municipio", "municipio_generador",
+                                                             "municipio_devolucion", "fecha_desde", "fecha_hasta"}]
+    cases.append({"municipio": "Honda", "fecha_desde": "2021-06-30T12:00:00.000Z", "fecha_hasta": "2023-01-01"})
+    cases.append({"fecha_desde": "no es fecha"})
+    for filters in cases:
+        rows = store.filter(filters)
+        expected = [record["id"] for record in run_query(records, filters)]
+        print(f"{filters}: {len(rows)} filas")
+        assert [store.ids[row] for row in rows] == expected, filters
+
+
+def test_date_index_matches_scan():
+    print("\n=== TEST: el índice de fechas da lo mismo que comparar fila por fila ===")
+    records = make_records(random_certificados(400) + RECORDS)
+    store = record_store.RecordStore("Certificados", records)
+    bounds = [None, "2019-01-01", "2021-06-15", "2021-06-15T00:00:00.000Z", "2022-12-31T23:59:59.000Z",
+              "2024-01-15", "2030-01-01", "no es fecha"]
+    for desde in bounds:
+        for hasta in bounds:
+            filters = {key: value for key, value in (("fecha_desde", desde), ("fecha_hasta", hasta)) if value}
+            expected = [record["id"] for record in run_query(records, filters)]
+            assert [store.ids[row] for row in store.filter(filters)] == expected, filters
+
+    # Los límites son estrictos: la fecha exacta del límite no entra por ningún lado
+    exact = store.date_range("2024-01-14", "2024-01-16")
+    assert [store.ids[row] for row in exact] == [records[400 + 1]["id"], records[400 + 5]["id"]]
+    assert store.date_range("2024-01-15", "2024-01-16") == []
+    assert store.date_range("2024-01-14", "2024-01-15") == []
+
+
+def test_kardex_date_index():
+    print("\n=== TEST: Kardex tiene índice sobre fechakardex ===")
+    rows = [{"fechakardex": f"2024-0{month}-10", "Total": month} for month in (3, 1, 2, 1)] + [{"Total": 9}]
+    store = record_store.RecordStore("Kardex", make_records(rows))
+    assert list(store.date_index.rows) == [1, 3, 2, 0]
+    assert store.date_range("2024-01-31", None) == [0, 2]
+    assert store.date_range(None, "2024-02-10") == [1, 3]
+    assert record_store.date_from_value(store.dates[0]) == datetime(2024, 3, 10)
+    assert record_store.date_from_value(store.dates[4]) is None
+
+
+def test_kardex_posting_lists_match_local_query():
+    print("\n=== TEST: los índices invertidos de Kardex devuelven lo mismo que local_query ===")
+    rng = random.Random(3)
+    rows = [{
+        "fechakardex": f"2024-{rng.randint(1, 12):02d}-10",
+        "Name (from Coordinador)": [rng.choice(COORDINADORES)],
+        "MunicipioOrigen": rng.choice(MUNICIPIOS),
+        "nombregestor": rng.choice(["Gestor A", "Gestor B", None]),
+        "Total": rng.randint(0, 90),
+    } for _ in range(300)]
+    records = make_records(rows)
+    store = record_store.RecordStore("Kardex", records)
+    cases = [
+        {"Name (from Coordinador)": "Ana Gómez"},
+        {"MunicipioOrigen": "Honda", "nombregestor": "Gestor B"},
+        {"nombregestor": ""},
+        {"Name (from Coordinador)": "Marta Ruiz", "MunicipioOrigen": "Melgar", "nombregestor": "Gestor A"},
+        {"MunicipioOrigen": "Bogotá"},
+    ]
+    for filters in cases:
+        expected = [record["id"] for record in run_query(records, filters)]
+        assert [store.ids[row] for row in store.filter(filters)] == expected, filters
+
+
+def test_combined_municipio_index():
+    print("\n=== TEST: el índice combinado de municipio es la unión de generador y devolución ===")
+    store = record_store.RecordStore("Certificados", make_records(random_certificados(300)))
+    for municipio in MUNICIPIOS:
+        generador = set(store.filter({"municipio_generador": municipio}))
+        devolucion = set(store.filter({"municipio_devolucion": municipio}))
+        assert store.filter({"municipio": municipio}) == sorted(generador | devolucion)
+    assert ("municipiogenerador", "municipiodevolucion") in store._combined
+    assert store.filter({"municipio": "Bogotá"}) == []
+    assert record_store.RecordStore("Kardex", []).filter({"municipio": "Honda"}) is None
+
+
+class CountingList(list):
+    """Lista que cuenta cuántas posiciones se leen"""
+    reads = 0
+
+    def __getitem__(self, index):
+        CountingList.reads += 1
+        return super().__getitem__(index)
+
+
+def test_intersection_skips_non_matching_rows():
+    print("\n=== TEST: la intersección no recorre la lista larga completa ===")
+    long = CountingList(range(0, 200000, 2))
+    short = [10, 11, 5000, 77777, 150000, 199998]
+    CountingList.reads = 0
+    assert record_store.intersect(short, long) == [10, 5000, 150000, 199998]
+    print(f"Lecturas en la lista larga: {CountingList.reads}")
+    assert CountingList.reads < 200
+    assert record_store.intersect(long, short) == [10, 5000, 150000, 199998]
+    assert record_store.intersect([], long) == []
+
+
+def test_unsupported_filter_falls_back():
+    print("\n=== TEST: un filtro sobre un campo fuera de las columnas devuelve None ===")
+    store = record_store.RecordStore("Certificados", make_records(RECORDS))
+    assert store.filter({"pre_consecutivo": "C-3"}) is None
+    kardex = record_store.RecordStore("Kardex", [])
+    assert kardex.filter({"idkardex": "K-1"}) is None
+
+
+def test_aggregations_match_columns():
+    print("\n=== TEST: las agregaciones sobre el almacén coinciden con Columns ===")
+    records = make_records(random_certificados(500))
+    store = record_store.RecordStore("Certificados", records)
+    columns = Columns("Certificados", records)
+    assert totals(store) == totals(columns)
+    for group_by in ("coordinador", "municipio", "municipio_devolucion", "mes"):
+        assert aggregate(store, group_by) == aggregate(columns, group_by), group_by
+
+    rows = store.filter({"coordinador": "Ana Gómez"})
+    subset = [records[row] for row in rows]
+    assert aggregate(store.select(rows), "mes") == aggregate(Columns("Certificados", subset), "mes")
+
+
+def test_memory_is_a_fraction_of_dicts():
+    print("\n=== TEST: las columnas ocupan una fracción de los diccionarios por fila ===")
+    rows = random_certificados(5000)
+    store = record_store.RecordStore("Certificados", make_records(rows))
+    dict_bytes = sum(
+        sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row.values())
+        for row in rows
+    )
+    print(f"Diccionarios: {dict_bytes} bytes, columnas: {store.memory_bytes()} bytes")
+    assert store.memory_bytes() * 5 < dict_bytes
+
+
+def test_store_rebuilt_on_new_version():
+    print("\n=== TEST: el almacén se reutiliza hasta que cambia la versión de la copia local ===")
+    record_store.invalidate()
+    table_mirror.configure(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'mirror_test.db')}")
+    try:
+        pages = [make_records(RECORDS[:3])]
+        fetch_page = lambda table_name, params, offset: (pages[0], None)
+        table_mirror.sync_table("Certificados", fetch_page=fetch_page)
+        store = record_store.get_store("Certificados")
+        assert store.size == 3
+        assert record_store.get_store("Certificados") is store
+
+        pages[0] = make_records(RECORDS)
+        table_mirror.sync_table("Certificados", full=True, fetch_page=fetch_page)
+        rebuilt = record_store.get_store("Certificados")
+        assert rebuilt is not store and rebuilt.size == len(RECORDS)
+    finally:
+        table_mirror.engine = table_mirror.SessionLocal = None
+        record_store.invalidate()
+
+
+def test_concurrent_callers_build_once():
+    print("\n=== TEST: varios hilos con una versión nueva construyen el almacén una sola vez ===")
+    record_store.invalidate()
+    table_mirror.configure(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'mirror_test.db')}")
+    records = make_records(RECORDS)
+    table_mirror.sync_table("Certificados", fetch_page=lambda table_name, params, offset: (records, None))
+
+    builds = []
+    original = table_mirror.iter_mirror_records
+
+    def slow_iter(table_name):
+        builds.append(table_name)
+        time.sleep(0.05)
+        return original(table_name)
+
+    table_mirror.iter_mirror_records = slow_iter
+    try:
+        stores = []
+        threads = [threading.Thread(target=lambda: stores.append(record_store.get_store("Certificados")))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print(f"Construcciones: {len(builds)}")
+        assert builds == ["Certificados"]
+        assert len(stores) == 8 and all(store is stores[0] for store in stores)
+    finally:
+        table_mirror.iter_mirror_records = original
+        table_mirror.engine = table_mirror.SessionLocal = None
+        record_store.invalidate()
+
+
+if __name__ == "__main__":
+    test_filters_match_local_query()
+    test_date_index_matches_scan()
+    test_kardex_date_index()
+    test_kardex_posting_lists_match_local_query()
+    test_combined_municipio_index()
+    test_intersection_skips_non_matching_rows()
+    test_unsupported_filter_falls_back()
+    test_aggregations_match_columns()
+    test_memory_is_a_fraction_of_dicts()
+    test_store_rebuilt_on_new_version()
+    test_concurrent_callers_build_once()
+    print("\n✅ Pruebas completadas")
@@ -0,0 +1,149 @@
+"""
+Pruebas de la caché persistente de respuestas del agente (response_cache.py)
+sin conexión: OpenAI y los conteos de tablas se sustituyen por dobles.
+
+Verifica que un turno repetido no llama a OpenAI, que la clave cambia con el
+estado y con la versión de datos, el bypass con extra["no_cache"], la
+persistencia en disco y la expulsión por TTL y por LRU.
+"""
+import os
+import asyncio
+import tempfile
+from types import SimpleNamespace
+import agent_with_context
+import response_cache
+from conversation_state import ConversationState, ConversationStatus
+
+
+class AgentEnv:
+    """Credenciales de prueba, caché en un archivo temporal y dobles de OpenAI y de los conteos"""
+
+    def __init__(self, answer="Voy a armar la consulta de Certificados."):
+        self.answer = answer
+        self.calls = 0
+        self.path = os.path.join(tempfile.mkdtemp(), "response_cache.db")
+
+    def responses_create(self, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(output_text=self.answer, usage=None)
+
+    async def aresponses_create(self, **kwargs):
+        return self.responses_create(**kwargs)
+
+    def __enter__(self):
+        names = ("AIRTABLE_API_KEY", "AIRTABLE_BASE_ID", "OPENAI_API_KEY")
+        self.saved_env = {name: os.environ.get(name) for name in names}
+        os.environ.update(AIRTABLE_API_KEY="key_test", AIRTABLE_BASE_ID="app_test", OPENAI_API_KEY="sk_test")
+        self.saved = (agent_with_context.OpenAI, agent_with_context.get_async_openai_client,
+                      agent_with_context._load_counts, agent_with_context._load_counts_async)
+        agent_with_context.OpenAI = lambda: SimpleNamespace(responses=SimpleNamespace(create=self.responses_create))
+        agent_with_context.get_async_openai_client = (
+            lambda: SimpleNamespace(responses=SimpleNamespace(create=self.aresponses_create))
+        )
+        agent_with_context._load_counts = lambda max_records: ({"Certificados": 10, "Kardex": 20}, None)
+
+        async def load_counts_async(max_records):
+            return {"Certificados": 10, "Kardex": 20}, None
+
+        agent_with_context._load_counts_async = load_counts_async
+        response_cache.configure(f"sqlite:///{self.path}")
+        return self
+
+    def __exit__(self, *exc):
+        (agent_with_context.OpenAI, agent_with_context.get_async_openai_client,
+         agent_with_context._load_counts, agent_with_context._load_counts_async) = self.saved
+        for name, value in self.saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def ask(question, extra=None):
+    state = ConversationState(user_id="director", conversation_id=None)
+    state.add_message("user", question)
+    return agent_with_context.run_agent_with_context(question, state, extra)
+
+
+def test_repeated_turn_skips_openai():
+    print("\n=== TEST: la misma pregunta con el mismo estado no vuelve a llamar a OpenAI ===")
+    with AgentEnv() as env:
+        first, first_state = ask("¿Cuánto recolectó Ana en enero?")
+        second, second_state = ask("  cuánto recolectó ana en enero ")
+        print(f"Llamadas a OpenAI: {env.calls}")
+        assert env.calls == 1
+        assert first == second == env.answer
+        # La respuesta guardada se aplica al estado igual que una nueva
+        assert second_state.query["table"] == first_state.query["table"] == "Certificados"
+        assert second_state.conversation["status"] == first_state.conversation["status"]
+        assert second_state.history[-1]["content"] == env.answer
+
+        ask("¿Cuánto recolectó Ana en enero?", {"no_cache": True})
+        assert env.calls == 2
+        metrics = response_cache.get_metrics()
+        print(metrics)
+        assert metrics["entries"] == 1 and metrics["bypassed"] >= 1
+
+        # Versión asíncrona: comparte la caché
+        state = ConversationState(user_id="director", conversation_id=None)
+        message, _ = asyncio.run(
+            agent_with_context.run_agent_with_context_async("¿Cuánto recolectó Ana en enero?", state)
+        )
+        assert message == env.answer and env.calls == 2
+
+
+def test_key_depends_on_state_and_data():
+    print("\n=== TEST: la clave cambia con el estado, el historial y la versión de datos ===")
+    question = "consolidado de enero"
+    base = ConversationState(user_id="u", conversation_id="c")
+    key = response_cache.make_key(question, base, "gpt-5.1")
+    assert key == response_cache.make_key("Consolidado  de enero?", ConversationState("v", "d"), "gpt-5.1")
+
+    with_filter = ConversationState(user_id="u", conversation_id="c")
+    with_filter.add_filter("coordinador", "Ana Gómez")
+    awaiting = ConversationState(user_id="u", conversation_id="c")
+    awaiting.update_status(ConversationStatus.AWAITING_CLARIFICATION)
+    with_history = ConversationState(user_id="u", conversation_id="c")
+    with_history.add_message("agent", "¿De qué tabla?")
+    for state in (with_filter, awaiting, with_history):
+        assert response_cache.make_key(question, state, "gpt-5.1") != key
+    assert response_cache.make_key(question, base, "otro-modelo") != key
+
+    versions, original = (lambda: {"Certificados": 7, "Kardex": 3}), response_cache.data_versions
+    response_cache.data_versions = versions
+    try:
+        assert response_cache.make_key(question, base, "gpt-5.1") != key
+    finally:
+        response_cache.data_versions = original
+
+
+def test_persistence_ttl_and_lru():
+    print("\n=== TEST: las respuestas sobreviven a un reinicio y se expulsan por TTL y LRU ===")
+    with AgentEnv() as env:
+        response_cache.put("a", "respuesta a")
+        response_cache.configure(f"sqlite:///{env.path}")  # Como al reiniciar el servidor
+        assert response_cache.get("a") == "respuesta a"
+
+        response_cache.CACHE_MAX_ENTRIES, max_entries = 2, response_cache.CACHE_MAX_ENTRIES
+        try:
+            response_cache.put("b", "respuesta b")
+            response_cache.get("a")  # "a" pasa a ser la más reciente
+            response_cache.put("c", "respuesta c")
+            assert response_cache.get("b") is None
+            assert response_cache.get("a") == "respuesta a" and response_cache.get("c") == "respuesta c"
+        finally:
+            response_cache.CACHE_MAX_ENTRIES = max_entries
+
+        response_cache.CACHE_TTL, ttl = -1, response_cache.CACHE_TTL
+        try:
+            assert response_cache.get("a") is None
+        finally:
+            response_cache.CACHE_TTL = ttl
+        assert response_cache.get_metrics()["entries"] == 1
+
+
+if __name__ == "__main__":
+    test_repeated_turn_skips_openai()
+    test_key_depends_on_state_and_data()
+    test_persistence_ttl_and_lru()
+    print("\n✅ Pruebas completadas")
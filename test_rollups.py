@@ -0,0 +1,183 @@
+"""
+Pruebas de los consolidados mensuales de la copia local (rollups.py) sin conexión.
+
+Verifica que los consolidados mantenidos de forma incremental coinciden
+con recalcularlos desde cero y con aggregations sobre los registros.
+"""
+import os
+import json
+import tempfile
+import rollups
+import table_mirror
+from aggregations import Columns, aggregate
+
+
+CERTIFICADOS = [
+    {"fechadevolucion": "2024-01-10", "nombrecoordinador": "Ana Gómez", "municipiogenerador": "Ibagué",
+     "rigidos": 10, "flexibles": 2.5, "total": 12.5},
+    {"fechadevolucion": "2024-01-20", "nombrecoordinador": "Ana Gómez", "municipiogenerador": "Ibagué",
+     "rigidos": 5, "total": 5},
+    {"fechadevolucion": "2024-02-01T15:30:00.000Z", "nombrecoordinador": "Juan Pérez",
+     "municipiogenerador": "Espinal", "metalicos": 3, "total": 3},
+    {"nombrecoordinador": ["Juan Pérez"], "municipiogenerador": "Honda", "total": 1},
+]
+
+KARDEX = [
+    {"fechakardex": "2024-03-05", "Name (from Coordinador)": ["Ana Gómez"], "NombreCentrodeAcopio": "Centro Norte",
+     "nombregestor": "Gestor A", "TipoMovimiento": "Entrada", "Reciclaje": 40, "Total": 40},
+    {"fechakardex": "2024-03-18", "Name (from Coordinador)": ["Ana Gómez"], "NombreCentrodeAcopio": "Centro Norte",
+     "nombregestor": "Gestor A", "TipoMovimiento": "Entrada", "Reciclaje": 10, "Incineración": 5, "Total": 15},
+    {"fechakardex": "2024-03-20", "Name (from Coordinador)": ["Ana Gómez"], "NombreCentrodeAcopio": "Centro Norte",
+     "nombregestor": "Gestor B", "TipoMovimiento": "Salida", "Carton": 7, "Total": 7},
+]
+
+
+def make_records(rows, prefix="rec"):
+    return [{"id": f"{prefix}{i:03d}", "createdTime": f"2024-01-01T00:00:{i:02d}.000Z", "fields": dict(fields)}
+            for i, fields in enumerate(rows)]
+
+
+class FakeTable:
+    """Devuelve `records` completos en el backfill y `changed` en el incremental"""
+
+    def __init__(self, records):
+        self.records = records
+        self.changed = []
+
+    def fetch_page(self, table_name, params, offset):
+        if "filterByFormula" in params:
+            return self.changed, None
+        return self.records, None
+
+
+def setup_mirror():
+    table_mirror.configure(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'mirror_test.db')}")
+
+
+def rebuilt_rollups(table_name):
+    """Consolidados recalculados desde cero, para comparar con los incrementales"""
+    db = table_mirror.SessionLocal()
+    try:
+        table_mirror._rebuild_rollups(db, table_name)
+        db.flush()
+        rows = [group.to_dict() for group in db.query(table_mirror.MonthlyRollup).filter_by(table_name=table_name)]
+        db.rollback()
+        return rows
+    finally:
+        db.close()
+
+
+def by_key(rows):
+    return sorted(rows, key=lambda row: json.dumps(row, sort_keys=True, ensure_ascii=False))
+
+
+def test_rollups_match_aggregations():
+    print("\n=== TEST: los consolidados dan los mismos totales que aggregations ===")
+    setup_mirror()
+    try:
+        records = make_records(CERTIFICADOS)
+        table_mirror.sync_table("Certificados", fetch_page=FakeTable(records).fetch_page)
+        rows = table_mirror.get_rollups("Certificados")
+        print(f"Grupos: {len(rows)}")
+        assert len(rows) == 3
+
+        columns = Columns("Certificados", records)
+        for group_by in ("coordinador", "municipio", "mes"):
+            assert rollups.summarize("Certificados", rows, group_by) == aggregate(columns, group_by), group_by
+
+        enero = rollups.summarize("Certificados", rows, where={"mes": "2024-01"})
+        assert enero[0]["registros"] == 2
+        assert enero[0]["total"] == 17.5
+    finally:
+        table_mirror.engine = table_mirror.SessionLocal = None
+
+
+def test_kardex_keys():
+    print("\n=== TEST: Kardex se consolida por centro de acopio, gestor y tipo de movimiento ===")
+    setup_mirror()
+    try:
+        table_mirror.sync_table("Kardex", fetch_page=FakeTable(make_records(KARDEX)).fetch_page)
+        rows = table_mirror.get_rollups("Kardex")
+        assert len(rows) == 2
+        entrada = [row for row in rows if row["tipo_movimiento"] == "Entrada"][0]
+        assert entrada["registros"] == 2
+        assert entrada["Reciclaje"] == 50
+        assert entrada["coordinador"] == "Ana Gómez"
+        assert entrada["centro_acopio"] == "Centro Norte"
+        assert entrada["municipio"] == ""
+        by_gestor = rollups.summarize("Kardex", rows, "gestor")
+        assert [row["gestor"] for row in by_gestor] == ["Gestor A", "Gestor B"]
+    finally:
+        table_mirror.engine = table_mirror.SessionLocal = None
+
+
+def test_incremental_changes_update_rollups():
+    print("\n=== TEST: cambios incrementales restan el aporte anterior y suman el nuevo ===")
+    setup_mirror()
+    try:
+        records = make_records(CERTIFICADOS)
+        fake = FakeTable(records)
+        table_mirror.sync_table("Certificados", fetch_page=fake.fetch_page)
+
+        # Cambia el coordinador y el total de un registro, y llega uno nuevo
+        modified = dict(records[2], fields=dict(records[2]["fields"], nombrecoordinador="Ana Gómez", total=9))
+        new = make_records([{"fechadevolucion": "2024-02-11", "nombrecoordinador": "Luis Díaz", "total": 4}], "new")[0]
+        fake.changed = [modified, new]
+        result = table_mirror.sync_table("Certificados", fetch_page=fake.fetch_page)
+        assert result["mode"] == "incremental" and result["changed"] == 2
+
+        rows = table_mirror.get_rollups("Certificados")
+        assert by_key(rows) == by_key(rebuilt_rollups("Certificados"))
+        coordinadores = {row["coordinador"]: row for row in rollups.summarize("Certificados", rows, "coordinador")}
+        assert "Juan Pérez" in coordinadores and coordinadores["Juan Pérez"]["registros"] == 1
+        assert coordinadores["Ana Gómez"]["total"] == 26.5
+        assert coordinadores["Luis Díaz"]["total"] == 4
+    finally:
+        table_mirror.engine = table_mirror.SessionLocal = None
+
+
+def test_deleted_records_leave_rollups():
+    print("\n=== TEST: los registros borrados en el backfill salen de los consolidados ===")
+    setup_mirror()
+    try:
+        records = make_records(CERTIFICADOS)
+        fake = FakeTable(records)
+        table_mirror.sync_table("Certificados", fetch_page=fake.fetch_page)
+
+        fake.records = records[:2]
+        result = table_mirror.sync_table("Certificados", full=True, fetch_page=fake.fetch_page)
+        assert result["deleted"] == 2
+
+        rows = table_mirror.get_rollups("Certificados")
+        assert len(rows) == 1
+        assert rows[0]["coordinador"] == "Ana Gómez" and rows[0]["registros"] == 2
+        assert by_key(rows) == by_key(rebuilt_rollups("Certificados"))
+    finally:
+        table_mirror.engine = table_mirror.SessionLocal = None
+
+
+def test_existing_mirror_gets_rollups_on_configure():
+    print("\n=== TEST: una copia creada sin consolidados los calcula al configurar ===")
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'mirror_test.db')}"
+    table_mirror.configure(url)
+    try:
+        table_mirror.sync_table("Certificados", fetch_page=FakeTable(make_records(CERTIFICADOS)).fetch_page)
+        db = table_mirror.SessionLocal()
+        db.query(table_mirror.MonthlyRollup).delete()
+        db.commit()
+        db.close()
+        assert table_mirror.get_rollups("Certificados") == []
+
+        table_mirror.configure(url)
+        assert len(table_mirror.get_rollups("Certificados")) == 3
+    finally:
+        table_mirror.engine = table_mirror.SessionLocal = None
+
+
+if __name__ == "__main__":
+    test_rollups_match_aggregations()
+    test_kardex_keys()
+    test_incremental_changes_update_rollups()
+    test_deleted_records_leave_rollups()
+    test_existing_mirror_gets_rollups_on_configure()
+    print("\n✅ Pruebas completadas")
@@ -0,0 +1,122 @@
+"""
+Pruebas de las instantáneas en Parquet / Arrow (snapshot_export.py) sin conexión.
+
+Requieren pyarrow; si no está instalado las pruebas no hacen nada.
+"""
+import os
+import tempfile
+import threading
+import table_mirror
+import snapshot_export
+from test_rollups import CERTIFICADOS, KARDEX, make_records
+from test_query_planner import setup_mirror, teardown_mirror
+
+try:
+    import pyarrow
+    import pyarrow.dataset as ds
+except ImportError:
+    ds = None
+
+
+def read(path, file_format="parquet"):
+    return ds.dataset(path, format=file_format, partitioning="hive").to_table()
+
+
+def test_parquet_partitions_and_types():
+    print("\n=== TEST: Parquet particionado por año y mes, con columnas tipadas ===")
+    if ds is None:
+        print("pyarrow no instalado")
+        return
+    setup_mirror(make_records(CERTIFICADOS))
+    table_mirror.sync_table("Kardex", fetch_page=lambda table_name, params, offset: (make_records(KARDEX), None))
+    output = tempfile.mkdtemp()
+    try:
+        summaries = snapshot_export.write_snapshots(output)
+        print(summaries)
+        certificados = summaries["Certificados"]
+        assert certificados["rows"] == len(CERTIFICADOS)
+        assert certificados["files"] == [
+            "anio=2024/mes=1/part-0.parquet",
+            "anio=2024/mes=2/part-0.parquet",
+            "anio=__HIVE_DEFAULT_PARTITION__/mes=__HIVE_DEFAULT_PARTITION__/part-0.parquet",
+        ]
+
+        table = read(certificados["path"])
+        assert table.schema.field("total").type == pyarrow.float64()
+        assert table.schema.field("fechadevolucion").type == pyarrow.timestamp("ms")
+        assert pyarrow.types.is_dictionary(table.schema.field("nombrecoordinador").type)
+        rows = sorted(table.to_pylist(), key=lambda row: row["id"])
+        assert [row["total"] for row in rows] == [12.5, 5.0, 3.0, 1.0]
+        # El lookup ["Juan Pérez"] y el texto "Juan Pérez" son el mismo valor
+        assert [row["nombrecoordinador"] for row in rows][2:] == ["Juan Pérez", "Juan Pérez"]
+        assert rows[3]["anio"] is None and rows[2]["mes"] == 2
+
+        kardex = read(summaries["Kardex"]["path"])
+        assert kardex.num_rows == len(KARDEX) and sum(kardex.column("Total").to_pylist()) == 62
+    finally:
+        teardown_mirror()
+
+
+def test_arrow_export_replaces_previous():
+    print("\n=== TEST: Arrow IPC y cada exportación reemplaza la anterior ===")
+    if ds is None:
+        print("pyarrow no instalado")
+        return
+    setup_mirror(make_records(CERTIFICADOS))
+    output = tempfile.mkdtemp()
+    try:
+        snapshot_export.write_table("Certificados", output)
+        summary = snapshot_export.write_table("Certificados", output, "arrow", "lz4")
+        assert all(name.endswith(".arrow") for name in summary["files"])
+        remaining = [name for _, _, names in os.walk(summary["path"]) for name in names]
+        assert sorted(remaining) == sorted(os.path.basename(name) for name in summary["files"])
+        assert read(summary["path"], "ipc").num_rows == len(CERTIFICADOS)
+    finally:
+        teardown_mirror()
+
+
+def test_concurrent_exports_do_not_collide():
+    print("\n=== TEST: dos exportaciones a la vez dejan una instantánea completa ===")
+    if ds is None:
+        print("pyarrow no instalado")
+        return
+    setup_mirror(make_records(CERTIFICADOS))
+    output = tempfile.mkdtemp()
+    results, errors = [], []
+
+    def export():
+        try:
+            results.append(snapshot_export.write_table("Certificados", output))
+        except Exception as e:
+            errors.append(e)
+
+    try:
+        threads = [threading.Thread(target=export) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        assert len(results) == 4
+        assert read(os.path.join(output, "Certificados")).num_rows == len(CERTIFICADOS)
+        assert not os.path.exists(os.path.join(output, "Certificados.tmp"))
+    finally:
+        teardown_mirror()
+
+
+def test_errors():
+    print("\n=== TEST: formato no soportado y copia local sin datos ===")
+    for args in [("Certificados", None, "xlsx"), ("Certificados", tempfile.mkdtemp())]:
+        try:
+            snapshot_export.write_table(*args)
+            assert False, "debía fallar"
+        except snapshot_export.SnapshotExportError as e:
+            print(f"Error esperado: {e}")
+
+
+if __name__ == "__main__":
+    test_parquet_partitions_and_types()
+    test_arrow_export_replaces_previous()
+    test_concurrent_exports_do_not_collide()
+    test_errors()
+    print("\n✅ Pruebas completadas")
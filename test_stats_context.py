@@ -0,0 +1,90 @@
+"""
+Pruebas del contexto estadístico para el modelo (stats_context.py) sin conexión.
+
+Verifica que el tamaño del contexto no crece con el número de registros, que
+los totales coinciden con aggregations y que las variaciones y los atípicos
+son los esperados.
+"""
+import prompt_encoding
+import stats_context
+from agent_core import _table_section
+from aggregations import aggregate, totals, format_table
+from record_store import RecordStore
+from test_record_store import random_certificados, make_records
+
+
+def certificado(fecha, coordinador, total):
+    return {"fechadevolucion": fecha, "nombrecoordinador": coordinador, "municipiogenerador": "Ibagué",
+            "rigidos": total, "total": total}
+
+
+def test_size_does_not_grow_with_rows():
+    print("\n=== TEST: el contexto ocupa lo mismo con 300 que con 6000 registros ===")
+    small, small_metadata = stats_context.build_context(
+        RecordStore("Certificados", make_records(random_certificados(300)))
+    )
+    large, large_metadata = stats_context.build_context(
+        RecordStore("Certificados", make_records(random_certificados(6000)))
+    )
+    raw_tokens = prompt_encoding.count_tokens(str(random_certificados(6000)))
+    print(f"300 filas: {small_metadata['tokens']} tokens, 6000 filas: {large_metadata['tokens']} tokens, "
+          f"filas crudas: {raw_tokens} tokens")
+    assert large_metadata["rows_in_period"] == 6000
+    assert large_metadata["tokens"] < small_metadata["tokens"] * 1.2
+    assert large_metadata["tokens"] * 50 < raw_tokens
+    assert f"últimos {stats_context.MAX_MONTHS} meses" in large
+
+
+def test_totals_match_aggregations():
+    print("\n=== TEST: los totales del periodo coinciden con aggregations ===")
+    records = make_records(random_certificados(500))
+    store = RecordStore("Certificados", records)
+    text, metadata = stats_context.build_context(store, "2021-12-31", "2023-01-01")
+    rows = store.date_range("2021-12-31", "2023-01-01")
+    subset = store.select(rows)
+    assert metadata["rows_in_period"] == len(rows) and metadata["rows_total"] == 500
+    assert format_table([totals(subset)]) in text
+    assert format_table(aggregate(subset, "coordinador"), stats_context.TOP_COORDINADORES) in text
+    assert f"Registros en el periodo: {len(rows)} (de 500 en la tabla)" in text
+
+
+def test_deltas_and_outliers():
+    print("\n=== TEST: variación mes a mes, frente al periodo anterior y atípicos ===")
+    rows = [certificado(f"2024-01-{day:02d}", "Ana Gómez", 10 + day % 3) for day in range(1, 21)]
+    rows += [certificado(f"2023-12-{day:02d}", "Juan Pérez", 5) for day in range(10, 30)]
+    rows.append(certificado("2024-01-25", "Juan Pérez", 900))
+    store = RecordStore("Certificados", make_records(rows))
+
+    months = stats_context.month_over_month(aggregate(store, "mes"), "total")
+    print(format_table(months))
+    assert [row["variacion_%"] for row in months] == [stats_context.NOT_AVAILABLE, 1021.0]
+
+    text, _ = stats_context.build_context(store, "2023-12-31", "2024-01-31")
+    print(text)
+    previous = stats_context.previous_rows(store, "2023-12-31", "2024-01-31")
+    assert len(previous) == 20
+    delta = stats_context.period_delta(totals(store.select(store.date_range("2023-12-31", "2024-01-31"))),
+                                       totals(store.select(previous)))
+    assert delta[-1] == {"medida": "total", "periodo": 1121.0, "anterior": 100.0, "variacion_%": 1021.0}
+    assert "Frente al periodo anterior de la misma duración (20 registros)" in text
+
+    assert [store.ids[row] for row in stats_context.outliers(store, list(range(store.size)), "total")] == ["rec00040"]
+    assert "rec00040" in text.split("Registros atípicos")[1].split("Registros de ejemplo")[0]
+    assert len(stats_context.exemplars(store, list(range(store.size)), "total")) == stats_context.EXEMPLAR_ROWS
+
+
+def test_table_section_reports_tokens():
+    print("\n=== TEST: la sección de la tabla informa los tokens usados ===")
+    text, metadata = _table_section("Kardex", None, "sin respuesta en 20s")
+    assert "no disponible" in text and metadata["tokens"] > 0
+    store = RecordStore("Certificados", make_records(random_certificados(10)))
+    text, metadata = _table_section("Certificados", store, None)
+    assert metadata["rows_in_period"] == 10 and metadata["tokens"] == prompt_encoding.count_tokens(text)
+
+
+if __name__ == "__main__":
+    test_size_does_not_grow_with_rows()
+    test_totals_match_aggregations()
+    test_deltas_and_outliers()
+    test_table_section_reports_tokens()
+    print("\n✅ Pruebas completadas")
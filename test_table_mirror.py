@@ -0,0 +1,160 @@
+"""
+Pruebas de la copia local (table_mirror.py) contra una Airtable simulada.
+Usa una base SQLite temporal; no requiere conexión.
+"""
+import os
+import re
+import tempfile
+from datetime import datetime, timedelta
+import table_mirror
+from airtable_client import AirtableAPIError
+
+
+class FakeAirtable:
+    """
+    Simula la API de listado de Airtable: páginas con cursor `offset` y el
+    filtro IS_AFTER(LAST_MODIFIED_TIME(), '...') que usa la sincronización incremental.
+    """
+    
+    def __init__(self, count, page_size=100):
+        self.page_size = page_size
+        self.tables = {"Certificados": {}, "Kardex": {}}
+        self.modified = {}
+        self.calls = 0
+        self.fail_after_calls = None
+        self.expired_offsets = set()
+        for i in range(count):
+            self.put("Certificados", f"recC{i:04d}", {"pre_consecutivo": str(i), "total": i})
+            self.put("Kardex", f"recK{i:04d}", {"idkardex": f"K{i}", "Total": i})
+    
+    def put(self, table_name, record_id, fields, modified=None):
+        self.tables[table_name][record_id] = {
+            "id": record_id,
+            "createdTime": "2024-01-01T00:00:00.000Z",
+            "fields": fields
+        }
+        self.modified[record_id] = modified or datetime.utcnow() - timedelta(hours=1)
+    
+    def delete(self, table_name, record_id):
+        del self.tables[table_name][record_id]
+    
+    def fetch_page(self, table_name, params, offset):
+        self.calls += 1
+        if self.fail_after_calls is not None and self.calls > self.fail_after_calls:
+            raise ConnectionError("caída simulada")
+        if offset in self.expired_offsets:
+            self.expired_offsets.discard(offset)
+            raise AirtableAPIError(422, "LIST_RECORDS_ITERATOR_NOT_AVAILABLE")
+        
+        records = sorted(self.tables[table_name].values(), key=lambda r: r["id"])
+        formula = params.get("filterByFormula", "")
+        match = re.search(r"IS_AFTER\(LAST_MODIFIED_TIME\(\), '([^']+)'\)", formula)
+        if match:
+            watermark = datetime.strptime(match.group(1), "%Y-%m-%dT%H:%M:%S.000Z")
+            records = [r for r in records if self.modified[r["id"]] > watermark]
+        
+        start = int(offset or 0)
+        end = start + self.page_size
+        next_offset = str(end) if end < len(records) else None
+        return records[start:end], next_offset
+
+
+def use_temp_mirror():
+    path = os.path.join(tempfile.mkdtemp(), "mirror_test.db")
+    table_mirror.configure(f"sqlite:///{path}")
+
+
+def test_backfill_then_incremental():
+    print("\n=== TEST: backfill completo y luego sincronización incremental ===")
+    use_temp_mirror()
+    fake = FakeAirtable(250)
+    
+    result = table_mirror.sync_table("Certificados", fetch_page=fake.fetch_page)
+    print(f"Backfill: {result}")
+    assert result["mode"] == "backfill"
+    assert result["pages"] == 3
+    assert table_mirror.count_records("Certificados") == 250
+    info = table_mirror.get_sync_info("Certificados")
+    assert info["ready"] and info["version"] == 1
+    
+    # Sin cambios: no sube la versión
+    result = table_mirror.sync_table("Certificados", fetch_page=fake.fetch_page)
+    print(f"Incremental sin cambios: {result}")
+    assert result["mode"] == "incremental"
+    assert result["changed"] == 0
+    assert table_mirror.get_sync_info("Certificados")["version"] == 1
+    
+    # Un registro modificado y uno nuevo
+    fake.put("Certificados", "recC0001", {"pre_consecutivo": "1", "total": 999}, modified=datetime.utcnow())
+    fake.put("Certificados", "recC9999", {"pre_consecutivo": "9999", "total": 5}, modified=datetime.utcnow())
+    result = table_mirror.sync_table("Certificados", fetch_page=fake.fetch_page)
+    print(f"Incremental con cambios: {result}")
+    assert result["changed"] == 2
+    assert table_mirror.count_records("Certificados") == 251
+    assert table_mirror.get_sync_info("Certificados")["version"] == 2
+    
+    totals = {r["id"]: r["fields"]["total"] for r in table_mirror.iter_mirror_records("Certificados")}
+    assert totals["recC0001"] == 999
+
+
+def test_backfill_resumes_after_failure():
+    print("\n=== TEST: el backfill se reanuda desde el último cursor guardado ===")
+    use_temp_mirror()
+    fake = FakeAirtable(450)
+    fake.fail_after_calls = 2
+    
+    try:
+        table_mirror.sync_table("Kardex", fetch_page=fake.fetch_page)
+        raise AssertionError("se esperaba la caída simulada")
+    except ConnectionError:
+        pass
+    
+    assert table_mirror.count_records("Kardex") == 200
+    assert not table_mirror.get_sync_info("Kardex")["ready"]
+    
+    fake.fail_after_calls = None
+    fake.calls = 0
+    result = table_mirror.sync_table("Kardex", fetch_page=fake.fetch_page)
+    print(f"Backfill reanudado: {result}")
+    assert result["resumed"]
+    assert fake.calls == 3  # solo las páginas que faltaban
+    assert table_mirror.count_records("Kardex") == 450
+
+
+def test_backfill_restarts_when_offset_expired():
+    print("\n=== TEST: el backfill empieza de nuevo si el cursor expiró ===")
+    use_temp_mirror()
+    fake = FakeAirtable(300)
+    fake.fail_after_calls = 1
+    try:
+        table_mirror.sync_table("Certificados", fetch_page=fake.fetch_page)
+    except ConnectionError:
+        pass
+    
+    fake.fail_after_calls = None
+    fake.expired_offsets.add("100")
+    result = table_mirror.sync_table("Certificados", fetch_page=fake.fetch_page)
+    print(f"Backfill reiniciado: {result}")
+    assert not result["resumed"]
+    assert table_mirror.count_records("Certificados") == 300
+
+
+def test_full_backfill_removes_deleted_records():
+    print("\n=== TEST: el backfill completo elimina los registros borrados ===")
+    use_temp_mirror()
+    fake = FakeAirtable(120)
+    table_mirror.sync_table("Kardex", fetch_page=fake.fetch_page)
+    
+    fake.delete("Kardex", "recK0005")
+    result = table_mirror.sync_table("Kardex", full=True, fetch_page=fake.fetch_page)
+    print(f"Backfill completo: {result}")
+    assert result["deleted"] == 1
+    assert table_mirror.count_records("Kardex") == 119
+
+
+if __name__ == "__main__":
+    test_backfill_then_incremental()
+    test_backfill_resumes_after_failure()
+    test_backfill_restarts_when_offset_expired()
+    test_full_backfill_removes_deleted_records()
+    print("\n✅ Pruebas completadas")
@@ -0,0 +1,188 @@
+"""
+Pruebas de las instantáneas en caché (table_snapshot.py) sin conexión.
+Reemplaza la sesión compartida de airtable_client por una API simulada.
+"""
+import os
+import tempfile
+import airtable_client
+import table_mirror
+import table_snapshot
+from agent_with_context import _load_counts
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self._payload = payload
+        self.status_code = status_code
+        self.text = str(payload)
+
+    def json(self):
+        return self._payload
+
+
+class FakeSession:
+    """Responde una sola página con `count` registros de cada tabla"""
+
+    def __init__(self, count, status_code=200):
+        self.count = count
+        self.status_code = status_code
+        self.calls = []
+        self.params = []
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        table_name = url.rsplit("/", 1)[-1]
+        self.calls.append(table_name)
+        self.params.append(params or {})
+        if self.status_code != 200:
+            return FakeResponse({"error": {"message": "NOT_FOUND"}}, self.status_code)
+        limit = min(self.count, int((params or {}).get("maxRecords") or self.count))
+        records = [{"id": f"rec{i}", "fields": {"total": i, "Total": i}} for i in range(limit)]
+        return FakeResponse({"records": records})
+
+
+def use_fake_session(session):
+    saved = (airtable_client._session, os.environ.get("AIRTABLE_API_KEY"), os.environ.get("AIRTABLE_BASE_ID"))
+    airtable_client._session = session
+    os.environ["AIRTABLE_API_KEY"] = "test"
+    os.environ["AIRTABLE_BASE_ID"] = "test"
+    table_mirror.engine = table_mirror.SessionLocal = None  # sin copia local
+    table_snapshot.invalidate()
+    return saved
+
+
+def restore(saved):
+    airtable_client._session = saved[0]
+    for key, value in zip(("AIRTABLE_API_KEY", "AIRTABLE_BASE_ID"), saved[1:]):
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+    table_snapshot.invalidate()
+
+
+def test_counts_are_cached():
+    print("\n=== TEST: el conteo se reutiliza entre turnos ===")
+    session = FakeSession(40)
+    saved = use_fake_session(session)
+    try:
+        first, error = _load_counts(100)
+        second, _ = _load_counts(100)
+        assert error is None
+        assert first == second == {"Certificados": "40", "Kardex": "40"}
+        assert session.calls == ["Certificados", "Kardex"]
+
+        table_snapshot.invalidate("Kardex")
+        _load_counts(100)
+        assert session.calls == ["Certificados", "Kardex", "Kardex"]
+    finally:
+        restore(saved)
+
+
+def test_expired_snapshot_is_refreshed():
+    print("\n=== TEST: la instantánea vencida se vuelve a pedir ===")
+    session = FakeSession(10)
+    saved = use_fake_session(session)
+    saved_ttl, table_snapshot.SNAPSHOT_TTL = table_snapshot.SNAPSHOT_TTL, 0
+    try:
+        table_snapshot.get_snapshot("Certificados")
+        table_snapshot.get_snapshot("Certificados")
+        assert len(session.calls) == 2
+    finally:
+        table_snapshot.SNAPSHOT_TTL = saved_ttl
+        restore(saved)
+
+
+def test_mirror_snapshot_loads_rows_lazily():
+    print("\n=== TEST: con la copia local lista no se llama a Airtable ===")
+    session = FakeSession(0)
+    saved = use_fake_session(session)
+    table_mirror.configure(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'mirror_test.db')}")
+    records = [{"id": f"recK{i}", "createdTime": "2024-01-01T00:00:00.000Z",
+                "fields": {"idkardex": f"K{i}", "Total": i}} for i in range(30)]
+    table_mirror.sync_table("Kardex", fetch_page=lambda table_name, params, offset: (records, None))
+    try:
+        snapshot = table_snapshot.get_snapshot("Kardex", max_records=20)
+        print(f"Metadatos: {snapshot.metadata()}")
+        assert snapshot.source == "mirror"
+        assert snapshot.count == 20 and snapshot.truncated
+        assert snapshot.count_label() == "más de 20"
+        assert not snapshot.metadata()["rows_loaded"]
+
+        rows = snapshot.get_records()
+        assert len(rows) == 20
+        assert rows[0]["tabla"] == "Kardex" and rows[0]["gestor"] == "N/A"
+        assert session.calls == []
+    finally:
+        restore(saved)
+        table_mirror.engine = table_mirror.SessionLocal = None
+
+
+def test_count_is_capped_the_same_for_both_sources():
+    print("\n=== TEST: el conteo se acota igual con Airtable y con la copia local ===")
+    session = FakeSession(150)
+    saved = use_fake_session(session)
+    try:
+        snapshot = table_snapshot.get_snapshot("Certificados", max_records=100)
+        print(f"Metadatos: {snapshot.metadata()}")
+        assert snapshot.source == "airtable"
+        assert snapshot.count == 100 and snapshot.truncated
+        assert len(snapshot.get_records()) == 100
+        assert snapshot.count_label() == "más de 100"
+
+        exact = table_snapshot.get_snapshot("Kardex", max_records=150)
+        assert exact.count == 150 and not exact.truncated
+        assert exact.count_label() == "150"
+    finally:
+        restore(saved)
+
+    table_mirror.configure(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'mirror_test.db')}")
+    records = [{"id": f"rec{i}", "createdTime": "2024-01-01T00:00:00.000Z", "fields": {"total": i}} for i in range(150)]
+    table_mirror.sync_table("Certificados", fetch_page=lambda table_name, params, offset: (records, None))
+    try:
+        snapshot = table_snapshot.get_snapshot("Certificados", max_records=100)
+        assert snapshot.source == "mirror"
+        assert (snapshot.count, snapshot.truncated) == (100, True)
+    finally:
+        table_snapshot.invalidate()
+        table_mirror.engine = table_mirror.SessionLocal = None
+
+
+def test_only_agent_fields_are_requested():
+    print("\n=== TEST: se piden solo los campos que usa el agente (fields[]) ===")
+    session = FakeSession(3)
+    saved = use_fake_session(session)
+    try:
+        table_snapshot.get_snapshot("Certificados")
+        table_snapshot.get_snapshot("Kardex")
+    finally:
+        restore(saved)
+
+    certificados_fields, kardex_fields = (params["fields[]"] for params in session.params)
+    print(f"Kardex: {kardex_fields}")
+    assert "certificadopdf" not in certificados_fields
+    assert len(certificados_fields) == len(table_snapshot.CERTIFICADOS_FIELDS)
+    assert "Name (from Coordinador)" in kardex_fields
+    assert "NombreCentrodeAcopio" in kardex_fields
+
+
+def test_count_error_message():
+    print("\n=== TEST: error de Airtable al contar ===")
+    saved = use_fake_session(FakeSession(5, status_code=404))
+    try:
+        counts, error = _load_counts(100)
+    finally:
+        restore(saved)
+
+    print(f"Error: {error}")
+    assert counts is None
+    assert error == "Error consultando Certificados: Error 404: NOT_FOUND"
+
+
+if __name__ == "__main__":
+    test_counts_are_cached()
+    test_expired_snapshot_is_refreshed()
+    test_mirror_snapshot_loads_rows_lazily()
+    test_count_is_capped_the_same_for_both_sources()
+    test_only_agent_fields_are_requested()
+    test_count_error_message()
+    print("\n✅ Pruebas completadas")